@@ -31,6 +31,9 @@ from code_testing import (
     CodeProfiler, IntegrityChecker
 )
 from websocket_manager import ConnectionManager
+from usage_tracker import usage_aggregator, extract_token_count
+from latency_stats import latency_tracker
+from collaboration_messages import collaboration_messages
 import base64
 from cryptography.fernet import Fernet
 
@@ -255,22 +258,16 @@ async def generate_llm_response(
         
         execution_time = time.time() - start_time
         
-        # Update model statistics
-        model.total_requests += 1
-        model.avg_response_time = (
-            (model.avg_response_time * (model.total_requests - 1) + execution_time) 
-            / model.total_requests
+        # Model statistics and API key usage are flushed in batches by the aggregator
+        usage_aggregator.record_api_call(
+            user_id,
+            tokens=extract_token_count(response.get("usage")),
+            model_id=model.id,
+            api_key_id=api_key.id if api_key else None,
+            success=response["success"],
+            latency=execution_time
         )
-        if response["success"]:
-            model.success_rate = ((model.success_rate * (model.total_requests - 1) + 100) 
-                                 / model.total_requests)
-        db.commit()
-        
-        # Update API key usage
-        if api_key:
-            api_key.usage_count += 1
-            api_key.last_used = datetime.utcnow()
-            db.commit()
+        latency_tracker.record(model.id, model.provider, execution_time, success=response["success"])
         
         return LLMGenerateResponse(
             success=response["success"],
@@ -375,6 +372,8 @@ async def execute_code(request: CodeExecutionRequest):
         execution_time=result["execution_time"],
         memory_usage=result["memory_usage"],
         cpu_usage=result["cpu_usage"],
+        resources=result["resources"],
+        limit_exceeded=result["limit_exceeded"],
         test_results=test_results if test_results else None
     )
 
@@ -743,15 +742,18 @@ async def collaboration_websocket(websocket: WebSocket, session_id: str, db: Ses
                 )
             
             elif message["type"] == "chat":
-                # Update chat history in database
-                if session.chat_history is None:
-                    session.chat_history = []
-                session.chat_history.append({
-                    "user": message.get("user"),
-                    "message": message["data"]["message"],
-                    "timestamp": datetime.utcnow().isoformat()
-                })
-                db.commit()
+                # Buffered append to the session's message log; never rewrites history
+                try:
+                    collaboration_messages.record(
+                        session_id,
+                        message.get("user"),
+                        message["data"]["message"],
+                        data=message["data"]
+                    )
+                except ValueError as e:
+                    # Only the sender hears about a message that cannot be stored
+                    await websocket.send_text(json.dumps({"type": "error", "data": {"message": str(e)}}))
+                    continue
                 
                 # Broadcast chat message
                 await manager.broadcast_to_session(
@@ -1,41 +1,67 @@
 # Simplified API Routes without Authentication
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, Request, Query
+from fastapi.responses import Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, union
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, List, Dict, Any, Optional, Literal, Union
+from contextlib import aclosing
 import asyncio
 import json
+import time
 import uuid
 import os
+import orjson
+from dataclasses import asdict
 from cryptography.fernet import Fernet
 
-from database import SessionLocal
-from supabase_client import get_supabase_client
+from database import get_async_db
+from read_replicas import get_async_read_db
+from chat_history_store import ChatSeqConflict, chat_history_store
 from models import (
-    User, Model, TestRun, CollaborationSession, APIKey,
+    User, Model, TestRun, CollaborationSession, CollaborationSessionMessage, APIKey,
     CodeSession, PromptTemplate, ModelBenchmark,
-    UsageStatistics, ChatHistory
+    UsageStatistics, ChatHistory, ModelMarketplace
 )
 from schemas import (
-    APIKeyCreate, APIKeyResponse, ModelCreate, ModelResponse,
+    APIKeyCreate, APIKeyResponse, ModelCreate, ModelResponse, ModelSummaryResponse,
     SkynetGenerateRequest, SkynetGenerateResponse,
     CodeExecutionRequest, CodeExecutionResponse,
     CodeAnalysisRequest, CodeAnalysisResponse,
     AutoTestGenerationRequest, AutoTestGenerationResponse,
-    CodeSessionCreate, CodeSessionResponse,
+    CodeSessionCreate, CodeSessionResponse, CodeSessionSummaryResponse,
     PromptTemplateCreate, PromptTemplateResponse,
     ModelBenchmarkCreate, ModelBenchmarkResponse,
     ModelComparisonRequest, ModelComparisonResponse,
-    CollaborationSessionCreate, CollaborationSessionResponse,
-    ChatHistoryCreate, ChatHistoryUpdate, ChatHistoryResponse,
+    CollaborationSessionCreate, CollaborationSessionResponse, CollaborationSessionSummaryResponse,
+    CollaborationSessionMessageResponse,
+    ModelLatencyStatsResponse,
+    ChatHistoryCreate, ChatHistoryUpdate, ChatHistoryResponse, ChatHistorySummaryResponse,
+    ChatHistoryAppend, ChatHistoryAppendResponse, ChatHistoryMessagesResponse, ChatHistorySearchResult,
     CodeOptimizationRequest, CodeOptimizationResponse
 )
 from skynet_providers import SkynetProviderFactory, ModelProvider, ModelRegistry
 from code_testing import (
     CodeAnalyzer, UnitTestGenerator, CodeExecutor, 
-    CodeProfiler, IntegrityChecker
+    CodeProfiler, IntegrityChecker, slowest_tests
+)
+from executor_pool import ExecutionStream
+from code_jobs import (
+    BACKGROUND_PRIORITY, REQUEST_PRIORITY, STREAM_PRIORITY, CodeJobsOverloaded, code_jobs, guest_owner
 )
 from websocket_manager import ConnectionManager
+from usage_tracker import usage_aggregator, extract_token_count
+from latency_stats import latency_tracker
+from collaboration_messages import collaboration_messages
+from model_artifacts import (
+    ArtifactFileResponse, compute_etag, etag_matches, if_range_matches, parse_range, stat_artifact
+)
+from pagination import MAX_PAGE_SIZE, Page, page_params, keyset, finish_page, decode_rank_cursor, encode_rank_cursor
+from bulk_upsert import bulk_upsert
+from serialization import ORJSONResponse, response_columns, rows_response
+from http_cache import cached_response, catalog_cache
 
 # Create routers for different API sections
 skynet_router = APIRouter(tags=["Skynet"])
@@ -47,17 +73,26 @@ market_router = APIRouter(tags=["Marketplace"])
 # WebSocket manager
 manager = ConnectionManager()
 
-# Database dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # Create a default user ID for non-authenticated sessions
 DEFAULT_USER_ID = "guest-user"
 
+# ?view= on list endpoints: "summary" skips heavy text/JSON columns (fetch those by id)
+ListView = Literal["full", "summary"]
+
+# Columns each list view selects; rows map 1:1 onto the response schema fields (see serialization.py)
+MODEL_LIST_COLUMNS = {
+    "full": response_columns(Model, ModelResponse),
+    "summary": response_columns(Model, ModelSummaryResponse),
+}
+CODE_SESSION_LIST_COLUMNS = {
+    "full": response_columns(CodeSession, CodeSessionResponse),
+    "summary": response_columns(CodeSession, CodeSessionSummaryResponse),
+}
+COLLABORATION_SESSION_LIST_COLUMNS = {
+    "full": response_columns(CollaborationSession, CollaborationSessionResponse),
+    "summary": response_columns(CollaborationSession, CollaborationSessionSummaryResponse),
+}
+
 # Encryption utilities for API keys
 def get_encryption_key():
     """Get encryption key for API keys - must be set in environment"""
@@ -91,47 +126,52 @@ def decrypt_api_key(encrypted_key: str) -> str:
 cipher_suite = Fernet(get_encryption_key())
 
 # Helper function to auto-register models when API key is added
-async def auto_register_provider_models(provider: str, db: Session):
-    """Automatically register models for a provider when API key is added"""
+async def auto_register_provider_models(provider: str, db: AsyncSession) -> List[str]:
+    """Automatically register models for a provider when API key is added.
+
+    One INSERT ... ON CONFLICT DO NOTHING against the (user_id, provider,
+    model_identifier) constraint: already registered models are skipped and
+    concurrent key additions cannot create duplicates. Returns the identifiers
+    that were newly registered.
+    """
     available_models = ModelRegistry.get_available_models()
 
     if provider not in available_models:
-        return
-
-    for model_info in available_models[provider]:
-        model_id = model_info["id"]
-        model_name = model_info["name"]
-
-        # Check if model already exists
-        existing_model = db.query(Model).filter(
-            Model.user_id == DEFAULT_USER_ID,
-            Model.provider == provider,
-            Model.model_identifier == model_id
-        ).first()
-
-        if not existing_model:
-            # Create new model entry
-            new_model = Model(
-                name=model_name,
-                type="api",
-                user_id=DEFAULT_USER_ID,
-                provider=provider,
-                model_identifier=model_id,
-                status="active",
-                is_public=False,
-                description=f"{model_name} from {provider}",
-                config={"context_length": model_info.get("context", 0), "vision": model_info.get("vision", False)}
-            )
-            db.add(new_model)
+        return []
 
-    db.commit()
+    rows = [
+        {
+            "id": str(uuid.uuid4()),
+            "name": model_info["name"],
+            "type": "api",
+            "user_id": DEFAULT_USER_ID,
+            "provider": provider,
+            "model_identifier": model_info["id"],
+            "status": "active",
+            "is_public": False,
+            "description": f"{model_info['name']} from {provider}",
+            "config": {"context_length": model_info.get("context", 0), "vision": model_info.get("vision", False)},
+            "tags": [],
+            "avg_response_time": 0,
+            "total_requests": 0,
+            "success_rate": 100,
+        }
+        for model_info in available_models[provider]
+    ]
+    inserted = await bulk_upsert(
+        db, Model, rows,
+        conflict_columns=["user_id", "provider", "model_identifier"],
+        returning=["model_identifier"]
+    )
+    await db.commit()
+    return [row.model_identifier for row in inserted]
 
 # ============= Skynet API Routes =============
 
 @skynet_router.post("/api-keys", response_model=APIKeyResponse)
 async def add_api_key(
     api_key_data: APIKeyCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
 
     """Add an API key for LLM providers - No auth required"""
@@ -139,17 +179,19 @@ async def add_api_key(
     encrypted_key = encrypt_api_key(api_key_data.api_key)
 
     # Check if API key already exists for this provider
-    existing_key = db.query(APIKey).filter(
-        APIKey.user_id == DEFAULT_USER_ID,
-        APIKey.provider == api_key_data.provider
-    ).first()
+    existing_key = (await db.execute(
+        select(APIKey).where(
+            APIKey.user_id == DEFAULT_USER_ID,
+            APIKey.provider == api_key_data.provider
+        )
+    )).scalars().first()
 
     if existing_key:
         # Update existing key
         existing_key.encrypted_key = encrypted_key
         existing_key.is_active = True
-        db.commit()
-        db.refresh(existing_key)
+        await db.commit()
+        await db.refresh(existing_key)
         api_key = existing_key
     else:
         # Create new key
@@ -160,11 +202,12 @@ async def add_api_key(
             is_active=True
         )
         db.add(api_key)
-        db.commit()
-        db.refresh(api_key)
+        await db.commit()
+        await db.refresh(api_key)
 
     # Auto-register models for this provider
     await auto_register_provider_models(api_key_data.provider, db)
+    catalog_cache.invalidate()
 
     return APIKeyResponse(
         id=api_key.id,
@@ -176,9 +219,11 @@ async def add_api_key(
     )
 
 @skynet_router.get("/api-keys", response_model=List[APIKeyResponse])
-async def get_api_keys(db: Session = Depends(get_db)):
+async def get_api_keys(db: AsyncSession = Depends(get_async_read_db)):
     """Get API keys - No auth required"""
-    api_keys = db.query(APIKey).filter(APIKey.user_id == DEFAULT_USER_ID).all()
+    api_keys = (await db.execute(
+        select(APIKey).where(APIKey.user_id == DEFAULT_USER_ID)
+    )).scalars().all()
     return [
         APIKeyResponse(
             id=key.id,
@@ -191,14 +236,16 @@ async def get_api_keys(db: Session = Depends(get_db)):
     ]
 
 @skynet_router.get("/available-models")
-async def get_available_models():
+async def get_available_models(request: Request):
     """Get list of available LLM models"""
-    return ModelRegistry.get_available_models()
+    return await cached_response(
+        request, "available-models", lambda: ORJSONResponse(ModelRegistry.get_available_models())
+    )
 
 @skynet_router.post("/check-model-health")
 async def check_model_health(
     request: Dict[str, str],
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Check if a specific model is available and working"""
     provider_name = request.get("provider")
@@ -207,11 +254,13 @@ async def check_model_health(
     if not provider_name or not model_id:
         raise HTTPException(status_code=400, detail="Provider and model_id are required")
 
-    api_key_obj = db.query(APIKey).filter(
-        APIKey.user_id == DEFAULT_USER_ID,
-        APIKey.provider == provider_name,
-        APIKey.is_active == True
-    ).first()
+    api_key_obj = (await db.execute(
+        select(APIKey).where(
+            APIKey.user_id == DEFAULT_USER_ID,
+            APIKey.provider == provider_name,
+            APIKey.is_active == True
+        )
+    )).scalars().first()
 
     if not api_key_obj:
         return {
@@ -239,6 +288,7 @@ async def check_model_health(
         provider = SkynetProviderFactory.create_provider(provider_enum, decrypted_key)
 
         result = await provider.health_check(model_id)
+        usage_aggregator.record_model_test(DEFAULT_USER_ID)
         return result
 
     except Exception as e:
@@ -251,11 +301,11 @@ async def check_model_health(
 @skynet_router.post("/generate", response_model=SkynetGenerateResponse)
 async def generate_skynet_response(
     request: SkynetGenerateRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Generate response from LLM model - No auth required"""
     # Get the model
-    model = db.query(Model).filter(Model.id == request.model_id).first()
+    model = await db.get(Model, request.model_id)
     
     # Determine provider from model ID or model object
     provider_name = None
@@ -271,13 +321,16 @@ async def generate_skynet_response(
     
     if provider_name in ["openai", "anthropic", "gemini"]:
         # Try to use a provider directly
-        api_key_obj = db.query(APIKey).filter(
-            APIKey.user_id == DEFAULT_USER_ID,
-            APIKey.provider == provider_name,
-            APIKey.is_active == True
-        ).first()
+        api_key_obj = (await db.execute(
+            select(APIKey).where(
+                APIKey.user_id == DEFAULT_USER_ID,
+                APIKey.provider == provider_name,
+                APIKey.is_active == True
+            )
+        )).scalars().first()
         
         if api_key_obj:
+            start_time = time.perf_counter()
             try:
                 # Map provider name to ModelProvider enum
                 provider_enum_map = {
@@ -298,6 +351,21 @@ async def generate_skynet_response(
                     temperature=request.temperature,
                     max_tokens=request.max_tokens
                 )
+                execution_time = time.perf_counter() - start_time
+
+                # Usage accounting is write-behind; nothing is committed on this path
+                usage_aggregator.record_api_call(
+                    DEFAULT_USER_ID,
+                    tokens=extract_token_count(response.get("usage")),
+                    model_id=model.id if model else None,
+                    api_key_id=api_key_obj.id,
+                    success=response.get("success", True),
+                    latency=execution_time
+                )
+                latency_tracker.record(
+                    request.model_id, provider_name, execution_time,
+                    success=response.get("success", True)
+                )
 
                 # Check if the provider returned an error
                 if not response.get("success", True):
@@ -307,7 +375,7 @@ async def generate_skynet_response(
                         usage=None,
                         model=request.model_id,
                         error=response.get("error", "Unknown error from provider"),
-                        execution_time=0.0
+                        execution_time=execution_time
                     )
 
                 return SkynetGenerateResponse(
@@ -316,16 +384,18 @@ async def generate_skynet_response(
                     usage=response.get("usage"),
                     model=request.model_id,
                     error=None,
-                    execution_time=0.0
+                    execution_time=execution_time
                 )
             except Exception as e:
+                execution_time = time.perf_counter() - start_time
+                latency_tracker.record(request.model_id, provider_name, execution_time, success=False)
                 return SkynetGenerateResponse(
                     success=False,
                     response=None,
                     usage=None,
                     model=request.model_id,
                     error=f"Error calling {provider_name}: {str(e)}",
-                    execution_time=0.0
+                    execution_time=execution_time
                 )
         else:
             return SkynetGenerateResponse(
@@ -366,13 +436,7 @@ async def execute_custom_model(model: Model, prompt: str) -> str:
 
 # ============= Code Testing API Routes =============
 
-@code_router.post("/execute", response_model=CodeExecutionResponse)
-async def execute_code(
-    request: CodeExecutionRequest,
-    db: Session = Depends(get_db)
-):
-    """Execute Python code - No auth required"""
-    result = await CodeExecutor.execute_code(request.code)
+def code_execution_response(result: Dict[str, Any]) -> CodeExecutionResponse:
     return CodeExecutionResponse(
         success=result["success"],
         output=result["output"],
@@ -380,13 +444,134 @@ async def execute_code(
         execution_time=result["execution_time"],
         memory_usage=result["memory_usage"],
         cpu_usage=result["cpu_usage"],
+        resources=result["resources"],
+        limit_exceeded=result["limit_exceeded"],
         test_results=result.get("test_results")
     )
 
+def execution_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """A streamed execution event as sent; the result leaves out stdout, which has been streamed already"""
+    if event["type"] == "result":
+        return {"type": "result", "result": code_execution_response(event["result"]).model_dump(exclude={"output"})}
+    return event
+
+def sse_event(event_type: str, data: Dict[str, Any]) -> bytes:
+    return b"event: " + event_type.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+def event_stream(events: AsyncIterator[bytes]) -> StreamingResponse:
+    return StreamingResponse(
+        events, media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def execution_result(code: str) -> Dict[str, Any]:
+    return code_execution_response(await CodeExecutor.execute_code(code)).model_dump()
+
+@code_router.post("/execute", response_model=CodeExecutionResponse)
+async def execute_code(
+    request: CodeExecutionRequest,
+    http_request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Execute Python code - No auth required"""
+    async with code_jobs.slot(guest_owner(http_request), REQUEST_PRIORITY):
+        result = await CodeExecutor.execute_code(request.code)
+    usage_aggregator.record_code_execution(DEFAULT_USER_ID)
+    return code_execution_response(result)
+
+@code_router.post("/execute/stream")
+async def execute_code_stream(request: CodeExecutionRequest, http_request: Request):
+    """Execute Python code, streaming server-sent events as it runs - No auth required
+
+    Events are stdout and stderr chunks, resources samples, then result (or
+    cancelled). Closing the connection stops the run.
+    """
+    owner = guest_owner(http_request)
+    code_jobs.check_admission(owner)
+    usage_aggregator.record_code_execution(DEFAULT_USER_ID)
+
+    async def events():
+        try:
+            async with code_jobs.slot(owner, STREAM_PRIORITY), aclosing(CodeExecutor.stream_code(request.code)) as stream:
+                async for event in stream:
+                    event = execution_event(event)
+                    yield sse_event(event["type"], event)
+        except CodeJobsOverloaded as e:
+            # The queue filled up between the check above and the response starting
+            yield sse_event("rejected", {"type": "rejected", "detail": str(e), "retry_after": e.retry_after})
+
+    return event_stream(events())
+
+@code_router.websocket("/execute/ws")
+async def execute_code_ws(websocket: WebSocket):
+    """Execute Python code over a WebSocket - No auth required
+
+    The client sends a CodeExecutionRequest and receives the events of
+    /code/execute/stream as JSON messages. Sending {"type": "cancel"}, or
+    disconnecting, stops the run. When the execution queue is full the socket
+    is closed with 1013 (try again later).
+    """
+    await websocket.accept()
+    try:
+        request = CodeExecutionRequest(**await websocket.receive_json())
+    except WebSocketDisconnect:
+        return
+    except (ValueError, TypeError) as e:
+        await websocket.close(code=1007, reason=str(e)[:120])
+        return
+    usage_aggregator.record_code_execution(DEFAULT_USER_ID)
+    stream = ExecutionStream()
+    admitted = disconnected = False
+
+    async def execute():
+        nonlocal admitted
+        async with code_jobs.slot(guest_owner(websocket), STREAM_PRIORITY):
+            admitted = True
+            async with aclosing(CodeExecutor.stream_code(request.code, stream=stream)) as events:
+                async for event in events:
+                    await websocket.send_json(execution_event(event))
+
+    work = asyncio.create_task(execute())
+
+    async def receive_cancel():
+        nonlocal disconnected
+        while not disconnected:
+            try:
+                message = await websocket.receive_json()
+            except WebSocketDisconnect:
+                disconnected = True
+                message = {"type": "cancel"}
+            except ValueError:
+                continue
+            if isinstance(message, dict) and message.get("type") == "cancel":
+                # Still queued: give up the place; running: stop it and still send "cancelled"
+                if admitted:
+                    stream.cancel()
+                else:
+                    work.cancel()
+
+    receiver = asyncio.create_task(receive_cancel())
+    try:
+        await asyncio.wait({work})
+        if work.cancelled():
+            if not disconnected:
+                await websocket.send_json({"type": "cancelled"})
+        elif isinstance(work.exception(), CodeJobsOverloaded):
+            await websocket.close(code=1013, reason=str(work.exception())[:120])
+            return
+        else:
+            work.result()
+        if not disconnected:
+            await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        work.cancel()
+
 @code_router.post("/analyze", response_model=CodeAnalysisResponse)
 async def analyze_code(
     request: CodeAnalysisRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Analyze code complexity and quality - No auth required"""
     analysis = CodeAnalyzer.analyze_code(request.code)
@@ -402,7 +587,7 @@ async def analyze_code(
 @code_router.post("/generate-tests", response_model=AutoTestGenerationResponse)
 async def generate_tests(
     request: AutoTestGenerationRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Generate unit tests automatically with difficulty selection - No auth required"""
     # First analyze the code to get structure
@@ -435,7 +620,7 @@ async def generate_tests(
 @code_router.post("/profile")
 async def profile_code(
     request: CodeExecutionRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Profile code performance - No auth required"""
     profile_data = await CodeProfiler.profile_code(request.code)
@@ -444,12 +629,7 @@ async def profile_code(
         "success": True
     }
 
-@code_router.post("/run-tests")
-async def run_tests(
-    request: Dict[str, Any],
-    db: Session = Depends(get_db)
-):
-    """Run unit tests - No auth required"""
+async def tests_result(request: Dict[str, Any]) -> Dict[str, Any]:
     original_code = request.get("code", "")
     test_code = request.get("test_code", "")
 
@@ -457,17 +637,13 @@ async def run_tests(
 
     test_results = await CodeExecutor.run_tests(combined_code)
     return {
-        "test_results": test_results,
+        "test_results": [asdict(t) for t in test_results],
+        "slowest_tests": slowest_tests(test_results),
         "success": True,
         "output": "Tests executed"
     }
 
-@code_router.post("/run-auto-tests")
-async def run_auto_tests(
-    request: Dict[str, Any],
-    db: Session = Depends(get_db)
-):
-    """Generate and run tests automatically - No auth required"""
+async def auto_tests_result(request: Dict[str, Any]) -> Dict[str, Any]:
     code = request.get("code", "")
     difficulty = request.get("difficulty", "mid")
 
@@ -492,19 +668,116 @@ async def run_auto_tests(
 
     return {
         "test_code": test_code,
-        "test_results": test_results,
+        "test_results": [asdict(t) for t in test_results],
+        "slowest_tests": slowest_tests(test_results),
         "test_count": test_code.count("def test_"),
-        "passed": sum(1 for t in test_results if t.get("passed", False)),
-        "failed": sum(1 for t in test_results if not t.get("passed", True)),
+        "passed": sum(1 for t in test_results if t.passed),
+        "failed": sum(1 for t in test_results if not t.passed),
         "success": True
     }
 
+@code_router.post("/run-tests")
+async def run_tests(
+    request: Dict[str, Any],
+    http_request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Run unit tests - No auth required"""
+    async with code_jobs.slot(guest_owner(http_request), REQUEST_PRIORITY):
+        result = await tests_result(request)
+    usage_aggregator.record_code_execution(DEFAULT_USER_ID)
+    return result
+
+@code_router.post("/run-auto-tests")
+async def run_auto_tests(
+    request: Dict[str, Any],
+    http_request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Generate and run tests automatically - No auth required"""
+    async with code_jobs.slot(guest_owner(http_request), REQUEST_PRIORITY):
+        result = await auto_tests_result(request)
+    usage_aggregator.record_code_execution(DEFAULT_USER_ID)
+    return result
+
+# ============= Code Job Routes =============
+
+def submit_job(http_request: Request, response: Response, kind: str, run) -> Dict[str, Any]:
+    job = code_jobs.submit(kind, guest_owner(http_request), BACKGROUND_PRIORITY, run)
+    usage_aggregator.record_code_execution(DEFAULT_USER_ID)
+    response.headers["Location"] = f"/code/jobs/{job.id}"
+    return code_jobs.job_status(job)
+
+def owned_job(http_request: Request, job_id: str):
+    job = code_jobs.get(job_id)
+    if job is None or job.owner != guest_owner(http_request):
+        raise HTTPException(status_code=404, detail="Code job not found or expired")
+    return job
+
+@code_router.post("/jobs/execute", status_code=202)
+async def submit_execute_job(
+    request: CodeExecutionRequest,
+    http_request: Request,
+    response: Response
+):
+    """Queue a code execution and return its job id at once - No auth required"""
+    return submit_job(http_request, response, "execute", lambda: execution_result(request.code))
+
+@code_router.post("/jobs/run-tests", status_code=202)
+async def submit_tests_job(
+    request: Dict[str, Any],
+    http_request: Request,
+    response: Response
+):
+    """Queue a unit test run (body as for /code/run-tests) - No auth required"""
+    return submit_job(http_request, response, "run-tests", lambda: tests_result(request))
+
+@code_router.post("/jobs/run-auto-tests", status_code=202)
+async def submit_auto_tests_job(
+    request: Dict[str, Any],
+    http_request: Request,
+    response: Response
+):
+    """Queue test generation and a run (body as for /code/run-auto-tests) - No auth required"""
+    return submit_job(http_request, response, "run-auto-tests", lambda: auto_tests_result(request))
+
+@code_router.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    http_request: Request,
+    wait: float = Query(0, ge=0, le=30, description="Seconds to wait for the job to finish before answering")
+):
+    """Status of a code job, with its result once finished - No auth required"""
+    job = owned_job(http_request, job_id)
+    if wait:
+        await job.wait(wait)
+    return code_jobs.job_status(job)
+
+@code_router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, http_request: Request):
+    """Server-sent events with the job's status on each change, the last one with the result - No auth required"""
+    job = owned_job(http_request, job_id)
+
+    async def events():
+        async for update in job.updates():
+            yield sse_event(update.status, code_jobs.job_status(update))
+
+    return event_stream(events())
+
+@code_router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str, http_request: Request):
+    """Cancel a queued or running code job - No auth required"""
+    job = owned_job(http_request, job_id)
+    code_jobs.cancel(job)
+    await job.wait(5)
+    return code_jobs.job_status(job)
+
 # ============= Code Session Routes =============
 
 @code_router.post("/sessions", response_model=CodeSessionResponse)
 async def create_code_session(
     session_data: CodeSessionCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a new code session - No auth required"""
     session = CodeSession(
@@ -514,8 +787,8 @@ async def create_code_session(
         language=session_data.language
     )
     db.add(session)
-    db.commit()
-    db.refresh(session)
+    await db.commit()
+    await db.refresh(session)
     
     return CodeSessionResponse(
         id=session.id,
@@ -532,36 +805,53 @@ async def create_code_session(
         updated_at=session.updated_at
     )
 
-@code_router.get("/sessions", response_model=List[CodeSessionResponse])
-async def get_code_sessions(db: Session = Depends(get_db)):
-    """Get all code sessions - No auth required"""
-    sessions = db.query(CodeSession).filter(
-        CodeSession.user_id == DEFAULT_USER_ID
-    ).order_by(CodeSession.created_at.desc()).limit(10).all()
-    
-    return [
-        CodeSessionResponse(
-            id=s.id,
-            user_id=s.user_id,
-            name=s.name,
-            code=s.code,
-            language=s.language,
-            test_code=s.test_code,
-            analysis_result=s.analysis_result,
-            performance_metrics=s.performance_metrics,
-            integrity_check=s.integrity_check,
-            auto_tests=s.auto_tests,
-            created_at=s.created_at,
-            updated_at=s.updated_at
-        ) for s in sessions
-    ]
+def code_session_response(s: CodeSession) -> CodeSessionResponse:
+    return CodeSessionResponse(
+        id=s.id,
+        user_id=s.user_id,
+        name=s.name,
+        code=s.code,
+        language=s.language,
+        test_code=s.test_code,
+        analysis_result=s.analysis_result,
+        performance_metrics=s.performance_metrics,
+        integrity_check=s.integrity_check,
+        auto_tests=s.auto_tests,
+        created_at=s.created_at,
+        updated_at=s.updated_at
+    )
+
+@code_router.get("/sessions", response_model=List[Union[CodeSessionSummaryResponse, CodeSessionResponse]])
+async def get_code_sessions(
+    response: Response,
+    view: ListView = "full",
+    page: Page = Depends(page_params(10)),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Get code sessions newest first, one keyset page at a time - No auth required"""
+    stmt = select(*CODE_SESSION_LIST_COLUMNS[view]).where(CodeSession.user_id == DEFAULT_USER_ID)
+    sessions = (await db.execute(
+        keyset(stmt, page, CodeSession.created_at, CodeSession.id)
+    )).all()
+    sessions = finish_page(sessions, page, response)
+    return rows_response([s._asdict() for s in sessions], response)
+
+@code_router.get("/sessions/{session_id}", response_model=CodeSessionResponse)
+async def get_code_session(session_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Get one code session with its code and results - No auth required"""
+    session = (await db.execute(
+        select(CodeSession).where(CodeSession.id == session_id, CodeSession.user_id == DEFAULT_USER_ID)
+    )).scalars().first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Code session not found")
+    return code_session_response(session)
 
 # ============= Model Management Routes =============
 
 @model_router.post("/upload", response_model=ModelResponse)
 async def upload_model(
     model_data: ModelCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Upload a custom model - No auth required"""
     model = Model(
@@ -578,8 +868,16 @@ async def upload_model(
         status="uploaded"
     )
     db.add(model)
-    db.commit()
-    db.refresh(model)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail=f"Model {model_data.model_identifier} from {model_data.provider} is already registered"
+        )
+    catalog_cache.invalidate()
+    await db.refresh(model)
     
     return ModelResponse(
         id=model.id,
@@ -601,41 +899,175 @@ async def upload_model(
         success_rate=model.success_rate
     )
 
-@model_router.get("/list", response_model=List[ModelResponse])
-async def list_models(db: Session = Depends(get_db)):
-    """List all models - No auth required"""
-    models = db.query(Model).filter(
-        (Model.user_id == DEFAULT_USER_ID) | (Model.is_public == True)
-    ).all()
-    
-    return [
-        ModelResponse(
-            id=m.id,
-            name=m.name,
-            type=m.type,
-            status=m.status,
-            user_id=m.user_id,
-            provider=m.provider,
-            model_identifier=m.model_identifier,
-            created_at=m.created_at,
-            updated_at=m.updated_at,
-            file_path=m.file_path,
-            config=m.config,
-            description=m.description,
-            tags=m.tags if m.tags else [],
-            is_public=m.is_public,
-            avg_response_time=m.avg_response_time,
-            total_requests=m.total_requests,
-            success_rate=m.success_rate
-        ) for m in models
-    ]
+def model_response(m: Model) -> ModelResponse:
+    return ModelResponse(
+        id=m.id,
+        name=m.name,
+        type=m.type,
+        status=m.status,
+        user_id=m.user_id,
+        provider=m.provider,
+        model_identifier=m.model_identifier,
+        created_at=m.created_at,
+        updated_at=m.updated_at,
+        file_path=m.file_path,
+        config=m.config,
+        description=m.description,
+        tags=m.tags if m.tags else [],
+        is_public=m.is_public,
+        avg_response_time=m.avg_response_time,
+        total_requests=m.total_requests,
+        success_rate=m.success_rate,
+        latency=latency_tracker.stats(m.id)
+    )
+
+def model_row(row) -> Dict[str, Any]:
+    """A MODEL_LIST_COLUMNS row as a ModelResponse / ModelSummaryResponse dict"""
+    data = row._asdict()
+    data["tags"] = data["tags"] or []
+    data["latency"] = latency_tracker.stats(row.id)
+    return data
+
+def visible_models_query(page: Page, view: ListView = "full"):
+    """One keyset page of the guest user's models plus public models, newest first.
+
+    The two halves of the OR are paged separately so each walks its own
+    created_at-ordered index and stops after one page; only the merged ids
+    are then loaded.
+    """
+    own = keyset(
+        select(Model.id, Model.created_at).where(Model.user_id == DEFAULT_USER_ID),
+        page, Model.created_at, Model.id
+    )
+    public = keyset(
+        select(Model.id, Model.created_at).where(Model.is_public == True),
+        page, Model.created_at, Model.id
+    )
+    ids = union(own, public).subquery()
+
+    stmt = select(*MODEL_LIST_COLUMNS[view]).where(Model.id.in_(select(ids.c.id)))
+    return keyset(stmt, page, Model.created_at, Model.id)
+
+async def visible_models_page(db: AsyncSession, page: Page, view: ListView) -> List[Any]:
+    return (await db.execute(visible_models_query(page, view))).all()
+
+async def visible_models_response(
+    request: Request, response: Response, page: Page, view: ListView, db: AsyncSession
+) -> Response:
+    """One memoized page of visible models, shared by /models/list and the legacy /models"""
+    async def build():
+        models = finish_page(await visible_models_page(db, page, view), page, response)
+        return rows_response([model_row(m) for m in models], response)
+    return await cached_response(request, ("models", view, page.limit, page.after), build)
+
+@model_router.get("/list", response_model=List[Union[ModelSummaryResponse, ModelResponse]])
+async def list_models(
+    request: Request,
+    response: Response,
+    view: ListView = "full",
+    page: Page = Depends(page_params(100)),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """List models newest first, one keyset page at a time - No auth required"""
+    return await visible_models_response(request, response, page, view, db)
+
+@model_router.get("/stats", response_model=Dict[str, ModelLatencyStatsResponse])
+async def list_model_stats():
+    """Latency percentiles, error rate and throughput for every model, merged across replicas"""
+    return {
+        model_id: stats
+        for model_id, stats in latency_tracker.all_stats().items()
+        if stats is not None
+    }
+
+@model_router.get("/{model_id}/stats", response_model=ModelLatencyStatsResponse)
+async def get_model_stats(model_id: str):
+    """Latency percentiles, error rate and throughput for one model, merged across replicas"""
+    stats = latency_tracker.stats(model_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No latency data recorded for this model")
+    return stats
+
+@model_router.get("/{model_id}", response_model=ModelResponse)
+async def get_model(model_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Get one model including its config and description - No auth required"""
+    model = (await db.execute(
+        select(Model).where(
+            Model.id == model_id,
+            (Model.user_id == DEFAULT_USER_ID) | (Model.is_public == True)
+        )
+    )).scalars().first()
+    if not model:
+        raise HTTPException(status_code=404, detail="Model not found")
+    return model_response(model)
+
+@model_router.api_route("/{model_id}/download", methods=["GET", "HEAD"])
+async def download_model(
+    model_id: str,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Download a stored model artifact with Range and ETag support - No auth required"""
+    model = (await db.execute(
+        select(Model).where(
+            Model.id == model_id,
+            (Model.user_id == DEFAULT_USER_ID) | (Model.is_public == True)
+        )
+    )).scalars().first()
+
+    if not model or not model.file_path:
+        raise HTTPException(status_code=404, detail="Model artifact not found")
+
+    try:
+        stat_result = await stat_artifact(model.file_path)
+        etag = await run_in_threadpool(compute_etag, model.file_path, stat_result)
+    except PermissionError:
+        raise HTTPException(status_code=403, detail="Model artifact file is not readable")
+    except OSError:
+        # Missing, not a regular file, a path component that is not a directory, ...
+        raise HTTPException(status_code=404, detail="Model artifact file is missing")
+
+    # Clients and caches holding the current version skip the transfer entirely
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"etag": etag, "accept-ranges": "bytes"})
+
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if not if_range or if_range_matches(if_range, etag):
+        try:
+            byte_range = parse_range(request.headers.get("range"), stat_result.st_size)
+        except ValueError:
+            return Response(
+                status_code=416,
+                headers={"content-range": f"bytes */{stat_result.st_size}", "etag": etag}
+            )
+
+    is_head = request.method == "HEAD"
+
+    # Count a download once per transfer: full fetches or the first chunk of a ranged fetch
+    if not is_head and (byte_range is None or byte_range[0] == 0):
+        await db.execute(
+            update(ModelMarketplace)
+            .where(ModelMarketplace.model_id == model.id)
+            .values(downloads=ModelMarketplace.downloads + 1)
+        )
+        await db.commit()
+
+    return ArtifactFileResponse(
+        model.file_path,
+        stat_result,
+        etag,
+        byte_range=byte_range,
+        filename=os.path.basename(model.file_path),
+        send_header_only=is_head
+    )
 
 # ============= Collaboration Routes =============
 
 @collab_router.post("/create", response_model=CollaborationSessionResponse)
 async def create_collaboration_session(
     session_data: CollaborationSessionCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Create a collaboration session - No auth required"""
     session = CollaborationSession(
@@ -648,8 +1080,8 @@ async def create_collaboration_session(
         shared_models=[]
     )
     db.add(session)
-    db.commit()
-    db.refresh(session)
+    await db.commit()
+    await db.refresh(session)
     
     return CollaborationSessionResponse(
         id=session.id,
@@ -664,26 +1096,93 @@ async def create_collaboration_session(
         updated_at=session.updated_at
     )
 
-@collab_router.get("/sessions", response_model=List[CollaborationSessionResponse])
-async def get_collaboration_sessions(db: Session = Depends(get_db)):
-    """Get active collaboration sessions - No auth required"""
-    sessions = db.query(CollaborationSession).filter(
-        CollaborationSession.is_active == True
-    ).limit(10).all()
-    
+def collaboration_session_response(s: CollaborationSession) -> CollaborationSessionResponse:
+    return CollaborationSessionResponse(
+        id=s.id,
+        name=s.name,
+        session_id=s.session_id,
+        created_by=s.created_by,
+        description=s.description,
+        is_active=s.is_active,
+        participants=s.participants if s.participants else [],
+        shared_models=s.shared_models if s.shared_models else [],
+        created_at=s.created_at,
+        updated_at=s.updated_at
+    )
+
+def collaboration_session_row(row) -> Dict[str, Any]:
+    """A COLLABORATION_SESSION_LIST_COLUMNS row as a CollaborationSessionResponse / summary dict"""
+    data = row._asdict()
+    if "participants" in data:
+        data["participants"] = data["participants"] or []
+        data["shared_models"] = data["shared_models"] or []
+    return data
+
+@collab_router.get(
+    "/sessions",
+    response_model=List[Union[CollaborationSessionSummaryResponse, CollaborationSessionResponse]]
+)
+async def get_collaboration_sessions(
+    response: Response,
+    view: ListView = "full",
+    page: Page = Depends(page_params(10)),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """Get active collaboration sessions newest first, one keyset page at a time - No auth required"""
+    stmt = select(*COLLABORATION_SESSION_LIST_COLUMNS[view]).where(CollaborationSession.is_active == True)
+    sessions = (await db.execute(
+        keyset(stmt, page, CollaborationSession.created_at, CollaborationSession.id)
+    )).all()
+    sessions = finish_page(sessions, page, response)
+    return rows_response([collaboration_session_row(s) for s in sessions], response)
+
+@collab_router.get("/sessions/{session_id}", response_model=CollaborationSessionResponse)
+async def get_collaboration_session(session_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Get one collaboration session by its session ID - No auth required"""
+    session = (await db.execute(
+        select(CollaborationSession).where(CollaborationSession.session_id == session_id)
+    )).scalars().first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Collaboration session not found")
+    return collaboration_session_response(session)
+
+@collab_router.get("/sessions/{session_id}/messages", response_model=List[CollaborationSessionMessageResponse])
+async def get_collaboration_messages(
+    session_id: str,
+    after_seq: Optional[int] = Query(None, ge=0, description="Return messages after this seq, oldest first"),
+    before_seq: Optional[int] = Query(None, ge=1, description="Return the messages just before this seq"),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Page through a session's chat log in seq order - No auth required.
+
+    Without a cursor this returns the latest messages; before_seq scrolls back
+    through older history and after_seq catches up after a reconnect.
+    """
+    # Read-your-writes for messages still sitting in this worker's buffer
+    if collaboration_messages.has_pending(session_id):
+        await asyncio.to_thread(collaboration_messages.flush)
+
+    stmt = select(CollaborationSessionMessage).where(CollaborationSessionMessage.session_id == session_id)
+    if after_seq is not None:
+        stmt = stmt.where(CollaborationSessionMessage.seq > after_seq).order_by(CollaborationSessionMessage.seq)
+        messages = (await db.execute(stmt.limit(limit))).scalars().all()
+    else:
+        if before_seq is not None:
+            stmt = stmt.where(CollaborationSessionMessage.seq < before_seq)
+        stmt = stmt.order_by(CollaborationSessionMessage.seq.desc()).limit(limit)
+        messages = list(reversed((await db.execute(stmt)).scalars().all()))
+
     return [
-        CollaborationSessionResponse(
-            id=s.id,
-            name=s.name,
-            session_id=s.session_id,
-            created_by=s.created_by,
-            description=s.description,
-            is_active=s.is_active,
-            participants=s.participants if s.participants else [],
-            shared_models=s.shared_models if s.shared_models else [],
-            created_at=s.created_at,
-            updated_at=s.updated_at
-        ) for s in sessions
+        CollaborationSessionMessageResponse(
+            seq=m.seq,
+            session_id=m.session_id,
+            user_id=m.user_id,
+            message_type=m.message_type,
+            content=m.content,
+            data=m.data,
+            created_at=m.created_at
+        ) for m in messages
     ]
 
 # WebSocket for real-time collaboration
@@ -699,6 +1198,20 @@ async def websocket_endpoint(
             data = await websocket.receive_text()
             message = json.loads(data)
 
+            if message["type"] == "chat":
+                # Buffered append to the session's message log; never rewrites history
+                try:
+                    collaboration_messages.record(
+                        session_id,
+                        DEFAULT_USER_ID,
+                        message["data"].get("message"),
+                        data=message["data"]
+                    )
+                except ValueError as e:
+                    # Only the sender hears about a message that cannot be stored
+                    await websocket.send_text(json.dumps({"type": "error", "data": {"message": str(e)}}))
+                    continue
+
             await manager.broadcast_to_session(
                 session_id,
                 json.dumps({
@@ -714,111 +1227,172 @@ async def websocket_endpoint(
 
 chat_history_router = APIRouter(tags=["Chat History"])
 
+def chat_history_response(chat: Dict[str, Any]) -> ChatHistoryResponse:
+    return ChatHistoryResponse(
+        id=chat["id"],
+        user_id=chat["user_id"],
+        session_id=chat["session_id"],
+        model_id=chat.get("model_id"),
+        model_name=chat["model_name"],
+        messages=chat["messages"],
+        title=chat.get("title"),
+        created_at=chat["created_at"],
+        updated_at=chat.get("updated_at")
+    )
+
+def chat_history_summary(chat: Dict[str, Any]) -> ChatHistorySummaryResponse:
+    return ChatHistorySummaryResponse(
+        id=chat["id"],
+        user_id=chat["user_id"],
+        session_id=chat["session_id"],
+        model_id=chat.get("model_id"),
+        model_name=chat["model_name"],
+        title=chat.get("title"),
+        created_at=chat["created_at"],
+        updated_at=chat.get("updated_at")
+    )
+
 @chat_history_router.post("/chat-history", response_model=ChatHistoryResponse)
-async def create_chat_history(
-    chat_data: ChatHistoryCreate,
-    db: Session = Depends(get_db)
-):
-    """Create or update chat history using Supabase - No auth required"""
+async def create_chat_history(chat_data: ChatHistoryCreate):
+    """Create or replace a chat - No auth required"""
     try:
-        supabase = get_supabase_client()
+        chat = await chat_history_store.save(
+            DEFAULT_USER_ID,
+            chat_data.session_id,
+            chat_data.model_id,
+            chat_data.model_name,
+            chat_data.messages,
+            chat_data.title
+        )
+        return chat_history_response(chat)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error saving chat history: {str(e)}")
 
-        # Check if chat already exists
-        existing = supabase.table("chat_history").select("*").eq("session_id", chat_data.session_id).eq("user_id", DEFAULT_USER_ID).maybeSingle().execute()
+@chat_history_router.post("/chat-history/{session_id}/messages", response_model=ChatHistoryAppendResponse)
+async def append_chat_messages(session_id: str, append_data: ChatHistoryAppend):
+    """Append new messages to a chat - No auth required.
 
-        chat_data_dict = {
-            "user_id": DEFAULT_USER_ID,
-            "session_id": chat_data.session_id,
-            "model_id": chat_data.model_id,
-            "model_name": chat_data.model_name,
-            "messages": chat_data.messages,
-            "title": chat_data.title or f"Chat with {chat_data.model_name}",
-            "updated_at": datetime.utcnow().isoformat()
-        }
-
-        if existing.data:
-            # Update existing chat
-            result = supabase.table("chat_history").update(chat_data_dict).eq("session_id", chat_data.session_id).eq("user_id", DEFAULT_USER_ID).execute()
-            chat = result.data[0]
-        else:
-            # Create new chat
-            result = supabase.table("chat_history").insert(chat_data_dict).execute()
-            chat = result.data[0]
-
-        return ChatHistoryResponse(
-            id=chat["id"],
-            user_id=chat["user_id"],
-            session_id=chat["session_id"],
-            model_id=chat.get("model_id"),
-            model_name=chat["model_name"],
-            messages=chat["messages"],
-            title=chat.get("title"),
-            created_at=datetime.fromisoformat(chat["created_at"].replace("Z", "+00:00")),
-            updated_at=datetime.fromisoformat(chat["updated_at"].replace("Z", "+00:00")) if chat.get("updated_at") else None
+    Clients send only the messages added since their last save, plus expected_seq:
+    the number of messages they know are stored. A mismatch (another tab, a lost
+    response) is rejected with 409 and the stored seq so the client can resync.
+    """
+    try:
+        seq = await chat_history_store.append(
+            DEFAULT_USER_ID,
+            session_id,
+            append_data.expected_seq,
+            append_data.messages,
+            model_id=append_data.model_id,
+            model_name=append_data.model_name,
+            title=append_data.title
+        )
+        return ChatHistoryAppendResponse(session_id=session_id, seq=seq, appended=len(append_data.messages))
+    except ChatSeqConflict as e:
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Chat history changed since expected_seq", "seq": e.seq}
         )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error saving chat history: {str(e)}")
 
-@chat_history_router.get("/chat-history", response_model=List[ChatHistoryResponse])
-async def get_chat_history(db: Session = Depends(get_db)):
-    """Get all chat history using Supabase - No auth required"""
+@chat_history_router.get("/chat-history/{session_id}/messages", response_model=ChatHistoryMessagesResponse)
+async def get_chat_messages(
+    session_id: str,
+    after_seq: Optional[int] = Query(None, ge=0, description="Return messages after this seq, oldest first"),
+    before_seq: Optional[int] = Query(None, ge=1, description="Return the messages just before this seq"),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE)
+):
+    """Page through a chat's messages - No auth required.
+
+    Messages are numbered from 1 in the order they were saved. Without a cursor
+    this returns the latest messages; before_seq scrolls back through older ones.
+    """
     try:
-        supabase = get_supabase_client()
-        result = supabase.table("chat_history").select("*").eq("user_id", DEFAULT_USER_ID).order("updated_at", desc=True).limit(50).execute()
+        window = await chat_history_store.get_messages(DEFAULT_USER_ID, session_id, after_seq, before_seq, limit)
+        if window is None:
+            raise HTTPException(status_code=404, detail="Chat history not found")
+        return ChatHistoryMessagesResponse(
+            session_id=session_id,
+            seq=window.seq,
+            first_seq=window.first_seq,
+            messages=window.messages
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching chat history: {str(e)}")
+
+@chat_history_router.get(
+    "/chat-history",
+    response_model=List[Union[ChatHistorySummaryResponse, ChatHistoryResponse]]
+)
+async def get_chat_history(
+    response: Response,
+    view: ListView = "full",
+    page: Page = Depends(page_params(50))
+):
+    """Get chat history, most recently updated first, one keyset page at a time - No auth required"""
+    try:
+        chats = await chat_history_store.list_chats(DEFAULT_USER_ID, page, include_messages=view == "full")
+        chats = finish_page(chats, page, response, key=lambda chat: (chat["updated_at"], chat["id"]))
+        if view == "summary":
+            return [chat_history_summary(chat) for chat in chats]
+        return [chat_history_response(chat) for chat in chats]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching chat history: {str(e)}")
 
+@chat_history_router.get("/chat-history/search", response_model=List[ChatHistorySearchResult])
+async def search_chat_history(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=256, description='Web search syntax: words, "phrases", or, -exclude'),
+    model_id: Optional[str] = None,
+    model_name: Optional[str] = None,
+    page: Page = Depends(page_params(20, decode=decode_rank_cursor))
+):
+    """Full-text search over chat titles and messages, best match first - No auth required"""
+    if not chat_history_store.supports_search:
+        raise HTTPException(status_code=501, detail="Full-text search needs CHAT_HISTORY_BACKEND=postgres")
+    try:
+        hits = await chat_history_store.search(DEFAULT_USER_ID, q, page, model_id=model_id, model_name=model_name)
+        hits = finish_page(hits, page, response, key=lambda hit: (hit["rank"], hit["id"]), encode=encode_rank_cursor)
         return [
-            ChatHistoryResponse(
-                id=chat["id"],
-                user_id=chat["user_id"],
-                session_id=chat["session_id"],
-                model_id=chat.get("model_id"),
-                model_name=chat["model_name"],
-                messages=chat["messages"],
-                title=chat.get("title"),
-                created_at=datetime.fromisoformat(chat["created_at"].replace("Z", "+00:00")),
-                updated_at=datetime.fromisoformat(chat["updated_at"].replace("Z", "+00:00")) if chat.get("updated_at") else None
-            ) for chat in result.data
+            ChatHistorySearchResult(
+                id=hit["id"],
+                user_id=hit["user_id"],
+                session_id=hit["session_id"],
+                model_id=hit.get("model_id"),
+                model_name=hit["model_name"],
+                title=hit.get("title"),
+                created_at=hit["created_at"],
+                updated_at=hit.get("updated_at"),
+                rank=hit["rank"],
+                snippet=hit.get("snippet")
+            ) for hit in hits
         ]
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching chat history: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error searching chat history: {str(e)}")
 
 @chat_history_router.get("/chat-history/{session_id}", response_model=ChatHistoryResponse)
-async def get_chat_by_session(session_id: str, db: Session = Depends(get_db)):
-    """Get chat history by session ID using Supabase - No auth required"""
+async def get_chat_by_session(session_id: str):
+    """Get chat history by session ID - No auth required"""
     try:
-        supabase = get_supabase_client()
-        result = supabase.table("chat_history").select("*").eq("session_id", session_id).eq("user_id", DEFAULT_USER_ID).maybeSingle().execute()
-
-        if not result.data:
+        chat = await chat_history_store.get(DEFAULT_USER_ID, session_id)
+        if chat is None:
             raise HTTPException(status_code=404, detail="Chat history not found")
-
-        chat = result.data
-        return ChatHistoryResponse(
-            id=chat["id"],
-            user_id=chat["user_id"],
-            session_id=chat["session_id"],
-            model_id=chat.get("model_id"),
-            model_name=chat["model_name"],
-            messages=chat["messages"],
-            title=chat.get("title"),
-            created_at=datetime.fromisoformat(chat["created_at"].replace("Z", "+00:00")),
-            updated_at=datetime.fromisoformat(chat["updated_at"].replace("Z", "+00:00")) if chat.get("updated_at") else None
-        )
+        return chat_history_response(chat)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching chat history: {str(e)}")
 
 @chat_history_router.delete("/chat-history/{session_id}")
-async def delete_chat_history(session_id: str, db: Session = Depends(get_db)):
-    """Delete chat history by session ID using Supabase - No auth required"""
+async def delete_chat_history(session_id: str):
+    """Delete chat history by session ID - No auth required"""
     try:
-        supabase = get_supabase_client()
-        result = supabase.table("chat_history").delete().eq("session_id", session_id).eq("user_id", DEFAULT_USER_ID).execute()
-
-        if not result.data:
+        if not await chat_history_store.delete(DEFAULT_USER_ID, session_id):
             raise HTTPException(status_code=404, detail="Chat history not found")
-
         return {"success": True, "message": "Chat history deleted"}
     except HTTPException:
         raise
@@ -830,7 +1404,7 @@ async def delete_chat_history(session_id: str, db: Session = Depends(get_db)):
 @code_router.post("/optimize", response_model=CodeOptimizationResponse)
 async def optimize_code(
     request: CodeOptimizationRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Analyze code and provide optimization suggestions - No auth required"""
     analysis = CodeAnalyzer.analyze_code(request.code)
@@ -874,13 +1448,15 @@ async def optimize_code(
 @code_router.post("/generate-optimized")
 async def generate_optimized_code(
     request: CodeOptimizationRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Generate fully optimized code using LLM - No auth required"""
-    api_key_obj = db.query(APIKey).filter(
-        APIKey.user_id == DEFAULT_USER_ID,
-        APIKey.is_active == True
-    ).first()
+    api_key_obj = (await db.execute(
+        select(APIKey).where(
+            APIKey.user_id == DEFAULT_USER_ID,
+            APIKey.is_active == True
+        )
+    )).scalars().first()
 
     if not api_key_obj:
         raise HTTPException(status_code=400, detail="Please configure an API key first")
@@ -0,0 +1,58 @@
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Rows per INSERT statement; keeps bind parameters well under Postgres' 32767 limit
+BULK_UPSERT_CHUNK_SIZE = 1000
+
+def upsert_statement(
+    model,
+    rows: List[Dict[str, Any]],
+    conflict_columns: Sequence[str],
+    update_columns: Optional[Sequence[str]] = None,
+    returning: Optional[Sequence[str]] = None
+):
+    """Multi-row INSERT ... ON CONFLICT for an ORM model.
+
+    With update_columns the conflicting rows take the incoming values for those
+    columns; without, they are left untouched (DO NOTHING). returning names the
+    columns to return for the rows that were actually written.
+    """
+    stmt = insert(model).values(rows)
+    if update_columns:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(conflict_columns),
+            set_={column: stmt.excluded[column] for column in update_columns}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=list(conflict_columns))
+    if returning:
+        stmt = stmt.returning(*(model.__table__.c[column] for column in returning))
+    return stmt
+
+def _chunks(rows: List[Dict[str, Any]], size: int) -> Iterable[List[Dict[str, Any]]]:
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+async def bulk_upsert(
+    db: AsyncSession,
+    model,
+    rows: Iterable[Dict[str, Any]],
+    conflict_columns: Sequence[str],
+    update_columns: Optional[Sequence[str]] = None,
+    returning: Optional[Sequence[str]] = None,
+    chunk_size: int = BULK_UPSERT_CHUNK_SIZE
+) -> List[Any]:
+    """Insert rows set-wise, skipping or updating conflicts; one statement per chunk.
+
+    Does not commit. Returns the `returning` rows of inserted/updated records
+    (rows skipped by DO NOTHING are not returned).
+    """
+    rows = list(rows)
+    written = []
+    for chunk in _chunks(rows, chunk_size):
+        result = await db.execute(upsert_statement(model, chunk, conflict_columns, update_columns, returning))
+        if returning:
+            written.extend(result.all())
+    return written
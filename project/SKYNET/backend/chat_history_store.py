@@ -0,0 +1,616 @@
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, cast, delete, func, literal_column, select, tuple_, update
+from sqlalchemy.dialects.postgresql import JSONB, JSONPATH
+from sqlalchemy.orm import load_only
+
+from bulk_upsert import upsert_statement
+from database import AsyncSessionLocal
+from models import ChatHistory, generate_uuid
+from pagination import Page, keyset
+from supabase_client import get_supabase_client
+
+# "postgres" keeps chats in the local chat_history table; "supabase" uses the hosted
+# table through PostgREST. Defaults to Supabase only when it is configured.
+CHAT_HISTORY_BACKEND = os.getenv(
+    "CHAT_HISTORY_BACKEND",
+    "supabase" if os.getenv("VITE_SUPABASE_URL") else "postgres"
+).lower()
+
+# Seconds a write queued behind another write of the same chat waits beyond it, for
+# further writes to join; a write to a chat with nothing in flight goes out at once
+CHAT_HISTORY_COALESCE_DELAY = float(os.getenv("CHAT_HISTORY_COALESCE_DELAY", "0"))
+
+# Text search configuration; must match the one chat_history.search_vector is built with
+SEARCH_CONFIG = "english"
+
+# ts_headline options for search snippets; matches are marked as Markdown bold
+SNIPPET_OPTIONS = 'MaxFragments=2, MaxWords=24, MinWords=8, StartSel=**, StopSel=**, FragmentDelimiter=" ... "'
+
+# Searches rank at most this many of the most recently updated matching chats, so
+# broad queries cost the same as narrow ones
+CHAT_SEARCH_CANDIDATE_LIMIT = int(os.getenv("CHAT_SEARCH_CANDIDATE_LIMIT", "1000"))
+
+SUMMARY_FIELDS = ("id", "user_id", "session_id", "model_id", "model_name", "title", "created_at", "updated_at")
+FULL_FIELDS = SUMMARY_FIELDS + ("messages",)
+
+class ChatSeqConflict(Exception):
+    """An append's expected_seq does not match the number of stored messages"""
+
+    def __init__(self, seq: int):
+        super().__init__(f"Chat history has {seq} messages")
+        self.seq = seq
+
+class ChatSearchUnavailable(Exception):
+    """search() on a backend whose supports_search is False"""
+
+@dataclass
+class MessageWindow:
+    seq: int  # Total messages stored
+    first_seq: int  # seq of messages[0], numbered from 1
+    messages: List[Dict[str, Any]]
+
+def message_window(total: int, after_seq: Optional[int], before_seq: Optional[int], limit: int) -> Tuple[int, int]:
+    """Zero-based [start, end) slice for a page of messages.
+
+    after_seq pages forward from a seq; otherwise the page ends just before
+    before_seq, or at the latest message.
+    """
+    if after_seq is not None:
+        start = min(after_seq, total)
+        return start, min(start + limit, total)
+    end = min(before_seq - 1, total) if before_seq is not None else total
+    return max(end - limit, 0), end
+
+def default_title(model_name: str) -> str:
+    return f"Chat with {model_name}"
+
+def search_chats_query(
+    user_id: str,
+    text: str,
+    page: Page,
+    model_id: Optional[str] = None,
+    model_name: Optional[str] = None
+):
+    """Chats matching a web-search style query, best rank first, keyset on (rank, id).
+
+    Candidates are the CHAT_SEARCH_CANDIDATE_LIMIT most recently updated matches:
+    rare terms are found through the GIN index on search_vector, common ones by
+    walking the (user_id, updated_at) index until enough rows match. Ranks are
+    computed for the candidates only, and snippets (which re-parse the message
+    text) for the returned page only.
+    """
+    config = literal_column(f"'{SEARCH_CONFIG}'::regconfig")
+    tsquery = func.websearch_to_tsquery(config, text)
+    candidates = select(ChatHistory.id, ChatHistory.search_vector).where(
+        ChatHistory.user_id == user_id,
+        ChatHistory.search_vector.bool_op("@@")(tsquery)
+    )
+    if model_id:
+        candidates = candidates.where(ChatHistory.model_id == model_id)
+    if model_name:
+        candidates = candidates.where(ChatHistory.model_name == model_name)
+    candidates = candidates.order_by(
+        ChatHistory.updated_at.desc(), ChatHistory.id.desc()
+    ).limit(CHAT_SEARCH_CANDIDATE_LIMIT).subquery()
+
+    rank = func.ts_rank_cd(candidates.c.search_vector, tsquery)
+    hits = select(candidates.c.id, rank.label("rank"))
+    if page.after is not None:
+        hits = hits.where(tuple_(rank, candidates.c.id) < tuple_(*page.after))
+    hits = hits.order_by(rank.desc(), candidates.c.id.desc()).limit(page.limit + 1).subquery()
+
+    contents = func.jsonb_array_elements_text(
+        func.jsonb_path_query_array(ChatHistory.messages, literal_column("'$[*].content'::jsonpath"))
+    ).table_valued("value")
+    text_body = select(func.string_agg(contents.c.value, "\n")).scalar_subquery()
+    snippet = func.ts_headline(config, text_body, tsquery, SNIPPET_OPTIONS)
+
+    return (
+        select(*(getattr(ChatHistory, name) for name in SUMMARY_FIELDS), hits.c.rank, snippet.label("snippet"))
+        .join(hits, ChatHistory.id == hits.c.id)
+        .order_by(hits.c.rank.desc(), hits.c.id.desc())
+    )
+
+class ChatHistoryStore(ABC):
+    """Storage for saved playground chats.
+
+    Chats are keyed by (user_id, session_id) and handled as plain dicts with
+    the ChatHistory column names and datetime timestamps. Every method is a
+    coroutine that never blocks the event loop.
+    """
+
+    # Whether search() works; backends without full-text search leave it False
+    supports_search = False
+
+    @abstractmethod
+    async def save(
+        self,
+        user_id: str,
+        session_id: str,
+        model_id: Optional[str],
+        model_name: str,
+        messages: List[Dict[str, Any]],
+        title: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Create the chat or replace its messages; returns the stored chat"""
+
+    @abstractmethod
+    async def append(
+        self,
+        user_id: str,
+        session_id: str,
+        expected_seq: int,
+        messages: List[Dict[str, Any]],
+        model_id: Optional[str] = None,
+        model_name: Optional[str] = None,
+        title: Optional[str] = None
+    ) -> int:
+        """Append messages if exactly expected_seq are stored; returns the new count.
+
+        Raises ChatSeqConflict otherwise, and ValueError when the append would
+        create the chat without a model_name.
+        """
+
+    @abstractmethod
+    async def list_chats(self, user_id: str, page: Page, include_messages: bool = True) -> List[Dict[str, Any]]:
+        """Most recently updated first, keyset on (updated_at, id); up to page.limit + 1 chats"""
+
+    @abstractmethod
+    async def get(self, user_id: str, session_id: str) -> Optional[Dict[str, Any]]:
+        """The whole chat, or None if there is no such chat"""
+
+    @abstractmethod
+    async def get_messages(
+        self,
+        user_id: str,
+        session_id: str,
+        after_seq: Optional[int] = None,
+        before_seq: Optional[int] = None,
+        limit: int = 50
+    ) -> Optional[MessageWindow]:
+        """A page of the chat's messages (see message_window), or None if there is no such chat"""
+
+    @abstractmethod
+    async def delete(self, user_id: str, session_id: str) -> bool:
+        """Returns False if there was no such chat"""
+
+    async def search(
+        self,
+        user_id: str,
+        text: str,
+        page: Page,
+        model_id: Optional[str] = None,
+        model_name: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Summary fields plus rank and snippet, best match first; up to page.limit + 1 chats"""
+        raise ChatSearchUnavailable(f"{type(self).__name__} has no full-text search")
+
+    async def close(self):
+        """Write out anything buffered"""
+
+class PostgresChatHistoryStore(ChatHistoryStore):
+    """Chats in the local chat_history table, through the async engine.
+
+    messages is JSONB, so appends (||), message counts and page slices run in
+    SQL instead of shipping the whole array back and forth.
+    """
+
+    supports_search = True
+
+    def __init__(self, session_factory=AsyncSessionLocal):
+        self.session_factory = session_factory
+        self.table = ChatHistory.__table__
+
+    def _owner(self, user_id: str, session_id: str):
+        return and_(self.table.c.user_id == user_id, self.table.c.session_id == session_id)
+
+    @staticmethod
+    def _record(chat, fields=FULL_FIELDS) -> Dict[str, Any]:
+        return {name: getattr(chat, name) for name in fields}
+
+    async def save(self, user_id, session_id, model_id, model_name, messages, title=None):
+        row = {
+            "id": generate_uuid(),
+            "user_id": user_id,
+            "session_id": session_id,
+            "model_id": model_id,
+            "model_name": model_name,
+            "messages": messages,
+            "title": title or default_title(model_name),
+            "updated_at": func.now(),
+        }
+        stmt = upsert_statement(
+            ChatHistory, [row],
+            conflict_columns=["user_id", "session_id"],
+            update_columns=["model_id", "model_name", "messages", "title", "updated_at"],
+            returning=FULL_FIELDS
+        )
+        async with self.session_factory() as db:
+            chat = (await db.execute(stmt)).one()
+            await db.commit()
+        return self._record(chat)
+
+    async def append(self, user_id, session_id, expected_seq, messages, model_id=None, model_name=None, title=None):
+        table = self.table
+        length = func.jsonb_array_length(table.c.messages)
+        changes = {
+            "messages": table.c.messages.op("||", return_type=JSONB)(bindparam("new_messages", messages, type_=JSONB)),
+            "updated_at": func.now(),
+        }
+        if title:
+            changes["title"] = title
+
+        async with self.session_factory() as db:
+            # Compare-and-set on the stored count: of two concurrent appends only one matches
+            seq = (await db.execute(
+                update(table)
+                .where(self._owner(user_id, session_id), length == expected_seq)
+                .values(**changes)
+                .returning(length)
+            )).scalar()
+            if seq is not None:
+                await db.commit()
+                return seq
+
+            stored = await db.scalar(select(length).where(self._owner(user_id, session_id)))
+            if stored is not None or expected_seq != 0:
+                raise ChatSeqConflict(stored or 0)
+            if not model_name:
+                raise ValueError("model_name is required to start a chat")
+
+            created = (await db.execute(upsert_statement(
+                ChatHistory,
+                [{
+                    "id": generate_uuid(),
+                    "user_id": user_id,
+                    "session_id": session_id,
+                    "model_id": model_id,
+                    "model_name": model_name,
+                    "messages": messages,
+                    "title": title or default_title(model_name),
+                }],
+                conflict_columns=["user_id", "session_id"],
+                returning=["id"]
+            ))).first()
+            if created is None:
+                # Another request created the chat between the two statements
+                await db.rollback()
+                stored = await db.scalar(select(length).where(self._owner(user_id, session_id)))
+                raise ChatSeqConflict(stored or 0)
+            await db.commit()
+        return len(messages)
+
+    async def list_chats(self, user_id, page, include_messages=True):
+        fields = FULL_FIELDS if include_messages else SUMMARY_FIELDS
+        stmt = select(ChatHistory).where(ChatHistory.user_id == user_id)
+        if not include_messages:
+            stmt = stmt.options(load_only(*(getattr(ChatHistory, name) for name in SUMMARY_FIELDS)))
+        async with self.session_factory() as db:
+            chats = (await db.execute(keyset(stmt, page, ChatHistory.updated_at, ChatHistory.id))).scalars().all()
+        return [self._record(chat, fields) for chat in chats]
+
+    async def get(self, user_id, session_id):
+        async with self.session_factory() as db:
+            chat = (await db.execute(
+                select(ChatHistory).where(ChatHistory.user_id == user_id, ChatHistory.session_id == session_id)
+            )).scalar_one_or_none()
+        return self._record(chat) if chat else None
+
+    async def get_messages(self, user_id, session_id, after_seq=None, before_seq=None, limit=50):
+        table = self.table
+        async with self.session_factory() as db:
+            total = await db.scalar(
+                select(func.jsonb_array_length(table.c.messages)).where(self._owner(user_id, session_id))
+            )
+            if total is None:
+                return None
+            start, end = message_window(total, after_seq, before_seq, limit)
+            messages = []
+            if end > start:
+                path = cast(f"$[{start} to {end - 1}]", JSONPATH)
+                messages = await db.scalar(
+                    select(func.jsonb_path_query_array(table.c.messages, path)).where(self._owner(user_id, session_id))
+                ) or []
+        return MessageWindow(seq=total, first_seq=start + 1, messages=messages)
+
+    async def delete(self, user_id, session_id):
+        async with self.session_factory() as db:
+            deleted = (await db.execute(
+                delete(self.table).where(self._owner(user_id, session_id)).returning(self.table.c.id)
+            )).first()
+            await db.commit()
+        return deleted is not None
+
+    async def search(self, user_id, text, page, model_id=None, model_name=None):
+        async with self.session_factory() as db:
+            rows = (await db.execute(search_chats_query(user_id, text, page, model_id, model_name))).mappings().all()
+        return [dict(row) for row in rows]
+
+def _parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")) if value else None
+
+class SupabaseChatHistoryStore(ChatHistoryStore):
+    """Chats in the hosted Supabase chat_history table.
+
+    The Supabase client is synchronous, so each operation runs in a worker
+    thread instead of holding up the event loop for the HTTP round trip.
+    """
+
+    def __init__(self, client_factory=get_supabase_client):
+        self.client_factory = client_factory
+
+    def _table(self):
+        return self.client_factory().table("chat_history")
+
+    @staticmethod
+    def _record(chat: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            **chat,
+            "created_at": _parse_timestamp(chat.get("created_at")),
+            "updated_at": _parse_timestamp(chat.get("updated_at")),
+        }
+
+    def _find(self, user_id: str, session_id: str, fields: str = "*") -> Optional[Dict[str, Any]]:
+        result = self._table().select(fields).eq("session_id", session_id).eq("user_id", user_id).maybe_single().execute()
+        return result.data if result else None
+
+    def _save(self, user_id, session_id, model_id, model_name, messages, title):
+        data = {
+            "user_id": user_id,
+            "session_id": session_id,
+            "model_id": model_id,
+            "model_name": model_name,
+            "messages": messages,
+            "title": title or default_title(model_name),
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }
+        if self._find(user_id, session_id, "id"):
+            result = self._table().update(data).eq("session_id", session_id).eq("user_id", user_id).execute()
+        else:
+            result = self._table().insert(data).execute()
+        return self._record(result.data[0])
+
+    def _append(self, user_id, session_id, expected_seq, messages, model_id, model_name, title):
+        chat = self._find(user_id, session_id, "id,messages,updated_at")
+        stored = (chat["messages"] or []) if chat else []
+        if len(stored) != expected_seq:
+            raise ChatSeqConflict(len(stored))
+
+        now = datetime.now(timezone.utc).isoformat()
+        if chat is None:
+            if not model_name:
+                raise ValueError("model_name is required to start a chat")
+            self._table().insert({
+                "user_id": user_id,
+                "session_id": session_id,
+                "model_id": model_id,
+                "model_name": model_name,
+                "messages": messages,
+                "title": title or default_title(model_name),
+                "updated_at": now,
+            }).execute()
+        else:
+            changes = {"messages": stored + messages, "updated_at": now}
+            if title:
+                changes["title"] = title
+            # Compare-and-set on updated_at: of two concurrent appends only one matches
+            result = self._table().update(changes).eq("id", chat["id"]).eq("updated_at", chat["updated_at"]).execute()
+            if not result.data:
+                current = self._find(user_id, session_id, "messages")
+                raise ChatSeqConflict(len((current or {}).get("messages") or []))
+        return len(stored) + len(messages)
+
+    def _list(self, user_id, page, include_messages):
+        fields = "*" if include_messages else ",".join(SUMMARY_FIELDS)
+        query = self._table().select(fields).eq("user_id", user_id)
+        if page.after is not None:
+            updated_at, chat_id = page.after
+            ts = updated_at.isoformat()
+            query = query.or_(f'updated_at.lt."{ts}",and(updated_at.eq."{ts}",id.lt."{chat_id}")')
+        # One order param for both keys ("updated_at.desc,id.desc"); PostgREST ignores repeated order params
+        result = query.order("updated_at.desc,id", desc=True).limit(page.limit + 1).execute()
+        return [self._record(chat) for chat in result.data]
+
+    def _get(self, user_id, session_id):
+        chat = self._find(user_id, session_id)
+        return self._record(chat) if chat else None
+
+    def _get_messages(self, user_id, session_id, after_seq, before_seq, limit):
+        chat = self._find(user_id, session_id, "messages")
+        if not chat:
+            return None
+        messages = chat["messages"] or []
+        start, end = message_window(len(messages), after_seq, before_seq, limit)
+        return MessageWindow(seq=len(messages), first_seq=start + 1, messages=messages[start:end])
+
+    def _delete(self, user_id, session_id):
+        result = self._table().delete().eq("session_id", session_id).eq("user_id", user_id).execute()
+        return bool(result.data)
+
+    async def save(self, user_id, session_id, model_id, model_name, messages, title=None):
+        return await asyncio.to_thread(self._save, user_id, session_id, model_id, model_name, messages, title)
+
+    async def append(self, user_id, session_id, expected_seq, messages, model_id=None, model_name=None, title=None):
+        return await asyncio.to_thread(
+            self._append, user_id, session_id, expected_seq, messages, model_id, model_name, title
+        )
+
+    async def list_chats(self, user_id, page, include_messages=True):
+        return await asyncio.to_thread(self._list, user_id, page, include_messages)
+
+    async def get(self, user_id, session_id):
+        return await asyncio.to_thread(self._get, user_id, session_id)
+
+    async def get_messages(self, user_id, session_id, after_seq=None, before_seq=None, limit=50):
+        return await asyncio.to_thread(self._get_messages, user_id, session_id, after_seq, before_seq, limit)
+
+    async def delete(self, user_id, session_id):
+        return await asyncio.to_thread(self._delete, user_id, session_id)
+
+@dataclass
+class PendingWrite:
+    kind: str  # "save" or "append"
+    user_id: str
+    session_id: str
+    messages: List[Dict[str, Any]]
+    model_id: Optional[str] = None
+    model_name: Optional[str] = None
+    title: Optional[str] = None
+    expected_seq: int = 0
+    result: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+    def continues(self, expected_seq: int) -> bool:
+        return self.kind == "append" and expected_seq == self.expected_seq + len(self.messages)
+
+class CoalescingChatHistoryStore(ChatHistoryStore):
+    """Folds rapid successive writes of the same chat into one backend write.
+
+    A write to a chat with no write in flight goes to the backing store at
+    once. One that finds an earlier write of the chat still on its way waits
+    for it (and `delay` seconds more), and is pending meanwhile: further full
+    saves of that chat replace the pending messages, and appends continuing
+    the pending seq are concatenated onto it; every caller then gets the result
+    (or error) of the single combined write. Anything else
+    - a save after an append, an append that does not continue the pending one,
+    a read or delete of the chat - first writes out what is pending, so callers
+    never observe their writes reordered or missing.
+    """
+
+    def __init__(self, inner: ChatHistoryStore, delay: float = CHAT_HISTORY_COALESCE_DELAY):
+        self.inner = inner
+        self.delay = delay
+        self._pending: Dict[Tuple[str, str], PendingWrite] = {}
+        self._writing: Dict[Tuple[str, str], PendingWrite] = {}
+        self._timers = set()
+
+    @property
+    def supports_search(self) -> bool:
+        return self.inner.supports_search
+
+    def _schedule(self, write: PendingWrite) -> PendingWrite:
+        self._pending[(write.user_id, write.session_id)] = write
+        timer = asyncio.create_task(self._flush_later(write))
+        self._timers.add(timer)
+        timer.add_done_callback(self._timers.discard)
+        return write
+
+    async def _flush_later(self, write: PendingWrite):
+        writing = self._writing.get((write.user_id, write.session_id))
+        if writing is not None:
+            await asyncio.wait([writing.result])
+            if self.delay > 0:
+                await asyncio.sleep(self.delay)
+        await self._flush(write.user_id, write.session_id, write)
+
+    async def _flush(self, user_id: str, session_id: str, only: Optional[PendingWrite] = None):
+        """Write out the pending write for a chat (if it is still `only`, when given)"""
+        key = (user_id, session_id)
+        write = self._pending.get(key)
+        if only is not None and write is not only:
+            return
+        if write is None:
+            # Nothing waiting, but a write may still be on its way to the backend
+            writing = self._writing.get(key)
+            if writing is not None:
+                await asyncio.wait([writing.result])
+            return
+
+        # Writes of one chat reach the backend one at a time, in order
+        del self._pending[key]
+        previous, self._writing[key] = self._writing.get(key), write
+        if previous is not None:
+            await asyncio.wait([previous.result])
+        try:
+            if write.kind == "save":
+                result = await self.inner.save(
+                    user_id, session_id, write.model_id, write.model_name, write.messages, write.title
+                )
+            else:
+                result = await self.inner.append(
+                    user_id, session_id, write.expected_seq, write.messages,
+                    write.model_id, write.model_name, write.title
+                )
+        except Exception as e:
+            write.result.set_exception(e)
+        else:
+            write.result.set_result(result)
+        finally:
+            if self._writing.get(key) is write:
+                del self._writing[key]
+
+    async def _flush_user(self, user_id: str):
+        await asyncio.gather(*(
+            self._flush(*key) for key in list(self._pending) if key[0] == user_id
+        ))
+
+    async def save(self, user_id, session_id, model_id, model_name, messages, title=None):
+        while True:
+            write = self._pending.get((user_id, session_id))
+            if write is None:
+                write = self._schedule(PendingWrite("save", user_id, session_id, list(messages), model_id, model_name, title))
+                break
+            if write.kind == "save":
+                write.messages, write.model_id, write.model_name, write.title = list(messages), model_id, model_name, title
+                break
+            await self._flush(user_id, session_id)
+        # Shielded: a caller going away must not cancel the write other callers wait on
+        return await asyncio.shield(write.result)
+
+    async def append(self, user_id, session_id, expected_seq, messages, model_id=None, model_name=None, title=None):
+        while True:
+            write = self._pending.get((user_id, session_id))
+            if write is None:
+                write = self._schedule(PendingWrite(
+                    "append", user_id, session_id, list(messages), model_id, model_name, title, expected_seq
+                ))
+                break
+            if write.continues(expected_seq):
+                write.messages.extend(messages)
+                write.model_id = write.model_id or model_id
+                write.model_name = write.model_name or model_name
+                write.title = title or write.title
+                break
+            await self._flush(user_id, session_id)
+        # Every caller of a combined append gets the final count, their next expected_seq
+        return await asyncio.shield(write.result)
+
+    async def list_chats(self, user_id, page, include_messages=True):
+        await self._flush_user(user_id)
+        return await self.inner.list_chats(user_id, page, include_messages)
+
+    async def get(self, user_id, session_id):
+        await self._flush(user_id, session_id)
+        return await self.inner.get(user_id, session_id)
+
+    async def get_messages(self, user_id, session_id, after_seq=None, before_seq=None, limit=50):
+        await self._flush(user_id, session_id)
+        return await self.inner.get_messages(user_id, session_id, after_seq, before_seq, limit)
+
+    async def delete(self, user_id, session_id):
+        await self._flush(user_id, session_id)
+        return await self.inner.delete(user_id, session_id)
+
+    async def search(self, user_id, text, page, model_id=None, model_name=None):
+        await self._flush_user(user_id)
+        return await self.inner.search(user_id, text, page, model_id, model_name)
+
+    async def close(self):
+        await asyncio.gather(*(self._flush(*key) for key in list(self._pending)))
+        await self.inner.close()
+
+def create_chat_history_store(backend: str = CHAT_HISTORY_BACKEND) -> ChatHistoryStore:
+    if backend == "postgres":
+        store = PostgresChatHistoryStore()
+    elif backend == "supabase":
+        store = SupabaseChatHistoryStore()
+    else:
+        raise ValueError(f"Unknown CHAT_HISTORY_BACKEND {backend!r}; expected 'postgres' or 'supabase'")
+    return CoalescingChatHistoryStore(store)
+
+chat_history_store = create_chat_history_store()
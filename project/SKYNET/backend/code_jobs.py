@@ -0,0 +1,355 @@
+"""
+Admission control and a job queue for code execution.
+
+Every code execution (/code/execute, /code/run-tests, /code/run-auto-tests,
+streamed runs and jobs submitted under /code/jobs) holds one of
+CODE_JOBS_MAX_RUNNING slots while it runs. Executions beyond that wait in a
+bounded queue: higher priority classes first, in arrival order within a class,
+skipping owners that already hold CODE_JOBS_MAX_RUNNING_PER_OWNER slots. An
+execution that would overfill the queue, or put more than
+CODE_JOBS_MAX_QUEUED_PER_OWNER of one owner's executions in it, is refused at
+once with CodeJobsOverloaded (a 429 with Retry-After) instead of adding
+processes to a host that is already busy. An execution that can use more
+processes (a sharded test run) takes extra slots for them, but only slots
+that are free with nobody waiting.
+
+An owner is the user, or for guests the client address (so clients behind one
+proxy share a quota). The priority class is set by the server from how the
+caller waits for the result, never taken from the request: streamed runs
+(STREAM_PRIORITY) show output as it is produced, other requests
+(REQUEST_PRIORITY) wait for the whole result, and submitted jobs
+(BACKGROUND_PRIORITY) are polled.
+
+Submitted jobs run in the background and their results are kept for
+CODE_JOBS_RESULT_TTL seconds, for clients that poll (GET /code/jobs/{id},
+optionally waiting) or are pushed status changes (GET /code/jobs/{id}/events).
+Queue depth and wait / run time percentiles are in code_jobs.stats().
+"""
+import asyncio
+import logging
+import math
+import os
+import uuid
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Literal, Optional
+
+from starlette.requests import HTTPConnection
+
+from latency_stats import LatencySketch, summarize
+
+logger = logging.getLogger(__name__)
+
+# Code executions running at once on this worker; each is a process busy on a CPU
+CODE_JOBS_MAX_RUNNING = int(os.getenv("CODE_JOBS_MAX_RUNNING", str(os.cpu_count() or 2)))
+# Executions waiting for a slot; beyond that new ones get a 429
+CODE_JOBS_MAX_QUEUED = int(os.getenv("CODE_JOBS_MAX_QUEUED", "64"))
+# Slots one owner may hold at once, and executions one owner may have waiting
+CODE_JOBS_MAX_RUNNING_PER_OWNER = int(os.getenv("CODE_JOBS_MAX_RUNNING_PER_OWNER", "2"))
+CODE_JOBS_MAX_QUEUED_PER_OWNER = int(os.getenv("CODE_JOBS_MAX_QUEUED_PER_OWNER", "8"))
+# Seconds a finished job's result stays available, and how many finished jobs are kept at most
+CODE_JOBS_RESULT_TTL = float(os.getenv("CODE_JOBS_RESULT_TTL", "600"))
+CODE_JOBS_MAX_FINISHED = int(os.getenv("CODE_JOBS_MAX_FINISHED", "1000"))
+
+JobPriority = Literal["high", "normal", "low"]
+PRIORITIES = ("high", "normal", "low")
+STREAM_PRIORITY: JobPriority = "high"
+REQUEST_PRIORITY: JobPriority = "normal"
+BACKGROUND_PRIORITY: JobPriority = "low"
+
+def guest_owner(connection: HTTPConnection) -> str:
+    """Quota owner of an unauthenticated request or WebSocket: the client address"""
+    return f"guest:{connection.client.host}" if connection.client else "guest"
+
+class CodeJobsOverloaded(Exception):
+    """The queue, or the owner's share of it, is full; nothing was queued"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+@dataclass(eq=False)
+class _Waiter:
+    owner: str
+    priority: int
+    future: asyncio.Future
+    enqueued_at: float
+
+@dataclass(eq=False)
+class CodeJob:
+    id: str
+    kind: str
+    owner: str
+    priority: str
+    submitted_at: datetime
+    status: str = "queued"  # queued, running, succeeded, failed, cancelled
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    result: Any = None
+    error: Optional[str] = None
+    _waiter: Optional[_Waiter] = field(default=None, repr=False)
+    _task: Optional[asyncio.Task] = field(default=None, repr=False)
+    _changed: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def _update(self, status: str, **values):
+        self.status = status
+        for name, value in values.items():
+            setattr(self, name, value)
+        # Wake everyone waiting for a change; later waiters wait for the next one
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self, timeout: float):
+        """Until the job finishes or timeout seconds pass"""
+        while not self.finished:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                return
+
+    async def updates(self) -> AsyncIterator["CodeJob"]:
+        """The job now and after each status change, until it finishes"""
+        while True:
+            changed = self._changed
+            yield self
+            if self.finished:
+                return
+            await changed.wait()
+
+class CodeJobScheduler:
+    """Execution slots with a bounded priority queue and per-owner quotas, plus background jobs"""
+
+    def __init__(
+        self,
+        max_running: int = CODE_JOBS_MAX_RUNNING,
+        max_queued: int = CODE_JOBS_MAX_QUEUED,
+        max_running_per_owner: int = CODE_JOBS_MAX_RUNNING_PER_OWNER,
+        max_queued_per_owner: int = CODE_JOBS_MAX_QUEUED_PER_OWNER,
+        result_ttl: float = CODE_JOBS_RESULT_TTL,
+        max_finished: int = CODE_JOBS_MAX_FINISHED
+    ):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.max_running_per_owner = max_running_per_owner
+        self.max_queued_per_owner = max_queued_per_owner
+        self.result_ttl = result_ttl
+        self.max_finished = max_finished
+        self._waiting: List[Deque[_Waiter]] = [deque() for _ in PRIORITIES]
+        self._running: Dict[str, int] = {}
+        self._queued: Dict[str, int] = {}
+        self.running = 0
+        self.jobs: "OrderedDict[str, CodeJob]" = OrderedDict()
+        self.wait_times = LatencySketch()
+        self.run_times = LatencySketch()
+        self.window_start = datetime.now(timezone.utc)
+        self.admitted = 0
+        self.rejected = {"queue_full": 0, "owner_quota": 0}
+        self.outcomes = {"succeeded": 0, "failed": 0, "cancelled": 0}
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiting) for waiting in self._waiting)
+
+    def _retry_after(self) -> int:
+        """Seconds until the queue has likely moved on enough for a new execution to be admitted"""
+        mean_run = self.run_times.sum / self.run_times.count if self.run_times.count else 1.0
+        return max(1, math.ceil(mean_run * (self.queued + 1) / max(self.max_running, 1)))
+
+    def check_admission(self, owner: str):
+        """Raise CodeJobsOverloaded if an execution for owner would be refused now"""
+        if self.queued >= self.max_queued:
+            self.rejected["queue_full"] += 1
+            raise CodeJobsOverloaded("Too many code executions are waiting; try again later", self._retry_after())
+        if self._queued.get(owner, 0) >= self.max_queued_per_owner:
+            self.rejected["owner_quota"] += 1
+            raise CodeJobsOverloaded(
+                f"You already have {self.max_queued_per_owner} code executions waiting; try again later",
+                self._retry_after()
+            )
+
+    def _enqueue(self, owner: str, priority: str) -> _Waiter:
+        self.check_admission(owner)
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(owner, PRIORITIES.index(priority), loop.create_future(), loop.time())
+        self._waiting[waiter.priority].append(waiter)
+        self._queued[owner] = self._queued.get(owner, 0) + 1
+        self._admit()
+        return waiter
+
+    def _dequeue(self, waiter: _Waiter):
+        self._waiting[waiter.priority].remove(waiter)
+        self._queued[waiter.owner] -= 1
+        if not self._queued[waiter.owner]:
+            del self._queued[waiter.owner]
+
+    def _admit(self):
+        """Hand free slots to the first waiters, by priority then arrival, whose owners are under quota"""
+        while self.running < self.max_running:
+            waiter = next(
+                # A cancelled waiter leaves the queue itself once its task runs again
+                (waiter for waiting in self._waiting for waiter in waiting
+                 if not waiter.future.done() and self._running.get(waiter.owner, 0) < self.max_running_per_owner),
+                None
+            )
+            if waiter is None:
+                return
+            self._dequeue(waiter)
+            self.running += 1
+            self._running[waiter.owner] = self._running.get(waiter.owner, 0) + 1
+            self.admitted += 1
+            self.wait_times.add(asyncio.get_running_loop().time() - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+    def _release(self, owner: str):
+        self.running -= 1
+        self._running[owner] -= 1
+        if not self._running[owner]:
+            del self._running[owner]
+        self._admit()
+
+    def position(self, waiter: _Waiter) -> Optional[int]:
+        """1-based place in the queue: waiters of a higher class, then of the same class that came earlier"""
+        if waiter.future.done():
+            return None  # admitted
+        ahead = sum(len(waiting) for waiting in self._waiting[:waiter.priority])
+        for other in self._waiting[waiter.priority]:
+            if other is waiter:
+                break
+            ahead += 1
+        return ahead + 1
+
+    @asynccontextmanager
+    async def _holding(self, waiter: _Waiter):
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(waiter.owner)  # admitted just as the caller was cancelled
+            else:
+                self._dequeue(waiter)
+            raise
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            yield
+        finally:
+            self.run_times.add(loop.time() - started)
+            self._release(waiter.owner)
+
+    @asynccontextmanager
+    async def slot(self, owner: str, priority: JobPriority = "normal"):
+        """Hold an execution slot, waiting in the queue for one if needed; raises CodeJobsOverloaded"""
+        async with self._holding(self._enqueue(owner, priority)):
+            yield
+
+    @asynccontextmanager
+    async def extra_slots(self, wanted: int) -> AsyncIterator[int]:
+        """Take up to wanted more slots that are free right now, for an execution that already
+        holds one and can spread over more processes; yields how many it got, possibly 0.
+
+        Never waits, and takes nothing while any execution is queued.
+        """
+        waiting = any(not waiter.future.done() for waiting in self._waiting for waiter in waiting)
+        taken = 0 if waiting else max(0, min(wanted, self.max_running - self.running))
+        self.running += taken
+        try:
+            yield taken
+        finally:
+            self.running -= taken
+            if taken:
+                self._admit()
+
+    def submit(self, kind: str, owner: str, priority: JobPriority, run: Callable[[], Awaitable[Any]]) -> CodeJob:
+        """Queue run() as a background job; raises CodeJobsOverloaded"""
+        self._prune()
+        waiter = self._enqueue(owner, priority)
+        job = CodeJob(uuid.uuid4().hex, kind, owner, priority, datetime.now(timezone.utc), _waiter=waiter)
+        self.jobs[job.id] = job
+        job._task = asyncio.create_task(self._run_job(job, run))
+        return job
+
+    async def _run_job(self, job: CodeJob, run: Callable[[], Awaitable[Any]]):
+        try:
+            async with self._holding(job._waiter):
+                job._waiter = None
+                job._update("running", started_at=datetime.now(timezone.utc))
+                result = await run()
+        except asyncio.CancelledError:
+            self._finish(job, "cancelled")
+        except Exception as e:
+            logger.exception("Code job %s (%s) failed", job.id, job.kind)
+            self._finish(job, "failed", error=str(e))
+        else:
+            self._finish(job, "succeeded", result=result)
+
+    def _finish(self, job: CodeJob, status: str, **values):
+        job._waiter = None
+        self.outcomes[status] += 1
+        job._update(status, finished_at=datetime.now(timezone.utc), **values)
+
+    def get(self, job_id: str) -> Optional[CodeJob]:
+        self._prune()
+        return self.jobs.get(job_id)
+
+    def cancel(self, job: CodeJob):
+        """Take a queued job out of the queue, or stop a running one and kill its process group"""
+        if not job.finished and job._task is not None:
+            job._task.cancel()
+
+    def _prune(self):
+        now = datetime.now(timezone.utc)
+        finished = [job for job in self.jobs.values() if job.finished]
+        for i, job in enumerate(finished):
+            if len(finished) - i > self.max_finished or (now - job.finished_at).total_seconds() > self.result_ttl:
+                del self.jobs[job.id]
+
+    def job_status(self, job: CodeJob) -> Dict[str, Any]:
+        return {
+            "job_id": job.id,
+            "kind": job.kind,
+            "status": job.status,
+            "priority": job.priority,
+            "position": self.position(job._waiter) if job._waiter is not None else None,
+            "submitted_at": job.submitted_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+            "wait_time": ((job.started_at or job.finished_at or datetime.now(timezone.utc)) - job.submitted_at).total_seconds(),
+            "run_time": ((job.finished_at or datetime.now(timezone.utc)) - job.started_at).total_seconds()
+                        if job.started_at else None,
+            "result": job.result,
+            "error": job.error,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        now = asyncio.get_running_loop().time()
+        oldest = min((waiter.enqueued_at for waiting in self._waiting for waiter in waiting), default=None)
+        return {
+            "running": self.running,
+            "max_running": self.max_running,
+            "queued": self.queued,
+            "max_queued": self.max_queued,
+            "queued_by_priority": {name: len(waiting) for name, waiting in zip(PRIORITIES, self._waiting)},
+            "oldest_queued_seconds": now - oldest if oldest is not None else None,
+            "owners_running": len(self._running),
+            "owners_queued": len(self._queued),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "jobs": {"kept": len(self.jobs), **self.outcomes},
+            "wait_time": summarize(self.wait_times, self.window_start),
+            "run_time": summarize(self.run_times, self.window_start),
+        }
+
+    async def stop(self):
+        """Cancel jobs still queued or running; their process groups are killed"""
+        tasks = [job._task for job in self.jobs.values() if job._task is not None and not job._task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+code_jobs = CodeJobScheduler()
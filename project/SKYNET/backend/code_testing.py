@@ -7,12 +7,17 @@ import unittest
 import tempfile
 import os
 import subprocess
-from typing import Dict, Any, List, Optional, Tuple
-from contextlib import redirect_stdout, redirect_stderr
+from typing import AsyncIterator, Dict, Any, List, Optional, Tuple
+from contextlib import aclosing, redirect_stdout, redirect_stderr
 import json
 import psutil
 import asyncio
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass, replace
+
+from code_jobs import code_jobs
+from executor_pool import ExecutionLimits, ExecutionStream, ProcessOutput, ProcessTimeout, executor_pool
+from sandbox_client import sandbox_client
+from test_shards import CODE_TEST_WORKERS, collect_units, plan_shards, record_durations
 
 @dataclass
 class TestResult:
@@ -20,6 +25,11 @@ class TestResult:
     passed: bool
     error_message: Optional[str]
     execution_time: float
+    # "passed", "failed", "error", "skipped", "expected_failure", "unexpected_success" or "timeout"
+    status: str = "passed"
+    # What the test printed, and the traceback of a failure or error
+    output: str = ""
+    traceback: Optional[str] = None
     
 @dataclass
 class PerformanceMetrics:
@@ -279,11 +289,82 @@ class UnitTestGenerator:
             
         return tests
 
+# Appended to the error of a run that a limit stopped
+LIMIT_MESSAGES = {
+    "cpu_time": "CPU time limit exceeded ({limits.cpu_seconds} seconds)",
+    "memory": "Memory limit exceeded ({limits.memory_mb} MB)",
+    "file_size": "File size limit exceeded ({limits.file_size_mb} MB)",
+    "processes": "Process limit exceeded ({limits.processes} processes)",
+}
+
+# Run by test_runner.py ahead of the test code, so run_tests gets a record per test
+TEST_RUNNER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_runner.py")
+# Test statuses that count as passing
+PASSING_STATUSES = ("passed", "skipped", "expected_failure")
+# Tests listed by slowest_tests()
+SLOWEST_TESTS = int(os.getenv("CODE_TESTS_SLOWEST", "5"))
+# Seconds one test may run before it is stopped and reported as timed out; 0 for no limit
+CODE_TEST_TIMEOUT = float(os.getenv("CODE_TEST_TIMEOUT", "10"))
+
+_test_runner_source: Optional[str] = None
+
+def test_script(test_code: str, include: Optional[List[str]] = None, exclude: Optional[List[str]] = None,
+                test_timeout: float = CODE_TEST_TIMEOUT) -> str:
+    """A script that runs test_code under test_runner.py, which writes a report next to it"""
+    global _test_runner_source
+    if _test_runner_source is None:
+        with open(TEST_RUNNER_SCRIPT) as f:
+            _test_runner_source = f.read()
+    return (
+        f"{_test_runner_source}\n\n"
+        f"sys.exit(run_tests({test_code!r}, __file__ + '.report.json', {include!r}, {exclude!r}, {test_timeout!r}))\n"
+    )
+
+def slowest_tests(test_results: List[TestResult], count: int = SLOWEST_TESTS) -> List[Dict[str, Any]]:
+    """The count slowest tests, slowest first"""
+    timed = sorted((t for t in test_results if t.execution_time > 0), key=lambda t: t.execution_time, reverse=True)
+    return [
+        {"test_name": t.test_name, "execution_time": t.execution_time, "status": t.status}
+        for t in timed[:count]
+    ]
+
 class CodeExecutor:
     """Executes Python code safely and measures performance"""
     
     @staticmethod
-    async def execute_code(code: str, timeout: int = 10) -> Dict[str, Any]:
+    async def run_code(code: str, timeout: float, limits: Optional[ExecutionLimits] = None,
+                       stream: Optional[ExecutionStream] = None, suffix: str = ".py",
+                       report: bool = False) -> ProcessOutput:
+        """Run code on a sandbox replica when SANDBOX_URLS is set, otherwise from the local executor pool.
+        
+        With report, the output carries what the script wrote to "<script>.report.json".
+        """
+        limits = limits or ExecutionLimits()
+        if sandbox_client.enabled:
+            return await sandbox_client.run(code, timeout, limits, stream, report)
+        
+        # Create a temporary file for the code
+        with tempfile.NamedTemporaryFile(mode='w', suffix=suffix, delete=False) as f:
+            f.write(code)
+            temp_file = f.name
+        report_file = temp_file + ".report.json"
+        try:
+            completed = await executor_pool.run(temp_file, timeout, limits, stream)
+            if report and os.path.exists(report_file):
+                if not limits.output_bytes or os.path.getsize(report_file) <= limits.output_bytes:
+                    try:
+                        with open(report_file) as f:
+                            completed.report = json.load(f)
+                    except ValueError:
+                        pass  # the script wrote something else there
+            return completed
+        finally:
+            for path in (temp_file, report_file):
+                if os.path.exists(path):
+                    os.remove(path)
+    
+    @staticmethod
+    async def execute_code(code: str, timeout: int = 10, stream: Optional[ExecutionStream] = None) -> Dict[str, Any]:
         """Execute Python code with timeout and resource monitoring"""
         
         result = {
@@ -292,173 +373,163 @@ class CodeExecutor:
             "execution_time": 0,
             "memory_usage": 0,
             "cpu_usage": 0,
+            "resources": None,
+            "limit_exceeded": None,
             "test_results": []
         }
-        
-        # Create a temporary file for the code
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-            f.write(code)
-            temp_file = f.name
+        limits = ExecutionLimits()
         
         try:
-            # Get initial memory usage
-            process = psutil.Process()
-            initial_memory = process.memory_info().rss / 1024 / 1024  # MB
-            
             # Execute the code with timeout
-            start_time = time.time()
-            
-            proc = subprocess.Popen(
-                [sys.executable, temp_file],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
             try:
-                stdout, stderr = proc.communicate(timeout=timeout)
-                execution_time = time.time() - start_time
-                
-                # Get final memory usage
-                final_memory = process.memory_info().rss / 1024 / 1024  # MB
-                memory_usage = final_memory - initial_memory
+                completed = await CodeExecutor.run_code(code, timeout, limits, stream)
+                result["error"] = completed.stderr if completed.stderr else None
+                result["success"] = completed.returncode == 0
+                if completed.limit_exceeded in LIMIT_MESSAGES:
+                    message = LIMIT_MESSAGES[completed.limit_exceeded].format(limits=limits)
+                    result["error"] = f"{result['error'] or ''}{message}"
                 
-                result["output"] = stdout
-                result["error"] = stderr if stderr else None
-                result["execution_time"] = execution_time
-                result["memory_usage"] = max(0, memory_usage)
-                result["success"] = proc.returncode == 0
-                
-            except subprocess.TimeoutExpired:
-                proc.kill()
+            except ProcessTimeout as e:
+                completed = e.output
                 result["error"] = f"Execution timeout ({timeout} seconds)"
                 result["success"] = False
+            
+            # Resource usage of the script's own process, not of this server
+            result["output"] = completed.stdout
+            result["execution_time"] = completed.execution_time
+            result["limit_exceeded"] = completed.limit_exceeded
+            if completed.resources is not None:
+                result["memory_usage"] = completed.resources.peak_rss_mb
+                result["cpu_usage"] = completed.resources.cpu_percent
+                result["resources"] = asdict(completed.resources)
                 
         except Exception as e:
             result["error"] = str(e)
             result["success"] = False
-            
-        finally:
-            # Clean up temp file
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
         
         return result
     
     @staticmethod
-    async def run_tests(test_code: str) -> List[TestResult]:
-        """Run unit tests and return results"""
-        
-        test_results = []
-        
-        # Create temporary file for test code
-        with tempfile.NamedTemporaryFile(mode='w', suffix='_test.py', delete=False) as f:
-            f.write(test_code)
-            temp_file = f.name
-        
+    async def stream_code(code: str, timeout: int = 10,
+                          stream: Optional[ExecutionStream] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Execute like execute_code, yielding stdout / stderr chunks and resource samples as they
+        happen and execute_code's result last; stream.cancel() or closing the iterator stops the run"""
+        stream = stream or ExecutionStream()
+        run = asyncio.create_task(CodeExecutor.execute_code(code, timeout, stream))
+        async with aclosing(stream.events(run)) as events:
+            async for event in events:
+                yield event
+    
+    @staticmethod
+    async def _run_test_shard(script: str, timeout: int,
+                              limits: ExecutionLimits) -> Tuple[Optional[ProcessOutput], Optional[TestResult]]:
+        """Run one test script; returns its output, or a failed result saying why it has no report"""
         try:
-            # Run the tests directly using the test file
-            proc = subprocess.Popen(
-                [sys.executable, temp_file],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            stdout, stderr = proc.communicate(timeout=30)
-            
-            # Parse test results from stdout and stderr
-            output = stdout + stderr
-            
-            # Check for test execution patterns
-            if "Ran " in output:
-                # Extract test count
-                import re
-                match = re.search(r'Ran (\d+) tests?', output)
-                if match:
-                    total_tests = int(match.group(1))
-                    
-                    # Check for failures
-                    if "FAILED" in output or "ERROR" in output:
-                        failed_match = re.search(r'FAILED \(.*?failures=(\d+).*?\)', output)
-                        error_match = re.search(r'FAILED \(.*?errors=(\d+).*?\)', output)
-                        
-                        failures = int(failed_match.group(1)) if failed_match else 0
-                        errors = int(error_match.group(1)) if error_match else 0
-                        failed_count = failures + errors
-                        passed_count = total_tests - failed_count
-                        
-                        # Add passed tests
-                        for i in range(passed_count):
-                            test_results.append(TestResult(
-                                test_name=f"Test_{i+1}",
-                                passed=True,
-                                error_message=None,
-                                execution_time=0
-                            ))
-                        
-                        # Add failed tests
-                        for i in range(failed_count):
-                            test_results.append(TestResult(
-                                test_name=f"Test_{passed_count+i+1}",
-                                passed=False,
-                                error_message="Test failed - check implementation",
-                                execution_time=0
-                            ))
-                    elif "OK" in output:
-                        # All tests passed
-                        for i in range(total_tests):
-                            test_results.append(TestResult(
-                                test_name=f"Test_{i+1}",
-                                passed=True,
-                                error_message=None,
-                                execution_time=0
-                            ))
-                else:
-                    # Couldn't parse test count
-                    test_results.append(TestResult(
-                        test_name="Test Execution",
-                        passed=False,
-                        error_message="Could not parse test results",
-                        execution_time=0
-                    ))
-            else:
-                # No tests were run or error in test file
-                test_results.append(TestResult(
-                    test_name="Test Execution",
-                    passed=False,
-                    error_message=output if output else "No tests were executed",
-                    execution_time=0
-                ))
-                        
-        except subprocess.TimeoutExpired:
-            test_results.append(TestResult(
+            completed = await CodeExecutor.run_code(script, timeout, limits, suffix='_test.py', report=True)
+        except ProcessTimeout as e:
+            return None, TestResult(
                 test_name="Test Execution",
                 passed=False,
-                error_message="Test execution timed out (30 seconds)",
-                execution_time=0
-            ))
+                error_message=f"Test execution timed out ({timeout} seconds)",
+                execution_time=e.output.execution_time,
+                status="timeout",
+                output=e.output.stdout + e.output.stderr
+            )
         except Exception as e:
-            test_results.append(TestResult(
+            return None, TestResult(
                 test_name="Test Execution",
                 passed=False,
                 error_message=str(e),
-                execution_time=0
-            ))
-            
-        finally:
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
+                execution_time=0,
+                status="error"
+            )
+        
+        if completed.report is None:
+            # The runner was killed (or never started) before writing its report
+            output = completed.stdout + completed.stderr
+            if completed.limit_exceeded in LIMIT_MESSAGES:
+                output += LIMIT_MESSAGES[completed.limit_exceeded].format(limits=limits)
+            return None, TestResult(
+                test_name="Test Execution",
+                passed=False,
+                error_message=output or "No test results available",
+                execution_time=completed.execution_time,
+                status="error",
+                output=output
+            )
+        return completed, None
+    
+    @staticmethod
+    async def run_tests(test_code: str, timeout: int = 30, workers: int = CODE_TEST_WORKERS) -> List[TestResult]:
+        """Run unit tests under test_runner.py and return a result per test.
+        
+        A suite long enough to be worth it is split into up to workers shards
+        (test_shards.py) that run in parallel, each in its own process with the
+        full timeout. The caller's code_jobs slot covers the first shard; each
+        further one needs a free slot of its own, so admission control still
+        bounds the processes running.
+        """
+        limits = ExecutionLimits()
+        units = collect_units(test_code)
+        wanted = len(plan_shards(units, workers))
+        async with code_jobs.extra_slots(wanted - 1) as extra:
+            shards = plan_shards(units, 1 + extra)
+            if len(shards) > 1:
+                names = [[unit.name for unit in shard] for shard in shards]
+                # The first shard also takes whatever tests collect_units could not see
+                scripts = [test_script(test_code, exclude=[name for shard in names[1:] for name in shard])]
+                scripts += [test_script(test_code, include=shard) for shard in names[1:]]
+            else:
+                scripts = [test_script(test_code)]
+            runs = await asyncio.gather(*(CodeExecutor._run_test_shard(script, timeout, limits) for script in scripts))
         
-        # If no test results were generated, add a default failure
-        if not test_results:
+        test_results: List[TestResult] = []
+        error = None
+        for shard, (completed, failure) in zip(shards, runs):
+            if failure is not None:
+                # Blame every test of the shard when they are known
+                test_results += [
+                    replace(failure, test_name=unit.name, execution_time=0) for unit in shard
+                ] or [failure]
+                continue
+            test_results += [
+                TestResult(
+                    test_name=test["name"],
+                    passed=test["status"] in PASSING_STATUSES,
+                    error_message=test["message"],
+                    execution_time=test["duration"],
+                    status=test["status"],
+                    output=test["output"],
+                    traceback=test["traceback"]
+                )
+                for test in completed.report["tests"]
+            ]
+            # Every shard runs the module, so a module-level error shows up in each
+            if completed.report["error"] and error is None:
+                error = TestResult(
+                    test_name="Test Execution",
+                    passed=False,
+                    error_message=completed.report["error"].rstrip().splitlines()[-1],
+                    execution_time=0,
+                    status="error",
+                    output=completed.stdout,
+                    traceback=completed.report["error"]
+                )
+            record_durations(units, {test["name"]: test["duration"] for test in completed.report["tests"]})
+        
+        if len(shards) > 1:
+            # The order a single process would have run them in
+            test_results.sort(key=lambda t: t.test_name)
+        if error is not None:
+            test_results.append(error)
+        elif not test_results:
             test_results.append(TestResult(
                 test_name="Test Execution",
                 passed=False,
-                error_message="No test results available",
-                execution_time=0
+                error_message="No tests were executed",
+                execution_time=0,
+                status="error"
             ))
-        
         return test_results
 
 class CodeProfiler:
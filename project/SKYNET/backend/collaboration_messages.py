@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert, update
+
+from database import TRANSIENT_ERRORS, SessionLocal
+from models import CollaborationSession, CollaborationSessionMessage, generate_uuid
+
+logger = logging.getLogger(__name__)
+
+# Seconds between batched inserts of buffered chat messages
+COLLAB_MESSAGE_FLUSH_INTERVAL = float(os.getenv("COLLAB_MESSAGE_FLUSH_INTERVAL", "0.25"))
+
+@dataclass
+class PendingMessage:
+    user_id: Optional[str]
+    message_type: str
+    content: Optional[str]
+    data: Optional[Dict[str, Any]]
+    created_at: datetime
+
+class CollaborationMessageWriter:
+    """Write-behind appender for collaboration chat messages.
+
+    WebSocket handlers record messages in memory and broadcast immediately; a
+    background task inserts everything buffered since the last flush. Per
+    session, one UPDATE ... RETURNING reserves a block of sequence numbers on
+    collaboration_sessions.message_seq (safe across workers) and one multi-row
+    INSERT appends the messages, so a session's cost no longer grows with the
+    length of its history.
+
+    A batch that fails for any other reason than a transient error is written
+    again one session at a time, and a session that still fails one message at
+    a time; messages that cannot be written are logged and dropped, so one bad
+    message never holds back the others.
+    """
+
+    def __init__(self, session_factory=SessionLocal, flush_interval: float = COLLAB_MESSAGE_FLUSH_INTERVAL):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending: Dict[str, List[PendingMessage]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def record(
+        self,
+        session_id: str,
+        user_id: Optional[str],
+        content: Optional[str],
+        message_type: str = "chat",
+        data: Optional[Dict[str, Any]] = None
+    ):
+        """Buffer one message for the next flush; ValueError for content Postgres cannot store"""
+        if content is not None and not isinstance(content, str):
+            raise ValueError(f"Message content must be a string, not {type(content).__name__}")
+        if content and "\x00" in content:
+            raise ValueError("Message content must not contain NUL characters")
+        message = PendingMessage(user_id, message_type, content, data, datetime.now(timezone.utc))
+        with self._lock:
+            self._pending.setdefault(session_id, []).append(message)
+
+    def has_pending(self, session_id: str) -> bool:
+        with self._lock:
+            return bool(self._pending.get(session_id))
+
+    def _swap(self) -> Dict[str, List[PendingMessage]]:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def _restore(self, pending: Dict[str, List[PendingMessage]]):
+        """Put an unflushed batch back ahead of anything recorded since"""
+        with self._lock:
+            for session_id, messages in pending.items():
+                self._pending[session_id] = messages + self._pending.get(session_id, [])
+
+    def flush(self):
+        """Append all buffered messages, in one transaction unless that fails (blocking)"""
+        pending = self._swap()
+        if not pending:
+            return
+        try:
+            self._write(pending)
+        except TRANSIENT_ERRORS:
+            self._restore(pending)
+            logger.exception("Failed to append collaboration messages; will retry on next interval")
+        except Exception:
+            logger.exception("Failed to append collaboration messages; writing them one session at a time")
+            self._write_each(pending)
+
+    def _write_each(self, pending: Dict[str, List[PendingMessage]]):
+        sessions = list(pending.items())
+        for index, (session_id, messages) in enumerate(sessions):
+            try:
+                self._write({session_id: messages})
+                continue
+            except TRANSIENT_ERRORS:
+                self._restore(dict(sessions[index:]))
+                logger.exception("Failed to append collaboration messages; will retry on next interval")
+                return
+            except Exception:
+                if len(messages) == 1:
+                    logger.exception("Dropping a collaboration message for session %s that cannot be written", session_id)
+                    continue
+            for position, message in enumerate(messages):
+                try:
+                    self._write({session_id: [message]})
+                except TRANSIENT_ERRORS:
+                    self._restore({session_id: messages[position:], **dict(sessions[index + 1:])})
+                    logger.exception("Failed to append collaboration messages; will retry on next interval")
+                    return
+                except Exception:
+                    logger.exception("Dropping a collaboration message for session %s that cannot be written", session_id)
+
+    def _write(self, pending: Dict[str, List[PendingMessage]]):
+        """Append pending in one transaction, rolling back and raising on failure"""
+        sessions = CollaborationSession.__table__
+        db = self.session_factory()
+        try:
+            rows = []
+            for session_id, messages in pending.items():
+                last_seq = db.execute(
+                    update(sessions)
+                    .where(sessions.c.session_id == session_id)
+                    .values(message_seq=sessions.c.message_seq + len(messages))
+                    .returning(sessions.c.message_seq)
+                ).scalar()
+                if last_seq is None:
+                    logger.warning("Dropping %d messages for unknown collaboration session %s", len(messages), session_id)
+                    continue
+                first_seq = last_seq - len(messages) + 1
+                rows.extend(
+                    {
+                        "id": generate_uuid(),
+                        "session_id": session_id,
+                        "seq": first_seq + offset,
+                        "user_id": m.user_id,
+                        "message_type": m.message_type,
+                        "content": m.content,
+                        "data": m.data,
+                        "created_at": m.created_at,
+                    }
+                    for offset, m in enumerate(messages)
+                )
+            if rows:
+                db.execute(insert(CollaborationSessionMessage.__table__), rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await asyncio.to_thread(self.flush)
+
+    def start(self):
+        """Start the periodic flush task on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Cancel the flush task and write out whatever is pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+collaboration_messages = CollaborationMessageWriter()
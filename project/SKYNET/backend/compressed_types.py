@@ -0,0 +1,190 @@
+"""
+Compressed column types.
+
+CompressedText and CompressedJSON store their values compressed in a bytea
+column and are transparent to the ORM: reads and writes see plain str / JSON
+values. Every stored value starts with a one-byte codec tag, so zstd, zstd
+with a trained dictionary, zlib and raw values can live side by side and the
+codec can change without rewriting old rows.
+
+Dictionaries help most for many small values sharing structure (a few KB of
+similar JSON). Train one from existing rows with
+
+    python compressed_types.py train --table code_sessions --column analysis_result --name code_sessions.analysis_result
+
+which writes <name>-<dict id>.zdict to COMPRESSION_DICT_DIR. A column declared
+with dictionary=<name> compresses with the newest dictionary of that name.
+Rows record the id of the dictionary they were written with, so retraining adds
+a file; old dictionary files must be kept (and deployed) for as long as rows
+reference them.
+"""
+import argparse
+import glob
+import json
+import os
+import threading
+import zlib
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+try:
+    import zstandard
+except ImportError:  # zlib fallback; rows already written with zstd need zstandard to be read
+    zstandard = None
+
+# Values shorter than this are stored uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "256"))
+# zstd level (1-22); the zlib fallback uses min(level, 9)
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "3"))
+COMPRESSION_DICT_DIR = os.getenv(
+    "COMPRESSION_DICT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "compression_dicts")
+)
+
+RAW = b"\x00"
+ZSTD = b"\x01"
+ZSTD_DICT = b"\x02"
+ZLIB = b"\x03"
+
+_dictionaries_by_name: Dict[str, Any] = {}
+_dictionaries_by_id: Dict[int, Any] = {}
+_dictionaries_loaded = False
+_dictionaries_lock = threading.Lock()
+# zstd (de)compressor objects are not safe to share between threads
+_local = threading.local()
+
+def register_dictionary(name: str, data: bytes):
+    """Make a trained dictionary available for compression under name and for reads by id"""
+    dictionary = zstandard.ZstdCompressionDict(data)
+    _dictionaries_by_name[name] = dictionary
+    _dictionaries_by_id[dictionary.dict_id()] = dictionary
+    return dictionary
+
+def _load_dictionaries():
+    global _dictionaries_loaded
+    if _dictionaries_loaded:
+        return
+    with _dictionaries_lock:
+        if _dictionaries_loaded:
+            return
+        if zstandard is not None:
+            # Oldest first, so the newest file of each name wins for compression
+            for path in sorted(glob.glob(os.path.join(COMPRESSION_DICT_DIR, "*.zdict")), key=os.path.getmtime):
+                name = os.path.basename(path).rsplit("-", 1)[0]
+                with open(path, "rb") as f:
+                    register_dictionary(name, f.read())
+        _dictionaries_loaded = True
+
+def _cached(kind: str, key, factory):
+    cache = _local.__dict__.setdefault(kind, {})
+    if key not in cache:
+        cache[key] = factory()
+    return cache[key]
+
+def compress(data: bytes, dictionary: Optional[str] = None, level: int = COMPRESSION_LEVEL) -> bytes:
+    """Tagged compressed form of data; see decompress"""
+    if len(data) < COMPRESSION_MIN_SIZE:
+        return RAW + data
+    if zstandard is None:
+        return ZLIB + zlib.compress(data, min(level, 9))
+
+    _load_dictionaries()
+    zdict = _dictionaries_by_name.get(dictionary) if dictionary else None
+    key = (level, zdict.dict_id() if zdict else None)
+    compressor = _cached("compressors", key, lambda: zstandard.ZstdCompressor(level=level, dict_data=zdict))
+    return (ZSTD_DICT if zdict else ZSTD) + compressor.compress(data)
+
+def decompress(blob: bytes) -> bytes:
+    blob = bytes(blob)
+    codec, payload = blob[:1], blob[1:]
+    if codec == RAW:
+        return payload
+    if codec == ZLIB:
+        return zlib.decompress(payload)
+    if codec not in (ZSTD, ZSTD_DICT):
+        raise ValueError(f"Unknown compression tag {codec!r}")
+    if zstandard is None:
+        raise RuntimeError("zstandard is required to read zstd-compressed values")
+
+    dict_id = None
+    if codec == ZSTD_DICT:
+        _load_dictionaries()
+        dict_id = zstandard.get_frame_parameters(payload).dict_id
+        if dict_id not in _dictionaries_by_id:
+            raise RuntimeError(f"Compression dictionary {dict_id} not found in {COMPRESSION_DICT_DIR}")
+    decompressor = _cached(
+        "decompressors", dict_id,
+        lambda: zstandard.ZstdDecompressor(dict_data=_dictionaries_by_id.get(dict_id))
+    )
+    return decompressor.decompress(payload)
+
+def train_dictionary(samples: List[bytes], size: int = 64 * 1024) -> bytes:
+    """Train a zstd dictionary of at most size bytes from sample values"""
+    if zstandard is None:
+        raise RuntimeError("zstandard is required to train dictionaries")
+    return zstandard.train_dictionary(size, samples).as_bytes()
+
+class CompressedText(TypeDecorator):
+    """Text stored compressed in a bytea column"""
+    impl = LargeBinary
+    cache_ok = True
+
+    def __init__(self, dictionary: Optional[str] = None):
+        super().__init__()
+        self.dictionary = dictionary
+
+    def encode(self, value: Any) -> bytes:
+        return value.encode()
+
+    def decode(self, data: bytes) -> Any:
+        return data.decode()
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else compress(self.encode(value), self.dictionary)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else self.decode(decompress(value))
+
+class CompressedJSON(CompressedText):
+    """JSON document stored compressed in a bytea column"""
+    cache_ok = True
+
+    def encode(self, value: Any) -> bytes:
+        return json.dumps(value, separators=(",", ":")).encode()
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data)
+
+if __name__ == "__main__":
+    from sqlalchemy import text
+
+    from database import engine
+
+    parser = argparse.ArgumentParser(description="Train a zstd dictionary from a column's current values")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train = subparsers.add_parser("train")
+    train.add_argument("--table", required=True)
+    train.add_argument("--column", required=True)
+    train.add_argument("--name", required=True, help="dictionary name the column type is declared with")
+    train.add_argument("--samples", type=int, default=5000, help="most recent values to sample")
+    train.add_argument("--size", type=int, default=64 * 1024, help="dictionary size in bytes")
+    args = parser.parse_args()
+
+    with engine.connect() as connection:
+        values = connection.execute(text(
+            f'SELECT "{args.column}" FROM "{args.table}" WHERE "{args.column}" IS NOT NULL '
+            f"ORDER BY created_at DESC LIMIT :samples"
+        ), {"samples": args.samples}).scalars().all()
+    samples = [
+        decompress(v) if isinstance(v, (bytes, memoryview)) else
+        (v if isinstance(v, str) else json.dumps(v, separators=(",", ":"))).encode()
+        for v in values
+    ]
+    data = train_dictionary(samples, args.size)
+    dict_id = zstandard.ZstdCompressionDict(data).dict_id()
+    os.makedirs(COMPRESSION_DICT_DIR, exist_ok=True)
+    path = os.path.join(COMPRESSION_DICT_DIR, f"{args.name}-{dict_id}.zdict")
+    with open(path, "wb") as f:
+        f.write(data)
+    print(f"Trained {len(data):,} byte dictionary {dict_id} from {len(samples):,} values -> {path}")
@@ -1,8 +1,16 @@
 import os
-from sqlalchemy import create_engine
+import threading
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+# Errors that say nothing about the statement (lost connection, server down); retrying it as is can succeed
+TRANSIENT_ERRORS = (OperationalError, InterfaceError)
 
 # Get database URL from environment
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -11,26 +19,193 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set")
 
-# Handle potential connection URL format issues
-if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
+def _normalize_url(url: str) -> str:
+    """Handle potential connection URL format issues"""
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql://", 1)
+    return url
+
+DATABASE_URL = _normalize_url(DATABASE_URL)
+
+# Streaming replicas for read-only routes, comma separated (see read_replicas.py); empty reads from the primary
+DATABASE_REPLICA_URLS = [
+    _normalize_url(url.strip()) for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()
+]
 
-# Create engine with NullPool and SSL configuration
 # Use SSL only if SSL_MODE is set to 'require' (for hosted databases)
 ssl_mode = os.getenv("SSL_MODE", "prefer")
+
+# Connection pool configuration
+# "queue" keeps warm connections per worker; "null" opens a fresh connection per checkout
+DB_POOL_MODE = os.getenv("DB_POOL_MODE", "queue").lower()
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Recycle before hosted providers / load balancers drop idle SSL sessions
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# TCP keepalives keep pooled SSL connections from being silently dropped while idle
+DB_KEEPALIVES_IDLE = int(os.getenv("DB_KEEPALIVES_IDLE", "30"))
+DB_KEEPALIVES_INTERVAL = int(os.getenv("DB_KEEPALIVES_INTERVAL", "10"))
+DB_KEEPALIVES_COUNT = int(os.getenv("DB_KEEPALIVES_COUNT", "5"))
+
+# Client-side prepared statement cache per asyncpg connection (0 disables, e.g. behind pgbouncer)
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "500"))
+
+class PoolMetrics:
+    """Counters for pool checkout latency and physical connection churn"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.checkins = 0
+            self.connects = 0
+            self.closes = 0
+            self.invalidations = 0
+            self.wait_count = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def incr(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "closes": self.closes,
+                "invalidations": self.invalidations,
+                "checkout_wait_avg_ms": (self.wait_total / self.wait_count * 1000) if self.wait_count else 0.0,
+                "checkout_wait_max_ms": self.wait_max * 1000,
+                # New physical connections per checkout: ~1.0 under NullPool, ~0 with a warm pool
+                "churn_ratio": (self.connects / self.checkouts) if self.checkouts else 0.0,
+            }
+
+pool_metrics = PoolMetrics()
+
+class _InstrumentedPoolMixin:
+    """Times how long callers wait to get a connection out of the pool"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_metrics.record_wait(time.perf_counter() - start)
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    pass
+
+class InstrumentedNullPool(_InstrumentedPoolMixin, NullPool):
+    pass
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+def instrument_pool_events(target_engine):
+    """Attach churn counters to an engine's pool"""
+    event.listen(target_engine, "connect", lambda *args: pool_metrics.incr("connects"))
+    event.listen(target_engine, "close", lambda *args: pool_metrics.incr("closes"))
+    event.listen(target_engine, "checkout", lambda *args: pool_metrics.incr("checkouts"))
+    event.listen(target_engine, "checkin", lambda *args: pool_metrics.incr("checkins"))
+    event.listen(target_engine, "invalidate", lambda *args: pool_metrics.incr("invalidations"))
+
+def _pool_kwargs(queue_pool_class=InstrumentedQueuePool) -> dict:
+    if DB_POOL_MODE == "null":
+        return {"poolclass": InstrumentedNullPool}
+    return {
+        "poolclass": queue_pool_class,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
 engine = create_engine(
     DATABASE_URL,
-    poolclass=NullPool,  # Disable connection pooling to avoid SSL timeout issues
     connect_args={
         "sslmode": ssl_mode,
         "connect_timeout": 10,
+        "keepalives": 1,
+        "keepalives_idle": DB_KEEPALIVES_IDLE,
+        "keepalives_interval": DB_KEEPALIVES_INTERVAL,
+        "keepalives_count": DB_KEEPALIVES_COUNT,
         "options": "-c statement_timeout=60000"  # 60 second timeout
-    }
+    },
+    **_pool_kwargs()
 )
+instrument_pool_events(engine)
+
+def _async_url(url: str):
+    """Point a postgresql:// URL at the asyncpg driver; libpq-only query args are dropped"""
+    async_url = make_url(url).set(drivername="postgresql+asyncpg")
+    return async_url.difference_update_query(["sslmode", "connect_timeout", "options"])
+
+def create_async_db_engine(url: str, **server_settings: str):
+    """Async engine sharing the pool settings of the sync engine.
+    asyncpg takes SSL and session settings differently from libpq, so they are mapped here."""
+    target_engine = create_async_engine(
+        _async_url(url),
+        connect_args={
+            "ssl": ssl_mode,
+            "timeout": 10,
+            "prepared_statement_cache_size": DB_PREPARED_STATEMENT_CACHE_SIZE,
+            "server_settings": {
+                "statement_timeout": "60000",  # 60 second timeout
+                "tcp_keepalives_idle": str(DB_KEEPALIVES_IDLE),
+                "tcp_keepalives_interval": str(DB_KEEPALIVES_INTERVAL),
+                "tcp_keepalives_count": str(DB_KEEPALIVES_COUNT),
+                **server_settings,
+            },
+        },
+        **_pool_kwargs(InstrumentedAsyncQueuePool)
+    )
+    instrument_pool_events(target_engine.sync_engine)
+    return target_engine
+
+# Async engine for the async route handlers
+async_engine = create_async_db_engine(DATABASE_URL)
+# Replica sessions are read-only, so a write routed to one fails instead of silently diverging
+async_replica_engines = [
+    create_async_db_engine(url, default_transaction_read_only="on") for url in DATABASE_REPLICA_URLS
+]
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: attributes stay loaded after commit, since async sessions cannot lazy-load
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+def get_pool_status() -> dict:
+    """Pool configuration, current occupancy and checkout/churn metrics"""
+    status = {"mode": DB_POOL_MODE, "metrics": pool_metrics.snapshot()}
+    if DB_POOL_MODE != "null":
+        pools = [("sync", engine.pool), ("async", async_engine.pool)]
+        pools += [(f"async_replica_{i}", replica.pool) for i, replica in enumerate(async_replica_engines)]
+        for name, pool in pools:
+            status[name] = {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+                "idle": pool.checkedin(),
+                "max_overflow": DB_MAX_OVERFLOW,
+            }
+    return status
+
 def get_db():
     """Get database session with proper error handling"""
     db = SessionLocal()
@@ -40,4 +215,13 @@ def get_db():
         db.rollback()
         raise e
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    """Get an async database session for async route handlers"""
+    async with AsyncSessionLocal() as db:
+        try:
+            yield db
+        except Exception:
+            await db.rollback()
+            raise
@@ -0,0 +1,726 @@
+"""
+Process management for code execution.
+
+run_python() runs a script in a fresh interpreter. Interpreter start-up, site
+and the imports a script needs usually cost more than the script itself, so
+executions normally go through the ExecutorPool instead. It keeps
+CODE_EXECUTOR_POOL_SIZE zygotes (zygote.py): warm interpreters that imported
+CODE_EXECUTOR_PRELOAD once and fork a child per execution. Either way the
+script leads its own process group with its own pipes. On timeout or
+cancellation the group is killed.
+
+A zygote is replaced after CODE_EXECUTOR_MAX_RUNS executions or once its
+memory grows past CODE_EXECUTOR_MAX_RSS_MB; the old one exits when its last
+child does. When no zygote can be started the script runs in a fresh
+interpreter.
+
+Every execution runs under ExecutionLimits: rlimits on address space, CPU
+time, file size and process count, applied in the child before the script
+starts, and at most CODE_EXECUTION_MAX_OUTPUT_BYTES of each of stdout and
+stderr kept in memory (OutputBuffer). ProcessOutput.limit_exceeded says which
+limit a run hit.
+
+Resource usage is the rusage of the script's process as it is reaped (by the
+zygote, or here through os.wait4), so it covers the script and any children
+it waited for, and nothing of the API process.
+
+A run given an ExecutionStream also passes its output there as it is read,
+along with periodic resource samples, for clients that watch it live.
+"""
+import asyncio
+import codecs
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# Zygotes executions are forked from; 0 starts a fresh interpreter for every execution
+CODE_EXECUTOR_POOL_SIZE = int(os.getenv("CODE_EXECUTOR_POOL_SIZE", "2"))
+# Modules each zygote imports once, so every execution starts with them loaded
+CODE_EXECUTOR_PRELOAD = os.getenv(
+    "CODE_EXECUTOR_PRELOAD",
+    "unittest,json,re,math,random,collections,itertools,functools,datetime,typing,dataclasses"
+)
+# A zygote is replaced after this many executions...
+CODE_EXECUTOR_MAX_RUNS = int(os.getenv("CODE_EXECUTOR_MAX_RUNS", "1000"))
+# ...or once its resident memory grows past this many MB
+CODE_EXECUTOR_MAX_RSS_MB = float(os.getenv("CODE_EXECUTOR_MAX_RSS_MB", "200"))
+# Seconds a new zygote has to import its modules and report ready
+CODE_EXECUTOR_START_TIMEOUT = float(os.getenv("CODE_EXECUTOR_START_TIMEOUT", "30"))
+
+# Address space per execution in MB; each thread a script starts reserves about 70 MB of it
+CODE_EXECUTION_MAX_MEMORY_MB = int(os.getenv("CODE_EXECUTION_MAX_MEMORY_MB", "1024"))
+# CPU seconds per process before it gets SIGXCPU, and SIGKILL a second later
+CODE_EXECUTION_MAX_CPU_SECONDS = int(os.getenv("CODE_EXECUTION_MAX_CPU_SECONDS", "20"))
+# Largest file a script may write, in MB
+CODE_EXECUTION_MAX_FILE_SIZE_MB = int(os.getenv("CODE_EXECUTION_MAX_FILE_SIZE_MB", "16"))
+# Processes the user the API runs as may have before a script's fork fails (RLIMIT_NPROC counts
+# all of that user's processes and does not apply to root, so run the API as a dedicated user)
+CODE_EXECUTION_MAX_PROCESSES = int(os.getenv("CODE_EXECUTION_MAX_PROCESSES", "256"))
+# Bytes of stdout and of stderr kept per execution; beyond that the middle is dropped
+CODE_EXECUTION_MAX_OUTPUT_BYTES = int(os.getenv("CODE_EXECUTION_MAX_OUTPUT_BYTES", str(1024 * 1024)))
+
+# Events a streamed run may have waiting for its client; output then waits too, and so does the script
+CODE_STREAM_MAX_PENDING = int(os.getenv("CODE_STREAM_MAX_PENDING", "16"))
+# Seconds between resource samples of a streamed run
+CODE_STREAM_SAMPLE_INTERVAL = float(os.getenv("CODE_STREAM_SAMPLE_INTERVAL", "0.5"))
+
+# Bytes read from a child's stdout / stderr at a time
+PROCESS_READ_CHUNK = 64 * 1024
+# Seconds to wait for output still buffered in the pipes once the process group is dead
+PROCESS_DRAIN_TIMEOUT = 1.0
+
+ZYGOTE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "zygote.py")
+ZYGOTE_MAX_MESSAGE = 64 * 1024
+
+@dataclass
+class ExecutionLimits:
+    """Per-execution limits; 0 disables one"""
+    memory_mb: int = CODE_EXECUTION_MAX_MEMORY_MB
+    cpu_seconds: int = CODE_EXECUTION_MAX_CPU_SECONDS
+    file_size_mb: int = CODE_EXECUTION_MAX_FILE_SIZE_MB
+    processes: int = CODE_EXECUTION_MAX_PROCESSES
+    output_bytes: int = CODE_EXECUTION_MAX_OUTPUT_BYTES
+
+    def rlimits(self) -> Dict[str, Tuple[int, int]]:
+        """(soft, hard) by resource name, for the child to setrlimit before running the script"""
+        limits = {"RLIMIT_CORE": (0, 0)}
+        if self.memory_mb:
+            limits["RLIMIT_AS"] = (self.memory_mb * 1024 * 1024,) * 2
+        if self.cpu_seconds:
+            limits["RLIMIT_CPU"] = (self.cpu_seconds, self.cpu_seconds + 1)
+        if self.file_size_mb:
+            limits["RLIMIT_FSIZE"] = (self.file_size_mb * 1024 * 1024,) * 2
+        if self.processes:
+            limits["RLIMIT_NPROC"] = (self.processes,) * 2
+        return limits
+
+class OutputBuffer:
+    """The first and last limit / 2 bytes of a stream; what comes between is counted and dropped.
+
+    The head shows how a run started and the tail, kept in a ring of chunks,
+    holds how it ended: the traceback, or unittest's summary.
+    """
+
+    def __init__(self, limit: int = CODE_EXECUTION_MAX_OUTPUT_BYTES):
+        self.head_size = limit // 2 if limit else sys.maxsize
+        self.tail_size = limit - limit // 2
+        self.head = bytearray()
+        self.tail: "deque[bytes]" = deque()
+        self.tail_bytes = 0
+        self.total = 0
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > len(self.head) + self.tail_bytes
+
+    def write(self, data: bytes):
+        self.total += len(data)
+        room = self.head_size - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail.append(data)
+            self.tail_bytes += len(data)
+            while self.tail_bytes - len(self.tail[0]) >= self.tail_size:
+                self.tail_bytes -= len(self.tail.popleft())
+
+    def getvalue(self) -> str:
+        tail = b"".join(self.tail)
+        if not self.truncated:
+            return (bytes(self.head) + tail).decode(errors="replace")
+        tail = tail[-self.tail_size:]
+        dropped = self.total - len(self.head) - len(tail)
+        return (
+            self.head.decode(errors="replace")
+            + f"\n... [{dropped:,} bytes truncated] ...\n"
+            + tail.decode(errors="replace")
+        )
+
+@dataclass
+class ResourceUsage:
+    peak_rss_mb: float
+    user_cpu_time: float
+    system_cpu_time: float
+    wall_time: float
+    voluntary_context_switches: int
+    involuntary_context_switches: int
+    # Block I/O, so reads served from the page cache don't count
+    read_bytes: int
+    write_bytes: int
+
+    @property
+    def cpu_percent(self) -> float:
+        return (self.user_cpu_time + self.system_cpu_time) / self.wall_time * 100 if self.wall_time > 0 else 0.0
+
+    @classmethod
+    def from_rusage(cls, rusage: Dict[str, Any], wall_time: float) -> "ResourceUsage":
+        """rusage: the ru_* fields of a reaped child's struct rusage"""
+        # ru_maxrss is in KB on Linux and in bytes on macOS
+        peak_rss = rusage["ru_maxrss"] * (1 if sys.platform == "darwin" else 1024)
+        return cls(
+            peak_rss_mb=peak_rss / 1024 / 1024,
+            user_cpu_time=rusage["ru_utime"],
+            system_cpu_time=rusage["ru_stime"],
+            wall_time=wall_time,
+            voluntary_context_switches=rusage["ru_nvcsw"],
+            involuntary_context_switches=rusage["ru_nivcsw"],
+            read_bytes=rusage["ru_inblock"] * 512,
+            write_bytes=rusage["ru_oublock"] * 512
+        )
+
+@dataclass
+class ProcessOutput:
+    returncode: Optional[int]
+    stdout: str
+    stderr: str
+    execution_time: float
+    resources: Optional[ResourceUsage] = None
+    # "timeout", "cpu_time", "memory", "file_size" or "processes" when that ended the run,
+    # "output" when it only had its output cut
+    limit_exceeded: Optional[str] = None
+    # What the script wrote to "<script>.report.json", when the caller asked for it (test runs)
+    report: Optional[Dict[str, Any]] = None
+
+class ProcessTimeout(Exception):
+    """The process outlived its timeout; its process group has been killed"""
+
+    def __init__(self, message: str, output: ProcessOutput):
+        super().__init__(message)
+        self.output = output
+
+class ZygoteError(Exception):
+    """The zygote died while running the script"""
+
+class ZygoteUnavailable(ZygoteError):
+    """No zygote could start the script; it did not run"""
+
+class ExecutionStream:
+    """A run's output and resource samples as they happen, for one consumer.
+
+    Output is queued with a bound and read from the pipes only as the
+    consumer keeps up, so a slow client stalls the script on a full pipe
+    rather than buffering its output here. Resource samples never wait: one
+    that finds the queue full is dropped.
+    """
+
+    def __init__(self, max_pending: int = CODE_STREAM_MAX_PENDING):
+        self.queue: asyncio.Queue = asyncio.Queue(max_pending)
+        self._decoders = {}
+        self._sampler: Optional[asyncio.Task] = None
+        self._run: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def output(self, name: str, data: bytes):
+        # Incremental decoding so characters split across reads come out whole
+        decoder = self._decoders.setdefault(name, codecs.getincrementaldecoder("utf-8")(errors="replace"))
+        text = decoder.decode(data)
+        if text and not self._closed:
+            await self.queue.put({"type": name, "data": text})
+
+    def started(self, pid: int):
+        self._sampler = asyncio.create_task(self._sample(pid))
+
+    def finished(self):
+        if self._sampler is not None:
+            self._sampler.cancel()
+
+    def cancel(self):
+        """Stop the run; the process group is killed and the events end with "cancelled" """
+        if self._run is not None:
+            self._run.cancel()
+
+    async def _sample(self, pid: int):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            process = psutil.Process(pid)
+        except psutil.Error:
+            return
+        while True:
+            await asyncio.sleep(CODE_STREAM_SAMPLE_INTERVAL)
+            try:
+                with process.oneshot():
+                    cpu = process.cpu_times()
+                    memory = process.memory_info()
+                    switches = process.num_ctx_switches()
+                    io = process.io_counters() if hasattr(process, "io_counters") else None
+            except psutil.Error:
+                return
+            sample = {
+                "type": "resources",
+                "elapsed": loop.time() - started,
+                "rss_mb": memory.rss / 1024 / 1024,
+                "user_cpu_time": cpu.user,
+                "system_cpu_time": cpu.system,
+                "voluntary_context_switches": switches.voluntary,
+                "involuntary_context_switches": switches.involuntary,
+                "read_bytes": io.read_bytes if io else None,
+                "write_bytes": io.write_bytes if io else None,
+            }
+            try:
+                self.queue.put_nowait(sample)
+            except asyncio.QueueFull:
+                pass
+
+    async def events(self, run: asyncio.Task) -> AsyncIterator[Dict[str, Any]]:
+        """Events until run finishes, then {"type": "result", "result": ...} or {"type": "cancelled"}.
+
+        Closing the iterator early (the client went away) cancels the run.
+        """
+        self._run = run
+        get = None
+        try:
+            while True:
+                get = asyncio.ensure_future(self.queue.get())
+                await asyncio.wait({get, run}, return_when=asyncio.FIRST_COMPLETED)
+                if get.done():
+                    yield get.result()
+                    continue
+                get.cancel()
+                while not self.queue.empty():
+                    yield self.queue.get_nowait()
+                if run.cancelled():
+                    yield {"type": "cancelled"}
+                else:
+                    yield {"type": "result", "result": run.result()}
+                return
+        finally:
+            if get is not None:
+                get.cancel()
+            # Nobody reads any more: release output waiting on a full queue and drop what follows
+            self._closed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            if not run.done():
+                run.cancel()
+                try:
+                    await run
+                except asyncio.CancelledError:
+                    pass
+
+def _kill_process_group(pid: int):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass  # group already gone
+
+async def _drain(reader: asyncio.StreamReader, buffer: OutputBuffer, name: str,
+                 stream: Optional[ExecutionStream] = None):
+    while True:
+        chunk = await reader.read(PROCESS_READ_CHUNK)
+        if not chunk:
+            return
+        buffer.write(chunk)
+        if stream is not None:
+            await stream.output(name, chunk)
+
+async def _finish_reading(readers: asyncio.Future):
+    done, _ = await asyncio.wait({readers}, timeout=PROCESS_DRAIN_TIMEOUT)
+    if not done:
+        readers.cancel()  # something escaped the group and still holds a pipe
+
+def _limit_exceeded(output: ProcessOutput, limits: ExecutionLimits, timed_out: bool, truncated: bool) -> Optional[str]:
+    if timed_out:
+        return "timeout"
+    if output.returncode not in (None, 0):
+        cpu_time = output.resources.user_cpu_time + output.resources.system_cpu_time if output.resources else 0
+        if output.returncode == -signal.SIGXCPU or (
+            output.returncode == -signal.SIGKILL and limits.cpu_seconds and cpu_time >= limits.cpu_seconds
+        ):
+            return "cpu_time"
+        if output.returncode == -signal.SIGXFSZ:
+            return "file_size"
+        # Python ignores SIGXFSZ and turns the other limits into exceptions; the last one is the cause
+        last_error = output.stderr[-1024:]
+        if "MemoryError" in last_error:
+            return "memory"
+        if "File too large" in last_error:
+            return "file_size"
+        if "BlockingIOError: [Errno 11]" in last_error:
+            return "processes"  # fork() hit RLIMIT_NPROC
+    return "output" if truncated else None
+
+def _output(returncode: Optional[int], stdout: OutputBuffer, stderr: OutputBuffer, start_time: float,
+            rusage: Optional[Dict[str, Any]], limits: ExecutionLimits, timed_out: bool) -> ProcessOutput:
+    execution_time = time.time() - start_time
+    output = ProcessOutput(
+        returncode=returncode,
+        stdout=stdout.getvalue(),
+        stderr=stderr.getvalue(),
+        execution_time=execution_time,
+        resources=ResourceUsage.from_rusage(rusage, execution_time) if rusage else None
+    )
+    output.limit_exceeded = _limit_exceeded(output, limits, timed_out, stdout.truncated or stderr.truncated)
+    return output
+
+def _rusage_fields(rusage) -> Dict[str, Any]:
+    return {name: getattr(rusage, name) for name in dir(rusage) if name.startswith("ru_")}
+
+def _wait4_blocking(pid: int) -> Tuple[int, Dict[str, Any]]:
+    _, status, rusage = os.wait4(pid, 0)
+    return os.waitstatus_to_exitcode(status), _rusage_fields(rusage)
+
+async def _wait4(pid: int) -> Tuple[int, Dict[str, Any]]:
+    """Reap a child with its resource usage; a pidfd says when it exited, so no thread waits on it"""
+    loop = asyncio.get_running_loop()
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        return await loop.run_in_executor(None, _wait4_blocking, pid)
+    exited = loop.create_future()
+    loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+    try:
+        await exited
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+    return _wait4_blocking(pid)
+
+async def run_python(path: str, timeout: float, limits: Optional[ExecutionLimits] = None,
+                     stream: Optional[ExecutionStream] = None) -> ProcessOutput:
+    """Run a Python file in a fresh interpreter without blocking the event loop.
+
+    The child leads its own process group, so on timeout or cancellation it is
+    killed together with anything it spawned. stdout and stderr are read as
+    they are written, so a chatty child never stalls on a full pipe. The
+    interpreter runs zygote.py's one-shot mode, which applies the rlimits
+    before the script starts.
+    """
+    limits = limits or ExecutionLimits()
+    start_time = time.time()
+    # Reaped with os.wait4 below rather than by asyncio's child watcher, which drops the rusage
+    proc = subprocess.Popen(
+        [sys.executable, ZYGOTE_SCRIPT, "--run", path, json.dumps(limits.rlimits())],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True
+    )
+    stdout, stderr = OutputBuffer(limits.output_bytes), OutputBuffer(limits.output_bytes)
+    transports = []
+    readers = None
+    timed_out = False
+    exited = asyncio.ensure_future(_wait4(proc.pid))
+    if stream is not None:
+        stream.started(proc.pid)
+    try:
+        pipe_readers = []
+        for pipe in (proc.stdout, proc.stderr):
+            pipe_reader, transport = await _pipe_reader(pipe)
+            pipe_readers.append(pipe_reader)
+            transports.append(transport)
+        readers = asyncio.gather(
+            _drain(pipe_readers[0], stdout, "stdout", stream), _drain(pipe_readers[1], stderr, "stderr", stream)
+        )
+        await asyncio.wait_for(asyncio.shield(exited), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+    finally:
+        # Also kills background children left by a clean exit, which would keep the pipes open
+        _kill_process_group(proc.pid)
+        await asyncio.wait({exited})
+        if stream is not None:
+            stream.finished()
+        if readers is not None:
+            await _finish_reading(readers)
+        for transport in transports:
+            transport.close()
+        for pipe in (proc.stdout, proc.stderr)[len(transports):]:
+            pipe.close()
+
+    proc.returncode, rusage = exited.result()
+    output = _output(proc.returncode, stdout, stderr, start_time, rusage, limits, timed_out)
+    if timed_out:
+        raise ProcessTimeout(f"{path} did not finish in {timeout} seconds", output)
+    return output
+
+async def _pipe_reader(pipe) -> Tuple[asyncio.StreamReader, asyncio.BaseTransport]:
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    return reader, transport
+
+def _fail(future: asyncio.Future, error: Exception):
+    if not future.done():
+        future.set_exception(error)
+        future.exception()  # the run awaiting it may have been cancelled; don't log it as never retrieved
+
+class Zygote:
+    """One warm interpreter that forks a child per execution"""
+
+    def __init__(self):
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.runs = 0
+        self.active = 0
+        self.retired = False
+        self.dead = False
+        self._sock: Optional[socket.socket] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ready: Optional[asyncio.Future] = None
+        self._reader: Optional[asyncio.Task] = None
+        self._pending: Dict[int, Tuple[asyncio.Future, asyncio.Future]] = {}
+        self._ids = itertools.count()
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        parent_sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                sys.executable, ZYGOTE_SCRIPT, str(child_sock.fileno()),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                pass_fds=(child_sock.fileno(),),
+                start_new_session=True,
+                env={**os.environ, "CODE_EXECUTOR_PRELOAD": CODE_EXECUTOR_PRELOAD}
+            )
+        except BaseException:
+            parent_sock.close()
+            raise
+        finally:
+            child_sock.close()
+        parent_sock.setblocking(False)
+        self._sock = parent_sock
+        self._ready = self._loop.create_future()
+        self._reader = asyncio.create_task(self._read())
+        try:
+            await asyncio.wait_for(asyncio.shield(self._ready), CODE_EXECUTOR_START_TIMEOUT)
+        except BaseException:
+            self.kill()
+            raise
+
+    def usable(self) -> bool:
+        if self.dead or self.retired or self._loop is not asyncio.get_running_loop():
+            return False
+        if self.runs >= CODE_EXECUTOR_MAX_RUNS:
+            return False
+        try:
+            return psutil.Process(self.process.pid).memory_info().rss / 1024 / 1024 <= CODE_EXECUTOR_MAX_RSS_MB
+        except psutil.Error:
+            return False
+
+    def retire(self):
+        """Take no more executions and exit once the running ones finish"""
+        if self.retired or self.dead:
+            return
+        self.retired = True
+        if self._loop is not asyncio.get_running_loop():
+            self.close()  # left over from another event loop
+            return
+        try:
+            self._sock.send(json.dumps({"op": "close"}).encode())
+        except OSError:
+            self.close()
+
+    def close(self):
+        """Hang up; the zygote kills the children it still has and exits"""
+        self.dead = True
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def kill(self):
+        """For a zygote that is not answering"""
+        self.close()
+        if self.process is not None and self.process.returncode is None:
+            _kill_process_group(self.process.pid)
+
+    async def wait_closed(self, timeout: float = 5.0):
+        if self._reader is None or self._loop is not asyncio.get_running_loop():
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self._reader), timeout)
+        except asyncio.TimeoutError:
+            self.kill()
+            await self._reader
+
+    async def _read(self):
+        try:
+            while True:
+                data = await self._loop.sock_recv(self._sock, ZYGOTE_MAX_MESSAGE)
+                if not data:
+                    break
+                message = json.loads(data)
+                if message.get("ready"):
+                    self._ready.set_result(True)
+                    continue
+                started, finished = self._pending.get(message["id"], (None, None))
+                if started is None:
+                    if "pid" in message:
+                        _kill_process_group(message["pid"])  # forked after its run gave up waiting
+                    continue
+                if "pid" in message:
+                    started.set_result(message["pid"])
+                else:
+                    self._pending.pop(message["id"])
+                    finished.set_result(message)
+        except (OSError, ValueError) as e:
+            if not self.dead:
+                logger.warning("Lost connection to code execution zygote: %s", e)
+        finally:
+            self.dead = True
+            _fail(self._ready, ZygoteUnavailable("zygote exited before it was ready"))
+            for started, finished in self._pending.values():
+                _fail(started, ZygoteUnavailable("zygote exited before starting the script"))
+                _fail(finished, ZygoteError("zygote exited while the script was running"))
+            self._pending.clear()
+            if self._sock is not None:
+                self._sock.close()
+            if self.process is not None:
+                await self.process.wait()
+
+    async def run(self, path: str, timeout: float, limits: ExecutionLimits,
+                  stream: Optional[ExecutionStream] = None) -> ProcessOutput:
+        request_id = next(self._ids)
+        started, finished = self._loop.create_future(), self._loop.create_future()
+        self._pending[request_id] = (started, finished)
+        self.runs += 1
+        self.active += 1
+
+        start_time = time.time()
+        stdout, stderr = OutputBuffer(limits.output_bytes), OutputBuffer(limits.output_bytes)
+        transports = []
+        readers = None
+        pid = None
+        timed_out = False
+        pipes = [*os.pipe(), *os.pipe()]  # stdout read, stdout write, stderr read, stderr write
+        try:
+            try:
+                socket.send_fds(self._sock, [json.dumps({"id": request_id, "path": path, "limits": limits.rlimits()}).encode()],
+                                [pipes[1], pipes[3]])
+            except OSError as e:
+                self._pending.pop(request_id, None)
+                raise ZygoteUnavailable(str(e))
+            finally:
+                os.close(pipes[1])
+                os.close(pipes[3])
+            pipe_readers = []
+            for fd in (pipes[0], pipes[2]):
+                pipe_reader, transport = await _pipe_reader(os.fdopen(fd, "rb", buffering=0))
+                pipe_readers.append(pipe_reader)
+                transports.append(transport)
+            readers = asyncio.gather(
+                _drain(pipe_readers[0], stdout, "stdout", stream), _drain(pipe_readers[1], stderr, "stderr", stream)
+            )
+
+            deadline = self._loop.time() + timeout
+            try:
+                pid = await asyncio.wait_for(asyncio.shield(started), timeout)
+                if stream is not None:
+                    stream.started(pid)
+                await asyncio.wait_for(asyncio.shield(finished), max(0, deadline - self._loop.time()))
+            except asyncio.TimeoutError:
+                timed_out = True
+        finally:
+            self.active -= 1
+            if pid is not None:
+                _kill_process_group(pid)
+                await asyncio.wait({finished}, timeout=PROCESS_DRAIN_TIMEOUT)
+            elif not started.done():
+                self._pending.pop(request_id, None)
+            if stream is not None:
+                stream.finished()
+            if readers is not None:
+                await _finish_reading(readers)
+            for transport in transports:
+                transport.close()
+            for fd in (pipes[0], pipes[2])[len(transports):]:
+                os.close(fd)
+
+        exit_status = finished.result() if finished.done() else {}
+        output = _output(
+            exit_status.get("returncode"), stdout, stderr, start_time, exit_status.get("rusage"), limits, timed_out
+        )
+        if timed_out:
+            raise ProcessTimeout(f"{path} did not finish in {timeout} seconds", output)
+        return output
+
+class ExecutorPool:
+    """Warm zygotes for code execution; run() picks the one with the fewest running executions"""
+
+    def __init__(self, size: int = CODE_EXECUTOR_POOL_SIZE):
+        self.size = size
+        self.zygotes: List[Zygote] = []
+        self._retired: List[Zygote] = []
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._warming: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Warm the zygotes in the background so the first execution does not wait for them"""
+        if self.size > 0 and (self._warming is None or self._warming.done()):
+            self._warming = asyncio.create_task(self._warm())
+
+    async def _warm(self):
+        try:
+            await self._acquire()
+        except Exception as e:
+            logger.warning("Could not start code execution zygotes: %s", e)
+
+    async def _acquire(self) -> Zygote:
+        if self._loop is not asyncio.get_running_loop():
+            self._loop = asyncio.get_running_loop()
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            for zygote in self.zygotes:
+                if not zygote.usable():
+                    zygote.retire()
+                    self._retired.append(zygote)
+            self.zygotes = [zygote for zygote in self.zygotes if not zygote.retired and not zygote.dead]
+            self._retired = [zygote for zygote in self._retired if not zygote.dead]
+            while len(self.zygotes) < self.size:
+                zygote = Zygote()
+                try:
+                    await zygote.start()
+                except (OSError, asyncio.TimeoutError, ZygoteError) as e:
+                    if not self.zygotes:
+                        raise ZygoteUnavailable(f"could not start a zygote: {e}")
+                    logger.warning("Could not start a code execution zygote: %s", e)
+                    break
+                self.zygotes.append(zygote)
+            return min(self.zygotes, key=lambda zygote: zygote.active)
+
+    async def run(self, path: str, timeout: float, limits: Optional[ExecutionLimits] = None,
+                  stream: Optional[ExecutionStream] = None) -> ProcessOutput:
+        """Run a Python file forked from a warm zygote, or in a fresh interpreter if none can be used"""
+        limits = limits or ExecutionLimits()
+        if self.size > 0:
+            try:
+                zygote = await self._acquire()
+                return await zygote.run(path, timeout, limits, stream)
+            except ZygoteUnavailable as e:
+                logger.warning("Running %s in a fresh interpreter: %s", path, e)
+        return await run_python(path, timeout, limits, stream)
+
+    async def stop(self):
+        """Kill the zygotes; executions still running are killed with them"""
+        if self._warming is not None:
+            self._warming.cancel()
+            try:
+                await self._warming
+            except asyncio.CancelledError:
+                pass
+            self._warming = None
+        for zygote in self.zygotes + self._retired:
+            zygote.close()
+        for zygote in self.zygotes + self._retired:
+            await zygote.wait_closed()
+        self.zygotes = []
+        self._retired = []
+
+executor_pool = ExecutorPool()
@@ -0,0 +1,311 @@
+"""
+HTTP caching for catalog endpoints.
+
+Catalog responses (/llm/available-models, /models/list, the legacy /models and
+/health) are memoized in-process as encoded bodies with a strong ETag from
+their content hash. Repeat polls are answered from memory, and a client that
+sends the ETag back in If-None-Match gets an empty 304. Entries are dropped on
+model or API key writes in this worker (catalog_cache.invalidate()) and expire
+after CATALOG_CACHE_TTL seconds, which bounds staleness for writes made by
+other workers and for the request counters and latency stats the model list
+carries. Those stats are time-derived (throughput), so a rebuilt model list
+usually gets a new ETag; 304s are reliable within one TTL. Clients pinned to
+the primary after a write (see read_replicas.py) bypass the cache so they
+always read their own writes.
+
+CompressionMiddleware compresses other text and JSON responses above
+HTTP_COMPRESSION_MIN_SIZE with brotli (when installed) or gzip. Memoized
+entries keep their compressed variants, so cache hits are not compressed again.
+"""
+import asyncio
+import gzip
+import hashlib
+import inspect
+import os
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+from fastapi import Request, Response
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from model_artifacts import etag_matches
+from read_replicas import replica_router
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Seconds a memoized catalog response is served before it is rebuilt
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "5"))
+# Distinct cached responses (one per route, view and page) kept before the oldest is evicted
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "256"))
+
+# Responses smaller than this are sent uncompressed
+HTTP_COMPRESSION_MIN_SIZE = int(os.getenv("HTTP_COMPRESSION_MIN_SIZE", "1024"))
+# Levels for responses compressed per request; memoized entries are compressed once, at the maximum
+HTTP_GZIP_LEVEL = int(os.getenv("HTTP_GZIP_LEVEL", "6"))
+HTTP_BROTLI_QUALITY = int(os.getenv("HTTP_BROTLI_QUALITY", "4"))
+
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+# Event streams are left alone so every event reaches the client as soon as it is sent
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/xml", "+json")
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Preferred content coding the client accepts, or None for identity"""
+    accepted: Dict[str, float] = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name.strip():
+            accepted[name.strip().lower()] = quality
+    for encoding in SUPPORTED_ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+def compress(data: bytes, encoding: str, best: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if best else HTTP_BROTLI_QUALITY)
+    # mtime=0 keeps the output, and so a cached variant, identical across rebuilds
+    return gzip.compress(data, compresslevel=9 if best else HTTP_GZIP_LEVEL, mtime=0)
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    return content_type != "text/event-stream" and any(
+        content_type.startswith(t) if t.endswith("/") else t in content_type for t in COMPRESSIBLE_TYPES
+    )
+
+def encoded_etag(etag: str, encoding: Optional[str]) -> str:
+    """Strong ETags differ per content coding: "<hash>" becomes "<hash>-<encoding>" """
+    if not encoding or not etag.endswith('"') or etag.startswith("W/"):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    media_type: Optional[str]
+    etag: str
+    # Headers of the built response worth replaying, e.g. the next-page cursor
+    headers: List[Tuple[bytes, bytes]]
+    version: int
+    expires_at: float
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+    @classmethod
+    def from_response(cls, response: Response, version: int, expires_at: float) -> "CachedResponse":
+        return cls(
+            body=response.body,
+            media_type=response.media_type,
+            etag=f'"{hashlib.sha256(response.body).hexdigest()[:32]}"',
+            headers=[
+                (name, value) for name, value in response.raw_headers
+                if name not in (b"content-length", b"content-type", b"etag")
+            ],
+            version=version,
+            expires_at=expires_at
+        )
+
+    def variant(self, encoding: Optional[str]) -> bytes:
+        if encoding is None:
+            return self.body
+        if encoding not in self.encoded:
+            self.encoded[encoding] = compress(self.body, encoding, best=True)
+        return self.encoded[encoding]
+
+ResponseBuilder = Callable[[], Union[Response, Awaitable[Response]]]
+
+async def build_entry(build: ResponseBuilder, version: int = 0, ttl: float = 0.0) -> CachedResponse:
+    response = build()
+    if inspect.isawaitable(response):
+        response = await response
+    return CachedResponse.from_response(response, version, time.monotonic() + ttl)
+
+class CatalogCache:
+    """Memoized catalog responses, rebuilt at most once at a time per key"""
+
+    def __init__(self, ttl: float = CATALOG_CACHE_TTL, max_entries: int = CATALOG_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+        self._building: Dict[Hashable, asyncio.Future] = {}
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        """Drop every entry; builds already running are not stored"""
+        self._version += 1
+        self._entries.clear()
+
+    async def get(self, key: Hashable, build: ResponseBuilder) -> CachedResponse:
+        entry = self._entries.get(key)
+        if entry is not None and entry.version == self._version and entry.expires_at > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        # Concurrent misses for the same key wait for one build instead of all querying
+        pending = self._building.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._building[key] = future
+        try:
+            entry = await build_entry(build, self._version, self.ttl)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # waiters re-raise it; don't log it as never retrieved
+            raise
+        finally:
+            self._building.pop(key, None)
+
+        future.set_result(entry)
+        if entry.version == self._version:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+catalog_cache = CatalogCache()
+
+async def cached_response(request: Request, key: Hashable, build: ResponseBuilder) -> Response:
+    """Serve a memoized catalog response with ETag / If-None-Match handling and negotiated compression.
+
+    build produces the full response on a miss; only its body, media type and
+    extra headers are kept.
+    """
+    if replica_router.is_pinned(request):
+        entry = await build_entry(build)
+    else:
+        entry = await catalog_cache.get(key, build)
+
+    encoding = None
+    if len(entry.body) >= HTTP_COMPRESSION_MIN_SIZE and is_compressible(entry.media_type):
+        encoding = choose_encoding(request.headers.get("accept-encoding"))
+    headers = {"etag": encoded_etag(entry.etag, encoding), "cache-control": "no-cache", "vary": "Accept-Encoding"}
+
+    if etag_matches(request.headers.get("if-none-match"), headers["etag"]):
+        return Response(status_code=304, headers=headers)
+
+    if encoding:
+        headers["content-encoding"] = encoding
+    response = Response(entry.variant(encoding), media_type=entry.media_type, headers=headers)
+    response.raw_headers.extend(entry.headers)
+    return response
+
+class _StreamCompressor:
+    """Compresses a streamed body chunk by chunk, flushing each so clients see it without waiting for the end"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=HTTP_BROTLI_QUALITY)
+        else:
+            self._compressor = zlib.compressobj(HTTP_GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+
+    def process(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+class CompressionMiddleware:
+    """Compress text and JSON responses above minimum_size with brotli or gzip, as the client accepts.
+
+    Responses that already carry a Content-Encoding (memoized catalog responses),
+    partial content and event streams pass through unchanged.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = HTTP_COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        compressor: Optional[_StreamCompressor] = None
+        passthrough = False
+
+        async def send_compressed(message: Message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                if start is not None:
+                    await send(start)
+                    start = None
+                passthrough = True
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is not None:
+                chunk = compressor.process(body)
+                if not more_body:
+                    chunk += compressor.finish()
+                await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+                return
+
+            headers = MutableHeaders(raw=start["headers"])
+            eligible = (
+                start["status"] not in (204, 206, 304)
+                and "content-encoding" not in headers
+                and is_compressible(headers.get("content-type"))
+            )
+            if eligible:
+                headers.add_vary_header("Accept-Encoding")
+            if not eligible or (not more_body and len(body) < self.minimum_size):
+                passthrough = True
+                await send(start)
+                start = None
+                await send(message)
+                return
+
+            headers["content-encoding"] = encoding
+            if "etag" in headers:
+                headers["etag"] = encoded_etag(headers["etag"], encoding)
+            if more_body:
+                del headers["content-length"]
+                compressor = _StreamCompressor(encoding)
+                body = compressor.process(body)
+            else:
+                body = compress(body, encoding)
+                headers["content-length"] = str(len(body))
+            await send(start)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,351 @@
+import asyncio
+import logging
+import math
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from bulk_upsert import upsert_statement
+from database import SessionLocal
+from models import ModelLatencyStats, generate_uuid
+
+logger = logging.getLogger(__name__)
+
+# Relative accuracy of reported quantiles (1% -> p99 of 2.00s reported within 1.98s..2.02s)
+LATENCY_RELATIVE_ACCURACY = float(os.getenv("LATENCY_RELATIVE_ACCURACY", "0.01"))
+# Seconds between persisting this replica's sketches and reloading the other replicas'
+LATENCY_PERSIST_INTERVAL = float(os.getenv("LATENCY_PERSIST_INTERVAL", "30"))
+# Identifies this process's rows so processes never overwrite each other. The
+# default is new for every process (workers on one host, a container restarted
+# with the same hostname); an explicit REPLICA_ID resumes its rows after a restart,
+# so it must be unique to one process.
+REPLICA_ID = os.getenv("REPLICA_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+# Rows of a replica not persisted for this many seconds are folded into RETIRED_REPLICA_ID's
+LATENCY_REPLICA_TTL = float(os.getenv("LATENCY_REPLICA_TTL", "600"))
+RETIRED_REPLICA_ID = "retired"
+
+# Latencies below this (seconds) land in the zero bucket
+MIN_TRACKED_LATENCY = 1e-6
+
+class LatencySketch:
+    """DDSketch-style log-bucketed histogram with bounded relative error.
+
+    Buckets are indexed by ceil(log_gamma(x)), so two sketches built with the same
+    accuracy merge exactly by adding bucket counts - which is what lets replicas
+    combine their histograms without losing precision.
+    """
+
+    def __init__(self, relative_accuracy: float = LATENCY_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.error_count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def _index(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, index: int) -> float:
+        # Midpoint of the bucket (gamma^(i-1), gamma^i] in the relative-error sense
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value: float, error: bool = False):
+        """Record one latency observation in seconds"""
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        if error:
+            self.error_count += 1
+        if value < MIN_TRACKED_LATENCY:
+            self.zero_count += 1
+        else:
+            index = self._index(value)
+            self.bins[index] = self.bins.get(index, 0) + 1
+
+    def merge(self, other: "LatencySketch"):
+        """Fold another sketch (same accuracy) into this one"""
+        if not math.isclose(other.gamma, self.gamma):
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.error_count += other.error_count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Return the approximate q-quantile (0 <= q <= 1), or None when empty"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "bins": {str(k): v for k, v in self.bins.items()},
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "error_count": self.error_count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LatencySketch":
+        sketch = cls(data.get("relative_accuracy", LATENCY_RELATIVE_ACCURACY))
+        sketch.bins = {int(k): v for k, v in (data.get("bins") or {}).items()}
+        sketch.zero_count = data.get("zero_count", 0)
+        sketch.count = data.get("count", 0)
+        sketch.error_count = data.get("error_count", 0)
+        sketch.sum = data.get("sum", 0.0)
+        sketch.min = data["min"] if data.get("min") is not None else math.inf
+        sketch.max = data.get("max", 0.0)
+        return sketch
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+def summarize(sketch: LatencySketch, window_start: Optional[datetime]) -> Dict[str, Any]:
+    """Percentiles (ms), error rate and throughput (requests/s) for a sketch"""
+    elapsed = 0.0
+    if window_start is not None:
+        elapsed = (datetime.now(timezone.utc) - window_start).total_seconds()
+    return {
+        "count": sketch.count,
+        "p50_ms": _ms(sketch.quantile(0.50)),
+        "p90_ms": _ms(sketch.quantile(0.90)),
+        "p99_ms": _ms(sketch.quantile(0.99)),
+        "mean_ms": _ms(sketch.sum / sketch.count) if sketch.count else None,
+        "max_ms": _ms(sketch.max) if sketch.count else None,
+        "error_rate": sketch.error_count / sketch.count if sketch.count else 0.0,
+        "throughput": sketch.count / max(elapsed, 1.0),
+        "window_start": window_start,
+    }
+
+class LatencyTracker:
+    """Per-model, per-provider latency sketches for this replica plus a merged cluster view.
+
+    Request handlers call record() (in-memory only). A background task persists
+    this replica's cumulative sketches to model_latency_stats and reloads every
+    other replica's rows, so stats() serves merged percentiles without touching
+    the database on the request path. Rows of replicas that stopped persisting
+    (exited processes) are merged into one "retired" row per model and provider
+    and deleted, so their counts stay in the stats without piling up rows.
+    """
+
+    def __init__(self, session_factory=SessionLocal, persist_interval: float = LATENCY_PERSIST_INTERVAL):
+        self.session_factory = session_factory
+        self.persist_interval = persist_interval
+        self._lock = threading.Lock()
+        self._local: Dict[Tuple[str, str], LatencySketch] = {}
+        self._window_start: Dict[Tuple[str, str], datetime] = {}
+        self._remote: Dict[Tuple[str, str], List[Tuple[LatencySketch, datetime]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, model_id: str, provider: Optional[str], latency: float, success: bool = True):
+        key = (model_id, provider or "unknown")
+        with self._lock:
+            sketch = self._local.get(key)
+            if sketch is None:
+                sketch = self._local[key] = LatencySketch()
+                self._window_start[key] = datetime.now(timezone.utc)
+            sketch.add(latency, error=not success)
+
+    def _merged(self, model_id: str) -> Tuple[LatencySketch, Optional[datetime]]:
+        merged = LatencySketch()
+        window_start = None
+        with self._lock:
+            sources = [
+                (sketch, self._window_start[key])
+                for key, sketch in self._local.items() if key[0] == model_id
+            ]
+            for key, rows in self._remote.items():
+                if key[0] == model_id:
+                    sources.extend(rows)
+            for sketch, started in sources:
+                merged.merge(sketch)
+                if started is not None and (window_start is None or started < window_start):
+                    window_start = started
+        return merged, window_start
+
+    def stats(self, model_id: str) -> Optional[Dict[str, Any]]:
+        """Merged stats for a model across providers and replicas, or None if never called"""
+        merged, window_start = self._merged(model_id)
+        if merged.count == 0:
+            return None
+        return summarize(merged, window_start)
+
+    def all_stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            model_ids = {key[0] for key in self._local} | {key[0] for key in self._remote}
+        return {model_id: self.stats(model_id) for model_id in model_ids}
+
+    def load(self):
+        """Resume this replica's sketches and load the others' (blocking)"""
+        db = self.session_factory()
+        try:
+            rows = db.query(ModelLatencyStats).all()
+        finally:
+            db.close()
+
+        remote: Dict[Tuple[str, str], List[Tuple[LatencySketch, datetime]]] = {}
+        with self._lock:
+            for row in rows:
+                key = (row.model_id, row.provider)
+                sketch = LatencySketch.from_dict(row.sketch or {})
+                if row.replica_id == REPLICA_ID:
+                    if key in self._local:
+                        sketch.merge(self._local[key])
+                    self._local[key] = sketch
+                    self._window_start[key] = row.window_start or datetime.now(timezone.utc)
+                else:
+                    remote.setdefault(key, []).append((sketch, row.window_start))
+            self._remote = remote
+
+    def persist(self):
+        """Upsert this replica's cumulative sketches, then refresh the remote view (blocking)"""
+        with self._lock:
+            rows = [
+                {
+                    "id": generate_uuid(),
+                    "model_id": model_id,
+                    "provider": provider,
+                    "replica_id": REPLICA_ID,
+                    "sketch": sketch.to_dict(),
+                    "request_count": sketch.count,
+                    "error_count": sketch.error_count,
+                    "window_start": self._window_start[(model_id, provider)],
+                    "updated_at": datetime.now(timezone.utc),
+                }
+                for (model_id, provider), sketch in self._local.items()
+            ]
+
+        if rows:
+            db = self.session_factory()
+            try:
+                db.execute(upsert_statement(
+                    ModelLatencyStats, rows,
+                    conflict_columns=["model_id", "provider", "replica_id"],
+                    update_columns=["sketch", "request_count", "error_count", "updated_at"]
+                ))
+                db.commit()
+            except Exception:
+                db.rollback()
+                logger.exception("Failed to persist latency sketches")
+            finally:
+                db.close()
+
+        try:
+            self._retire_stale()
+        except Exception:
+            logger.exception("Failed to retire stale latency sketches")
+
+        try:
+            self._refresh_remote()
+        except Exception:
+            logger.exception("Failed to load latency sketches from other replicas")
+
+    def _retire_stale(self):
+        """Merge the rows of replicas gone for LATENCY_REPLICA_TTL into the retired rows"""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=LATENCY_REPLICA_TTL)
+        db = self.session_factory()
+        try:
+            # SKIP LOCKED: replicas retiring at the same time take disjoint rows
+            stale = db.query(ModelLatencyStats).filter(
+                ModelLatencyStats.replica_id.notin_([REPLICA_ID, RETIRED_REPLICA_ID]),
+                ModelLatencyStats.updated_at < cutoff
+            ).with_for_update(skip_locked=True).all()
+            if not stale:
+                return
+            retired = {
+                (row.model_id, row.provider): row
+                for row in db.query(ModelLatencyStats).filter(
+                    ModelLatencyStats.replica_id == RETIRED_REPLICA_ID,
+                    ModelLatencyStats.model_id.in_({row.model_id for row in stale})
+                ).with_for_update().all()
+            }
+            for row in stale:
+                key = (row.model_id, row.provider)
+                sketch = LatencySketch.from_dict(row.sketch or {})
+                target = retired.get(key)
+                if target is None:
+                    target = retired[key] = ModelLatencyStats(
+                        id=generate_uuid(), model_id=row.model_id, provider=row.provider,
+                        replica_id=RETIRED_REPLICA_ID, window_start=row.window_start
+                    )
+                    db.add(target)
+                else:
+                    sketch.merge(LatencySketch.from_dict(target.sketch or {}))
+                target.sketch = sketch.to_dict()
+                target.request_count = sketch.count
+                target.error_count = sketch.error_count
+                if row.window_start is not None and (target.window_start is None or row.window_start < target.window_start):
+                    target.window_start = row.window_start
+                db.delete(row)
+            db.commit()
+            logger.info("Retired %d latency sketch rows of stopped replicas", len(stale))
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _refresh_remote(self):
+        db = self.session_factory()
+        try:
+            rows = db.query(ModelLatencyStats).filter(ModelLatencyStats.replica_id != REPLICA_ID).all()
+        finally:
+            db.close()
+        remote: Dict[Tuple[str, str], List[Tuple[LatencySketch, datetime]]] = {}
+        for row in rows:
+            remote.setdefault((row.model_id, row.provider), []).append(
+                (LatencySketch.from_dict(row.sketch or {}), row.window_start)
+            )
+        with self._lock:
+            self._remote = remote
+
+    async def _run(self):
+        try:
+            await asyncio.to_thread(self.load)
+        except Exception:
+            logger.exception("Failed to load persisted latency sketches")
+        while True:
+            await asyncio.sleep(self.persist_interval)
+            await asyncio.to_thread(self.persist)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.persist)
+
+latency_tracker = LatencyTracker()
+
@@ -1,31 +1,48 @@
 from dotenv import load_dotenv
 load_dotenv()
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Union
 import json
 import logging
 import os
 
-from database import SessionLocal, engine, Base, get_db
+from database import SessionLocal, async_engine, get_pool_status
 from models import (
     User, Model, TestRun, CollaborationSession, APIKey, CodeSession,
     PromptTemplate, ModelBenchmark, ModelMarketplace, UsageStatistics, SystemMetrics
 )
 from schemas import (
-    UserCreate, UserResponse, ModelCreate, ModelResponse,
+    UserCreate, UserResponse, ModelCreate, ModelResponse, ModelSummaryResponse,
     TestRunCreate, TestRunResponse, CodeExecutionRequest,
     CodeExecutionResponse
 )
 from websocket_manager import ConnectionManager
+from usage_tracker import usage_aggregator
+from latency_stats import latency_tracker
+from collaboration_messages import collaboration_messages
+from chat_history_store import chat_history_store
+from read_replicas import get_async_read_db, pin_writes_to_primary, replica_router
+from pagination import NEXT_CURSOR_HEADER, Page, page_params
+from serialization import ORJSONResponse
+from http_cache import CompressionMiddleware, cached_response
+from executor_pool import executor_pool
+from code_jobs import REQUEST_PRIORITY, CodeJobsOverloaded, code_jobs, guest_owner
+from sandbox_client import sandbox_client
 
 # Import the simplified no-auth API routers
 from api_routes_no_auth import skynet_router, code_router, model_router, collab_router, market_router, chat_history_router
+from api_routes_no_auth import ListView, visible_models_response
 
-Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title="Skynet Playground API", version="2.0.0", description="Complete Skynet IDE Platform - No Auth")
+# The schema comes from the Alembic migrations in migrations/; run `alembic upgrade head` first
+app = FastAPI(
+    title="Skynet Playground API",
+    version="2.0.0",
+    description="Complete Skynet IDE Platform - No Auth",
+    default_response_class=ORJSONResponse
+)
 
 # Allow all origins for demo purposes
 app.add_middleware(
@@ -34,10 +51,39 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
+app.add_middleware(CompressionMiddleware)
+if replica_router.replicas:
+    app.middleware("http")(pin_writes_to_primary)
 
 manager = ConnectionManager()
 
+@app.exception_handler(CodeJobsOverloaded)
+async def code_jobs_overloaded(request: Request, exc: CodeJobsOverloaded):
+    return ORJSONResponse({"detail": str(exc)}, status_code=429, headers={"Retry-After": str(exc.retry_after)})
+
+@app.on_event("startup")
+async def start_background_writers():
+    usage_aggregator.start()
+    latency_tracker.start()
+    collaboration_messages.start()
+    replica_router.start()
+    if not sandbox_client.enabled:
+        executor_pool.start()
+
+@app.on_event("shutdown")
+async def stop_background_writers():
+    await usage_aggregator.stop()
+    await latency_tracker.stop()
+    await collaboration_messages.stop()
+    await chat_history_store.close()
+    await replica_router.stop()
+    await code_jobs.stop()
+    await executor_pool.stop()
+    await sandbox_client.stop()
+    await async_engine.dispose()
+
 # Include all the simplified routers
 app.include_router(skynet_router, prefix="/llm", tags=["Skynet"])
 app.include_router(code_router, prefix="/code", tags=["Code Testing"])
@@ -47,39 +93,26 @@ app.include_router(market_router, prefix="/marketplace", tags=["Marketplace"])
 app.include_router(chat_history_router, prefix="/api", tags=["Chat History"])
 
 # Legacy endpoint for backward compatibility with frontend
-@app.get("/models", response_model=list[ModelResponse])
-async def get_models_legacy(db: Session = Depends(get_db)):
-    # Use guest user models
-    models = db.query(Model).filter((Model.user_id == "guest-user") | (Model.is_public == True)).all()
-    return [
-        ModelResponse(
-            id=model.id,
-            name=model.name,
-            type=model.type,
-            status=model.status,
-            user_id=model.user_id,
-            created_at=model.created_at,
-            updated_at=model.updated_at,
-            file_path=model.file_path,
-            config=model.config,
-            provider=model.provider,
-            model_identifier=model.model_identifier,
-            description=model.description,
-            tags=model.tags if model.tags else [],
-            is_public=model.is_public,
-            avg_response_time=model.avg_response_time,
-            total_requests=model.total_requests,
-            success_rate=model.success_rate
-        ) for model in models
-    ]
+@app.get("/models", response_model=List[Union[ModelSummaryResponse, ModelResponse]])
+async def get_models_legacy(
+    request: Request,
+    response: Response,
+    view: ListView = "full",
+    page: Page = Depends(page_params(100)),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    # Use guest user models; same keyset pages (and cache entries) as /models/list
+    return await visible_models_response(request, response, page, view, db)
 
 @app.post("/execute")
-async def execute_code(execution_request: CodeExecutionRequest):
+async def execute_code(execution_request: CodeExecutionRequest, request: Request):
     # Import code testing module
     from code_testing import CodeExecutor
     
     # Execute the code
-    result = await CodeExecutor.execute_code(execution_request.code)
+    async with code_jobs.slot(guest_owner(request), REQUEST_PRIORITY):
+        result = await CodeExecutor.execute_code(execution_request.code)
+    usage_aggregator.record_code_execution("guest-user")
     
     return CodeExecutionResponse(
         success=result["success"],
@@ -88,6 +121,8 @@ async def execute_code(execution_request: CodeExecutionRequest):
         execution_time=result["execution_time"],
         memory_usage=result["memory_usage"],
         cpu_usage=result["cpu_usage"],
+        resources=result["resources"],
+        limit_exceeded=result["limit_exceeded"],
         test_results=result.get("test_results")
     )
 
@@ -128,23 +163,36 @@ async def root():
         "note": "All features accessible without login"
     }
 
-@app.get("/health")
-async def health_check():
-    return {
-        "status": "healthy",
-        "version": "2.0.0",
-        "auth_required": False,
-        "services": {
-            "database": "connected",
-            "skynet_providers": ["openai", "anthropic", "gemini", "custom"],
-            "features": {
-                "code_testing": "enabled",
-                "model_upload": "enabled",
-                "collaboration": "enabled",
-                "marketplace": "enabled"
-            }
+HEALTH = {
+    "status": "healthy",
+    "version": "2.0.0",
+    "auth_required": False,
+    "services": {
+        "database": "connected",
+        "skynet_providers": ["openai", "anthropic", "gemini", "custom"],
+        "features": {
+            "code_testing": "enabled",
+            "model_upload": "enabled",
+            "collaboration": "enabled",
+            "marketplace": "enabled"
         }
     }
+}
+
+@app.get("/health")
+async def health_check(request: Request):
+    return await cached_response(request, "health", lambda: ORJSONResponse(HEALTH))
+
+@app.get("/health/db-pool")
+async def db_pool_health():
+    """Connection pool occupancy, checkout wait and connection churn, and read replica lag"""
+    return {**get_pool_status(), "replicas": replica_router.status()}
+
+@app.get("/health/code-jobs")
+async def code_jobs_health():
+    """Code execution slots in use, queue depth by priority, admissions and rejections, wait / run time
+    percentiles, and the sandbox replicas executions are sent to (if any)"""
+    return {**code_jobs.stats(), "sandboxes": sandbox_client.status()}
 
 if __name__ == "__main__":
     import uvicorn
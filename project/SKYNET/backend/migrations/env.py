@@ -0,0 +1,52 @@
+import time
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import text
+
+from database import engine, Base
+import models  # noqa: F401 - registers all tables on Base.metadata
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+# pg_advisory_lock key held while upgrading, so replicas starting together migrate one at a time
+MIGRATION_LOCK_KEY = 8031
+
+def run_migrations_offline():
+    """Emit SQL to stdout instead of executing it"""
+    context.configure(
+        url=str(engine.url),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    """Run migrations against the database configured by DATABASE_URL"""
+    with engine.connect() as connection:
+        # Session-level, so it outlives the per-revision commits; released when the connection closes.
+        # Polled rather than waited for: a waiting transaction would hold up CREATE INDEX CONCURRENTLY
+        # in the replica that has the lock, and the two would deadlock.
+        while not connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY}).scalar():
+            connection.commit()
+            time.sleep(1)
+        connection.commit()
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            # Each revision commits on its own so CONCURRENTLY index builds can use autocommit blocks
+            transaction_per_migration=True,
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,199 @@
+"""Baseline schema
+
+The schema as Base.metadata.create_all in main.py built it before migrations
+existed, frozen here as explicit DDL. Later revisions change it step by step,
+so this revision must never follow the live models. Tables that already exist
+(databases created by create_all before migrations) are left as they are.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def _created_at():
+    return sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now())
+
+def _updated_at():
+    return sa.Column("updated_at", sa.DateTime(timezone=True))
+
+TABLES = [
+    ("users", [
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("username", sa.String(), nullable=False),
+        sa.Column("hashed_password", sa.String(), nullable=False),
+        sa.Column("is_active", sa.Boolean()),
+        sa.Column("role", sa.String()),
+        _created_at(),
+        _updated_at(),
+        sa.Column("preferences", sa.JSON()),
+        sa.Column("usage_limits", sa.JSON()),
+    ], [("ix_users_email", ["email"], True), ("ix_users_username", ["username"], True)]),
+    ("api_keys", [
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("user_id", sa.String()),
+        sa.Column("provider", sa.String()),
+        sa.Column("encrypted_key", sa.String()),
+        sa.Column("is_active", sa.Boolean()),
+        _created_at(),
+        sa.Column("last_used", sa.DateTime(timezone=True)),
+        sa.Column("usage_count", sa.Integer()),
+    ], []),
+    ("models", [
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("user_id", sa.String()),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("type", sa.String(), nullable=False),
+        sa.Column("provider", sa.String()),
+        sa.Column("model_identifier", sa.String()),
+        sa.Column("file_path", sa.String()),
+        sa.Column("config", sa.JSON()),
+        sa.Column("status", sa.String()),
+        sa.Column("is_public", sa.Boolean()),
+        sa.Column("description", sa.Text()),
+        sa.Column("tags", sa.JSON()),
+        sa.Column("avg_response_time", sa.Float()),
+        sa.Column("total_requests", sa.Integer()),
+        sa.Column("success_rate", sa.Float()),
+        _created_at(),
+        _updated_at(),
+    ], []),
+    ("test_runs", [
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("user_id", sa.String()),
+        sa.Column("model_id", sa.String(), sa.ForeignKey("models.id")),
+        sa.Column("code", sa.Text()),
+        sa.Column("prompt", sa.Text()),
+        sa.Column("results", sa.JSON()),
+        sa.Column("execution_time", sa.Float()),
+        sa.Column("status", sa.String()),
+        sa.Column("test_type", sa.String()),
+        sa.Column("metrics", sa.JSON()),
+        _created_at(),
+    ], []),
+    ("collaboration_sessions", [
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("created_by", sa.String(), sa.ForeignKey("users.id")),
+        sa.Column("session_id", sa.String()),
+        sa.Column("description", sa.Text()),
+        sa.Column("is_active", sa.Boolean()),
+        sa.Column("participants", sa.JSON()),
+        sa.Column("shared_models", sa.JSON()),
+        sa.Column("chat_history", sa.JSON()),
+        _created_at(),
+        _updated_at(),
+    ], [("ix_collaboration_sessions_session_id", ["session_id"], True)]),
+    ("code_sessions", [
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("user_id", sa.String()),
+        sa.Column("name", sa.String()),
+        sa.Column("code", sa.Text()),
+        sa.Column("language", sa.String()),
+        sa.Column("test_code", sa.Text()),
+        sa.Column("analysis_result", sa.JSON()),
+        sa.Column("performance_metrics", sa.JSON()),
+        sa.Column("integrity_check", sa.JSON()),
+        sa.Column("auto_tests", sa.Text()),
+        _created_at(),
+        _updated_at(),
+    ], []),
+    ("prompt_templates", [
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("user_id", sa.String()),
+        sa.Column("name", sa.String()),
+        sa.Column("description", sa.Text()),
+        sa.Column("template", sa.Text()),
+        sa.Column("variables", sa.JSON()),
+        sa.Column("category", sa.String()),
+        sa.Column("is_public", sa.Boolean()),
+        sa.Column("usage_count", sa.Integer()),
+        sa.Column("rating", sa.Float()),
+        _created_at(),
+    ], []),
+    ("model_benchmarks", [
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("model_id", sa.String(), sa.ForeignKey("models.id")),
+        sa.Column("benchmark_name", sa.String()),
+        sa.Column("score", sa.Float()),
+        sa.Column("metrics", sa.JSON()),
+        sa.Column("test_data", sa.JSON()),
+        _created_at(),
+    ], []),
+    ("model_marketplace", [
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("model_id", sa.String(), sa.ForeignKey("models.id"), unique=True),
+        sa.Column("price", sa.Float()),
+        sa.Column("downloads", sa.Integer()),
+        sa.Column("rating", sa.Float()),
+        sa.Column("reviews", sa.JSON()),
+        sa.Column("featured", sa.Boolean()),
+        _created_at(),
+    ], []),
+    ("usage_statistics", [
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("user_id", sa.String()),
+        sa.Column("date", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("api_calls", sa.Integer()),
+        sa.Column("tokens_used", sa.Integer()),
+        sa.Column("models_tested", sa.Integer()),
+        sa.Column("code_executions", sa.Integer()),
+        sa.Column("storage_used", sa.Float()),
+        sa.UniqueConstraint("user_id", "date", name="uq_usage_statistics_user_date"),
+    ], []),
+    ("model_latency_stats", [
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("model_id", sa.String(), nullable=False),
+        sa.Column("provider", sa.String(), nullable=False),
+        sa.Column("replica_id", sa.String(), nullable=False),
+        sa.Column("sketch", sa.JSON(), nullable=False),
+        sa.Column("request_count", sa.Integer()),
+        sa.Column("error_count", sa.Integer()),
+        sa.Column("window_start", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.UniqueConstraint("model_id", "provider", "replica_id", name="uq_model_latency_stats_replica"),
+    ], [("ix_model_latency_stats_model_id", ["model_id"], False)]),
+    ("system_metrics", [
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("timestamp", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("active_users", sa.Integer()),
+        sa.Column("total_requests", sa.Integer()),
+        sa.Column("avg_response_time", sa.Float()),
+        sa.Column("error_rate", sa.Float()),
+        sa.Column("cpu_usage", sa.Float()),
+        sa.Column("memory_usage", sa.Float()),
+    ], []),
+    ("chat_history", [
+        sa.Column("id", sa.String(), primary_key=True),
+        sa.Column("user_id", sa.String()),
+        sa.Column("session_id", sa.String()),
+        sa.Column("model_id", sa.String(), sa.ForeignKey("models.id")),
+        sa.Column("model_name", sa.String()),
+        sa.Column("messages", sa.JSON()),
+        sa.Column("title", sa.String()),
+        _created_at(),
+        _updated_at(),
+    ], [("ix_chat_history_session_id", ["session_id"], False)]),
+]
+
+def upgrade():
+    context = op.get_context()
+    existing = set() if context.as_sql else set(sa.inspect(op.get_bind()).get_table_names())
+    for name, columns, indexes in TABLES:
+        if name in existing:
+            continue
+        op.create_table(name, *columns)
+        for index_name, index_columns, unique in indexes:
+            op.create_index(index_name, name, index_columns, unique=unique)
+
+def downgrade():
+    # Dropping the whole schema is never what a downgrade should do
+    pass
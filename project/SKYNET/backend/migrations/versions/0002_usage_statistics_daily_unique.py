@@ -0,0 +1,58 @@
+"""One usage_statistics row per user per day
+
+Backs the ON CONFLICT upsert used by the usage aggregator. Duplicate rows for the
+same (user_id, date) are folded into one before the constraint is added.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.execute("""
+        WITH ranked AS (
+            SELECT id, user_id, date,
+                   first_value(id) OVER (PARTITION BY user_id, date ORDER BY id) AS keeper
+            FROM usage_statistics
+        ),
+        totals AS (
+            SELECT r.keeper,
+                   sum(u.api_calls) AS api_calls,
+                   sum(u.tokens_used) AS tokens_used,
+                   sum(u.models_tested) AS models_tested,
+                   sum(u.code_executions) AS code_executions,
+                   sum(u.storage_used) AS storage_used
+            FROM usage_statistics u JOIN ranked r ON r.id = u.id
+            GROUP BY r.keeper
+            HAVING count(*) > 1
+        ),
+        merged AS (
+            UPDATE usage_statistics u
+            SET api_calls = t.api_calls, tokens_used = t.tokens_used,
+                models_tested = t.models_tested, code_executions = t.code_executions,
+                storage_used = t.storage_used
+            FROM totals t WHERE u.id = t.keeper
+            RETURNING u.id
+        )
+        DELETE FROM usage_statistics u
+        USING ranked r
+        WHERE u.id = r.id AND r.id <> r.keeper
+    """)
+    op.execute("""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_usage_statistics_user_date') THEN
+                ALTER TABLE usage_statistics
+                    ADD CONSTRAINT uq_usage_statistics_user_date UNIQUE (user_id, date);
+            END IF;
+        END $$
+    """)
+
+def downgrade():
+    op.execute("ALTER TABLE usage_statistics DROP CONSTRAINT IF EXISTS uq_usage_statistics_user_date")
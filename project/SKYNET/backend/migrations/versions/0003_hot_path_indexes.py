@@ -0,0 +1,42 @@
+"""Indexes for the hot router query patterns
+
+- models: owner listing, public marketplace listing, provider/identifier lookups
+- api_keys: (user_id, provider, is_active) lookups on every generate call
+- code_sessions: newest-first listing per user
+- collaboration_sessions: active session listing
+
+Indexes are built CONCURRENTLY so the migration does not block writes on a live
+database.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_models_user_id_created_at", "models (user_id, created_at DESC, id DESC)", None),
+    ("ix_models_public_created_at", "models (created_at DESC, id DESC)", "is_public"),
+    ("ix_models_user_provider_identifier", "models (user_id, provider, model_identifier)", None),
+    ("ix_models_provider", "models (provider)", None),
+    ("ix_api_keys_user_provider_active", "api_keys (user_id, provider, is_active)", None),
+    ("ix_code_sessions_user_created_at", "code_sessions (user_id, created_at DESC, id DESC)", None),
+    ("ix_collaboration_sessions_active_created_at", "collaboration_sessions (created_at DESC, id DESC)", "is_active"),
+]
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, target, predicate in INDEXES:
+            where = f" WHERE {predicate}" if predicate else ""
+            op.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {target}{where}")
+        op.execute("ANALYZE models, api_keys, code_sessions, collaboration_sessions")
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, _, _ in reversed(INDEXES):
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
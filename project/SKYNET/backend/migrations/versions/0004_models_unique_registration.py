@@ -0,0 +1,87 @@
+"""One models row per (user_id, provider, model_identifier)
+
+Backs the ON CONFLICT DO NOTHING bulk registration of provider models. Duplicate
+registrations left behind by concurrent API key additions are collapsed onto the
+oldest row: references from test runs, benchmarks, chat history and marketplace
+listings are repointed before the extra rows are deleted.
+
+The unique index is built CONCURRENTLY and then attached as a constraint; it
+replaces the plain lookup index from 0003.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+DUPLICATES = """
+    CREATE TEMPORARY TABLE model_duplicates ON COMMIT DROP AS
+    SELECT id, keeper FROM (
+        SELECT id,
+               first_value(id) OVER (
+                   PARTITION BY user_id, provider, model_identifier
+                   ORDER BY created_at, id
+               ) AS keeper
+        FROM models
+        WHERE provider IS NOT NULL AND model_identifier IS NOT NULL
+    ) ranked
+    WHERE id <> keeper
+"""
+
+def upgrade():
+    op.execute(DUPLICATES)
+    for table in ("test_runs", "model_benchmarks", "chat_history"):
+        op.execute(f"""
+            UPDATE {table} t SET model_id = d.keeper
+            FROM model_duplicates d WHERE t.model_id = d.id
+        """)
+    # model_marketplace.model_id is unique: keep one listing per group, the keeper's own if any
+    op.execute("""
+        DELETE FROM model_marketplace m
+        USING (
+            SELECT l.id,
+                   row_number() OVER (
+                       PARTITION BY coalesce(d.keeper, l.model_id)
+                       ORDER BY d.id IS NOT NULL, l.id
+                   ) AS rn
+            FROM model_marketplace l
+            LEFT JOIN model_duplicates d ON d.id = l.model_id
+            WHERE coalesce(d.keeper, l.model_id) IN (SELECT keeper FROM model_duplicates)
+        ) ranked
+        WHERE m.id = ranked.id AND ranked.rn > 1
+    """)
+    op.execute("""
+        UPDATE model_marketplace m SET model_id = d.keeper
+        FROM model_duplicates d WHERE m.model_id = d.id
+    """)
+    op.execute("DELETE FROM model_latency_stats s USING model_duplicates d WHERE s.model_id = d.id")
+    op.execute("DELETE FROM models m USING model_duplicates d WHERE m.id = d.id")
+
+    with op.get_context().autocommit_block():
+        op.execute("""
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_models_user_provider_identifier
+            ON models (user_id, provider, model_identifier)
+        """)
+        op.execute("""
+            DO $$
+            BEGIN
+                IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_models_user_provider_identifier') THEN
+                    ALTER TABLE models ADD CONSTRAINT uq_models_user_provider_identifier
+                        UNIQUE USING INDEX uq_models_user_provider_identifier;
+                END IF;
+            END $$
+        """)
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_models_user_provider_identifier")
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_models_user_provider_identifier
+            ON models (user_id, provider, model_identifier)
+        """)
+    op.execute("ALTER TABLE models DROP CONSTRAINT IF EXISTS uq_models_user_provider_identifier")
@@ -0,0 +1,78 @@
+"""Append-only collaboration chat log
+
+Moves collaboration_sessions.chat_history (a JSON array rewritten on every
+message) into collaboration_session_messages, one row per message keyed by
+(session_id, seq). collaboration_sessions.message_seq tracks the last seq
+handed out so writers can reserve blocks of sequence numbers atomically.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.execute("ALTER TABLE collaboration_sessions ADD COLUMN IF NOT EXISTS message_seq INTEGER NOT NULL DEFAULT 0")
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS collaboration_session_messages (
+            id VARCHAR PRIMARY KEY,
+            session_id VARCHAR NOT NULL
+                REFERENCES collaboration_sessions (session_id) ON DELETE CASCADE,
+            seq INTEGER NOT NULL,
+            user_id VARCHAR,
+            message_type VARCHAR,
+            content TEXT,
+            data JSON,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            CONSTRAINT uq_collaboration_session_messages_session_seq UNIQUE (session_id, seq)
+        )
+    """)
+    # Existing arrays become seq 1..n in their stored order (a database whose schema came
+    # from main.py's create_all has no chat_history, in which case there is nothing to move)
+    op.execute("""
+        DO $$
+        BEGIN
+            IF EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'collaboration_sessions' AND column_name = 'chat_history'
+            ) THEN
+                INSERT INTO collaboration_session_messages
+                    (id, session_id, seq, user_id, message_type, content, created_at)
+                SELECT gen_random_uuid()::text, s.session_id, m.seq,
+                       m.value->>'user', 'chat', m.value->>'message',
+                       coalesce((m.value->>'timestamp')::timestamp AT TIME ZONE 'UTC', s.created_at)
+                FROM collaboration_sessions s
+                CROSS JOIN LATERAL json_array_elements(s.chat_history::json) WITH ORDINALITY AS m(value, seq)
+                WHERE s.session_id IS NOT NULL AND json_typeof(s.chat_history::json) = 'array'
+                ON CONFLICT (session_id, seq) DO NOTHING;
+
+                UPDATE collaboration_sessions
+                SET message_seq = greatest(message_seq, json_array_length(chat_history::json))
+                WHERE json_typeof(chat_history::json) = 'array';
+
+                ALTER TABLE collaboration_sessions DROP COLUMN chat_history;
+            END IF;
+        END $$
+    """)
+
+def downgrade():
+    op.execute("ALTER TABLE collaboration_sessions ADD COLUMN IF NOT EXISTS chat_history JSON DEFAULT '[]'")
+    op.execute("""
+        UPDATE collaboration_sessions s
+        SET chat_history = coalesce((
+            SELECT json_agg(json_build_object(
+                       'user', m.user_id,
+                       'message', m.content,
+                       'timestamp', to_char(m.created_at AT TIME ZONE 'UTC', 'YYYY-MM-DD"T"HH24:MI:SS.US')
+                   ) ORDER BY m.seq)
+            FROM collaboration_session_messages m
+            WHERE m.session_id = s.session_id
+        ), '[]'::json)
+    """)
+    op.execute("DROP TABLE IF EXISTS collaboration_session_messages")
+    op.execute("ALTER TABLE collaboration_sessions DROP COLUMN IF EXISTS message_seq")
@@ -0,0 +1,91 @@
+"""chat_history as the local chat store
+
+- messages becomes JSONB (NOT NULL, default []) so appends, counts and page
+  slices run in SQL
+- one chat per (user_id, session_id): duplicates left by the old
+  check-then-insert save are collapsed onto the most recently updated row
+- updated_at is always set, for the (user_id, updated_at DESC, id DESC) keyset
+  listing index
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.execute("""
+        DELETE FROM chat_history c
+        USING (
+            SELECT id,
+                   row_number() OVER (
+                       PARTITION BY user_id, session_id
+                       ORDER BY coalesce(updated_at, created_at) DESC NULLS LAST, id DESC
+                   ) AS rn
+            FROM chat_history
+            WHERE user_id IS NOT NULL AND session_id IS NOT NULL
+        ) ranked
+        WHERE c.id = ranked.id AND ranked.rn > 1
+    """)
+    op.execute("UPDATE chat_history SET updated_at = coalesce(created_at, now()) WHERE updated_at IS NULL")
+    # A schema from main.py's create_all already has JSONB messages, and its
+    # generated search_vector (0007) forbids changing their type
+    op.execute("""
+        DO $$
+        BEGIN
+            IF (
+                SELECT data_type FROM information_schema.columns
+                WHERE table_name = 'chat_history' AND column_name = 'messages'
+            ) <> 'jsonb' THEN
+                ALTER TABLE chat_history
+                    ALTER COLUMN messages DROP DEFAULT,
+                    ALTER COLUMN messages TYPE JSONB USING coalesce(messages::jsonb, '[]'::jsonb);
+            END IF;
+        END $$
+    """)
+    op.execute("UPDATE chat_history SET messages = '[]'::jsonb WHERE messages IS NULL")
+    op.execute("""
+        ALTER TABLE chat_history
+            ALTER COLUMN messages SET DEFAULT '[]'::jsonb,
+            ALTER COLUMN messages SET NOT NULL,
+            ALTER COLUMN updated_at SET DEFAULT now(),
+            ALTER COLUMN updated_at SET NOT NULL
+    """)
+
+    with op.get_context().autocommit_block():
+        op.execute("""
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_chat_history_user_session
+            ON chat_history (user_id, session_id)
+        """)
+        op.execute("""
+            DO $$
+            BEGIN
+                IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_chat_history_user_session') THEN
+                    ALTER TABLE chat_history ADD CONSTRAINT uq_chat_history_user_session
+                        UNIQUE USING INDEX uq_chat_history_user_session;
+                END IF;
+            END $$
+        """)
+        op.execute("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_chat_history_user_updated_at
+            ON chat_history (user_id, updated_at DESC, id DESC)
+        """)
+        op.execute("ANALYZE chat_history")
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_chat_history_user_updated_at")
+    op.execute("ALTER TABLE chat_history DROP CONSTRAINT IF EXISTS uq_chat_history_user_session")
+    op.execute("""
+        ALTER TABLE chat_history
+            ALTER COLUMN messages DROP NOT NULL,
+            ALTER COLUMN messages DROP DEFAULT,
+            ALTER COLUMN messages TYPE JSON USING messages::json,
+            ALTER COLUMN updated_at DROP NOT NULL,
+            ALTER COLUMN updated_at DROP DEFAULT
+    """)
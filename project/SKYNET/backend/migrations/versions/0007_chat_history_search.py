@@ -0,0 +1,40 @@
+"""Full-text search over chat history
+
+Adds chat_history.search_vector, a stored generated tsvector over the title
+(weight A) and each message's content (weight B), and a GIN index on it.
+Adding the column rewrites chat_history once; afterwards Postgres keeps the
+vector current on every insert and update.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+SEARCH_VECTOR = """
+    setweight(to_tsvector('english'::regconfig, coalesce(title, '')), 'A') ||
+    setweight(jsonb_to_tsvector('english'::regconfig,
+                                jsonb_path_query_array(messages, '$[*].content'), '["string"]'), 'B')
+"""
+
+def upgrade():
+    op.execute(f"""
+        ALTER TABLE chat_history
+        ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ({SEARCH_VECTOR}) STORED
+    """)
+    with op.get_context().autocommit_block():
+        op.execute("""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_chat_history_search_vector
+            ON chat_history USING gin (search_vector)
+        """)
+        op.execute("ANALYZE chat_history")
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_chat_history_search_vector")
+    op.execute("ALTER TABLE chat_history DROP COLUMN IF EXISTS search_vector")
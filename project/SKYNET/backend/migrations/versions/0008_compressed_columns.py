@@ -0,0 +1,82 @@
+"""Compress large text / JSON columns
+
+test_runs.results, code_sessions.code / analysis_result / auto_tests and
+model_benchmarks.test_data become bytea holding compressed_types values
+(one codec tag byte + zstd / zlib payload). Existing rows are compressed in
+batches. The columns are set to STORAGE EXTERNAL so Postgres does not try to
+pglz-compress already compressed data again.
+
+chat_history.messages stays JSONB: appends, paging and the search vector work
+on it in SQL.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+import json
+
+from alembic import op
+from sqlalchemy import text
+
+from compressed_types import compress, decompress
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+# (table, column, original type, dictionary name)
+COLUMNS = [
+    ("test_runs", "results", "json", "test_runs.results"),
+    ("code_sessions", "code", "text", "code_sessions.code"),
+    ("code_sessions", "analysis_result", "json", "code_sessions.analysis_result"),
+    ("code_sessions", "auto_tests", "text", "code_sessions.auto_tests"),
+    ("model_benchmarks", "test_data", "json", "model_benchmarks.test_data"),
+]
+
+BATCH_SIZE = 500
+
+def _data_type(table: str, column: str) -> str:
+    return op.get_bind().execute(text(
+        "SELECT data_type FROM information_schema.columns WHERE table_name = :table AND column_name = :column"
+    ), {"table": table, "column": column}).scalar_one()
+
+def _rewrite(table: str, column: str, new_type: str, convert, value_sql: str = ":value"):
+    """Replace column with a new_type column holding convert(old value), in id order batches"""
+    bind = op.get_bind()
+    op.execute(f"ALTER TABLE {table} ADD COLUMN {column}__new {new_type}")
+    last_id = ""
+    while True:
+        rows = bind.execute(text(
+            f"SELECT id, {column} FROM {table} WHERE id > :last_id AND {column} IS NOT NULL ORDER BY id LIMIT :batch"
+        ), {"last_id": last_id, "batch": BATCH_SIZE}).all()
+        if not rows:
+            break
+        bind.execute(
+            text(f"UPDATE {table} SET {column}__new = {value_sql} WHERE id = :id"),
+            [{"id": row_id, "value": convert(value)} for row_id, value in rows]
+        )
+        last_id = rows[-1][0]
+    op.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+    op.execute(f"ALTER TABLE {table} RENAME COLUMN {column}__new TO {column}")
+
+def upgrade():
+    for table, column, kind, dictionary in COLUMNS:
+        # A schema from main.py's create_all already has them as bytea
+        if _data_type(table, column) != "bytea":
+            if kind == "json":
+                encode = lambda value: json.dumps(value, separators=(",", ":")).encode()
+            else:
+                encode = lambda value: value.encode()
+            _rewrite(table, column, "bytea", lambda value: compress(encode(value), dictionary))
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN {column} SET STORAGE EXTERNAL")
+
+def downgrade():
+    for table, column, kind, _ in reversed(COLUMNS):
+        if _data_type(table, column) != "bytea":
+            continue
+        _rewrite(
+            table, column, kind,
+            lambda value: decompress(value).decode(),
+            "CAST(:value AS json)" if kind == "json" else ":value"
+        )
@@ -0,0 +1,186 @@
+import os
+import re
+import stat
+import hashlib
+import threading
+from email.utils import formatdate
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# Chunk size used when the server does not support zero-copy sends
+CHUNK_SIZE = 1024 * 1024
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+# first-pos "-" [ last-pos ], or "-" suffix-length
+BYTE_RANGE_SPEC = re.compile(r"([0-9]*)-([0-9]*)")
+
+# Content hashes keyed by (path, inode, size, mtime_ns) so unchanged files are hashed once
+_etag_cache: Dict[Tuple[str, int, int, int], str] = {}
+_etag_lock = threading.Lock()
+
+def _hash_file(path: str) -> str:
+    """Compute the sha256 digest of a file in fixed-size chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def compute_etag(path: str, stat_result: os.stat_result) -> str:
+    """Return a strong ETag derived from the file content hash"""
+    key = (path, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+    with _etag_lock:
+        cached = _etag_cache.get(key)
+    if cached:
+        return cached
+
+    etag = f'"{_hash_file(path)}"'
+    with _etag_lock:
+        # Drop stale entries for the same path before caching the new hash
+        for stale in [k for k in _etag_cache if k[0] == path]:
+            del _etag_cache[stale]
+        _etag_cache[key] = etag
+    return etag
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header value against an ETag (weak comparison, * matches)"""
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+def if_range_matches(header: Optional[str], etag: str) -> bool:
+    """Check an If-Range header value against an ETag.
+
+    If-Range takes a single strong ETag compared exactly; *, weak ETags, lists
+    and dates never match, so the client gets the full entity.
+    """
+    if not header or etag.startswith("W/"):
+        return False
+    return header.strip() == etag
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single byte range into an inclusive (start, end) pair.
+
+    Returns None when the header is absent or should be ignored: multiple
+    ranges, unknown units, or a range that is not valid syntax (RFC 9110 says
+    to ignore an invalid Range and serve the full entity). Raises ValueError
+    when a valid range cannot be satisfied (it starts past the end, or is an
+    empty suffix).
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec:
+        # Multipart ranges are not supported; serving the full entity is allowed
+        return None
+
+    match = BYTE_RANGE_SPEC.fullmatch(spec)
+    if not match or not any(match.groups()):
+        return None
+    start_str, end_str = match.groups()
+    if start_str == "":
+        # Suffix range: last N bytes
+        length = int(end_str)
+        if length == 0 or size == 0:
+            raise ValueError(f"Unsatisfiable range: {header}")
+        return max(size - length, 0), size - 1
+
+    start = int(start_str)
+    if end_str and int(end_str) < start:
+        return None  # last-pos before first-pos is invalid, not unsatisfiable
+    if start >= size:
+        raise ValueError(f"Unsatisfiable range: {header}")
+    end = min(int(end_str), size - 1) if end_str else size - 1
+    return start, end
+
+class ArtifactFileResponse(Response):
+    """File response with strong ETags, single byte-range support and zero-copy sends.
+
+    When the ASGI server advertises the ``http.response.zerocopysend`` extension the
+    file descriptor is handed to the server (sendfile); otherwise the requested
+    range is streamed in large chunks read off the event loop.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        stat_result: os.stat_result,
+        etag: str,
+        byte_range: Optional[Tuple[int, int]] = None,
+        filename: Optional[str] = None,
+        send_header_only: bool = False,
+    ):
+        self.path = path
+        self.size = stat_result.st_size
+        self.byte_range = byte_range
+        self.send_header_only = send_header_only
+        self.status_code = 206 if byte_range else 200
+        self.media_type = "application/octet-stream"
+        self.background = None
+        self.body = b""
+
+        start, end = byte_range if byte_range else (0, self.size - 1)
+        self.offset = start
+        self.count = max(end - start + 1, 0)
+
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "content-length": str(self.count),
+        }
+        if byte_range:
+            headers["content-range"] = f"bytes {start}-{end}/{self.size}"
+        if filename:
+            headers["content-disposition"] = f"attachment; filename*=utf-8''{quote(filename)}"
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        if self.send_header_only or self.count == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        with open(self.path, "rb") as file:
+            if ZEROCOPY_EXTENSION in scope.get("extensions", {}):
+                await send({
+                    "type": ZEROCOPY_EXTENSION,
+                    "file": file,
+                    "offset": self.offset,
+                    "count": self.count,
+                    "more_body": False,
+                })
+                return
+
+            fd = file.fileno()
+            position = self.offset
+            remaining = self.count
+            while remaining > 0:
+                chunk = await anyio.to_thread.run_sync(os.pread, fd, min(CHUNK_SIZE, remaining), position)
+                if not chunk:
+                    break
+                position += len(chunk)
+                remaining -= len(chunk)
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": remaining > 0,
+                })
+            if remaining > 0:
+                # File shrank underneath us; terminate the body cleanly
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+async def stat_artifact(path: str) -> os.stat_result:
+    """Stat a model artifact; raises OSError as os.stat does, and FileNotFoundError for anything but a regular file"""
+    stat_result = await anyio.to_thread.run_sync(os.stat, path)
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise FileNotFoundError(path)
+    return stat_result
@@ -1,11 +1,13 @@
-from sqlalchemy import Column, String, DateTime, Text, Boolean, Integer, ForeignKey, JSON, Float, Enum
+from sqlalchemy import Column, String, DateTime, Text, Boolean, Integer, ForeignKey, JSON, Float, Enum, UniqueConstraint, Index, Computed
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import deferred, relationship
 import uuid
 import enum
 
 from database import Base
+from compressed_types import CompressedJSON, CompressedText
 
 def generate_uuid():
     return str(uuid.uuid4())
@@ -49,6 +51,9 @@ class APIKey(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     last_used = Column(DateTime(timezone=True))
     usage_count = Column(Integer, default=0)
+
+# Provider key lookup on every generate / health check call
+Index("ix_api_keys_user_provider_active", APIKey.user_id, APIKey.provider, APIKey.is_active)
     
 
 class Model(Base):
@@ -74,6 +79,17 @@ class Model(Base):
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+    # One registration per provider model per user; also serves the (user, provider, identifier) lookup.
+    # Uploaded models without a provider/identifier are unaffected (NULLs never conflict).
+    __table_args__ = (
+        UniqueConstraint("user_id", "provider", "model_identifier", name="uq_models_user_provider_identifier"),
+    )
+
+# /models/list filters on (user_id = ?) OR is_public; each side is paged over its own index
+Index("ix_models_user_id_created_at", Model.user_id, Model.created_at.desc(), Model.id.desc())
+Index("ix_models_public_created_at", Model.created_at.desc(), Model.id.desc(), postgresql_where=Model.is_public)
+Index("ix_models_provider", Model.provider)
     
 
 class TestRun(Base):
@@ -85,7 +101,7 @@ class TestRun(Base):
     model_id = Column(String, ForeignKey("models.id"))
     code = Column(Text)
     prompt = Column(Text, nullable=True)
-    results = Column(JSON, nullable=True)  # Test results and metrics
+    results = Column(CompressedJSON(dictionary="test_runs.results"), nullable=True)  # Test results and metrics
     execution_time = Column(Float)
     status = Column(String, default="pending")  # pending, running, completed, error
     test_type = Column(String)  # unit_test, integration_test, performance_test
@@ -104,25 +120,54 @@ class CollaborationSession(Base):
     is_active = Column(Boolean, default=True)
     participants = Column(JSON, nullable=True)  # List of user IDs in session
     shared_models = Column(JSON, default=[])  # List of model IDs
-    chat_history = Column(JSON, default=[])
+    # Last sequence number handed out to this session's messages (see CollaborationSessionMessage)
+    message_seq = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
+Index(
+    "ix_collaboration_sessions_active_created_at",
+    CollaborationSession.created_at.desc(), CollaborationSession.id.desc(),
+    postgresql_where=CollaborationSession.is_active
+)
+
+class CollaborationSessionMessage(Base):
+    """Append-only chat log of a collaboration session, ordered by seq"""
+    __tablename__ = "collaboration_session_messages"
+
+    id = Column(String, primary_key=True, default=generate_uuid)
+    session_id = Column(
+        String, ForeignKey("collaboration_sessions.session_id", ondelete="CASCADE"), nullable=False
+    )
+    seq = Column(Integer, nullable=False)
+    user_id = Column(String, nullable=True)
+    message_type = Column(String, default="chat")
+    content = Column(Text)
+    data = Column(JSON, nullable=True)  # Extra payload sent with the message
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    # Also the index for reading a session's history in seq order
+    __table_args__ = (
+        UniqueConstraint("session_id", "seq", name="uq_collaboration_session_messages_session_seq"),
+    )
+
 class CodeSession(Base):
     __tablename__ = "code_sessions"
     
     id = Column(String, primary_key=True, default=generate_uuid)
     user_id = Column(String, nullable=True)
     name = Column(String)
-    code = Column(Text)
+    code = Column(CompressedText(dictionary="code_sessions.code"))
     language = Column(String, default="python")
     test_code = Column(Text, nullable=True)
-    analysis_result = Column(JSON)
+    analysis_result = Column(CompressedJSON(dictionary="code_sessions.analysis_result"))
     performance_metrics = Column(JSON)
     integrity_check = Column(JSON)
-    auto_tests = Column(Text, nullable=True)
+    auto_tests = Column(CompressedText(dictionary="code_sessions.auto_tests"), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+
+Index("ix_code_sessions_user_created_at", CodeSession.user_id, CodeSession.created_at.desc(), CodeSession.id.desc())
     
 
 class PromptTemplate(Base):
@@ -149,7 +194,7 @@ class ModelBenchmark(Base):
     benchmark_name = Column(String)
     score = Column(Float)
     metrics = Column(JSON)  # Detailed metrics
-    test_data = Column(JSON)  # Test data used
+    test_data = Column(CompressedJSON(dictionary="model_benchmarks.test_data"))  # Test data used
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
 
@@ -167,6 +212,10 @@ class ModelMarketplace(Base):
     
 class UsageStatistics(Base):
     __tablename__ = "usage_statistics"
+    __table_args__ = (
+        # One row per user per day; the usage aggregator upserts against it
+        UniqueConstraint("user_id", "date", name="uq_usage_statistics_user_date"),
+    )
     
     id = Column(String, primary_key=True, default=generate_uuid)
     user_id = Column(String, nullable=True)
@@ -177,6 +226,23 @@ class UsageStatistics(Base):
     code_executions = Column(Integer, default=0)
     storage_used = Column(Float, default=0)  # in MB
     
+class ModelLatencyStats(Base):
+    __tablename__ = "model_latency_stats"
+    __table_args__ = (
+        # Each replica owns one row per (model, provider); readers merge across replicas
+        UniqueConstraint("model_id", "provider", "replica_id", name="uq_model_latency_stats_replica"),
+    )
+
+    id = Column(String, primary_key=True, default=generate_uuid)
+    model_id = Column(String, index=True, nullable=False)
+    provider = Column(String, nullable=False)
+    replica_id = Column(String, nullable=False)
+    sketch = Column(JSON, nullable=False)  # Serialized LatencySketch bins and counters
+    request_count = Column(Integer, default=0)
+    error_count = Column(Integer, default=0)
+    window_start = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
 class SystemMetrics(Base):
     __tablename__ = "system_metrics"
 
@@ -189,6 +255,13 @@ class SystemMetrics(Base):
     cpu_usage = Column(Float)
     memory_usage = Column(Float)
 
+# Title words rank above message words; only the "content" of each message is indexed
+CHAT_HISTORY_SEARCH_VECTOR = (
+    "setweight(to_tsvector('english'::regconfig, coalesce(title, '')), 'A') || "
+    "setweight(jsonb_to_tsvector('english'::regconfig, "
+    "jsonb_path_query_array(messages, '$[*].content'), '[\"string\"]'), 'B')"
+)
+
 class ChatHistory(Base):
     __tablename__ = "chat_history"
 
@@ -197,7 +270,18 @@ class ChatHistory(Base):
     session_id = Column(String, index=True)
     model_id = Column(String, ForeignKey("models.id"), nullable=True)
     model_name = Column(String)
-    messages = Column(JSON, default=[])
+    messages = Column(JSONB, nullable=False, default=list, server_default="[]")
     title = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+    # Title and message contents for full-text search, kept current by Postgres; never loaded by default
+    search_vector = deferred(Column(TSVECTOR, Computed(CHAT_HISTORY_SEARCH_VECTOR, persisted=True)))
+
+    __table_args__ = (
+        # One chat per session per user; saves upsert against it
+        UniqueConstraint("user_id", "session_id", name="uq_chat_history_user_session"),
+    )
+
+# Chat list is most recently updated first, keyset on (updated_at, id)
+Index("ix_chat_history_user_updated_at", ChatHistory.user_id, ChatHistory.updated_at.desc(), ChatHistory.id.desc())
+Index("ix_chat_history_search_vector", ChatHistory.search_vector, postgresql_using="gin")
\ No newline at end of file
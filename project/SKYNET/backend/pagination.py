@@ -0,0 +1,90 @@
+import base64
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import tuple_
+
+# Upper bound for ?limit= on every list endpoint
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "200"))
+
+# Opaque cursor for the next page; absent on the last page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+@dataclass
+class Page:
+    """Requested page: size plus the (sort key, id) of the last row already seen.
+
+    The sort key is a timestamp for the list endpoints and a rank for search.
+    """
+    limit: int
+    after: Optional[Tuple[Any, str]] = None
+
+def _encode(key: Any, row_id: str) -> str:
+    raw = json.dumps([key, row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode(cursor: str, parse_key: Callable[[Any], Any]) -> Tuple[Any, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key, row_id = json.loads(raw)
+        return parse_key(key), str(row_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid pagination cursor") from e
+
+def encode_cursor(timestamp: datetime, row_id: str) -> str:
+    return _encode(timestamp.isoformat(), row_id)
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Inverse of encode_cursor; raises ValueError for anything malformed"""
+    return _decode(cursor, datetime.fromisoformat)
+
+def encode_rank_cursor(rank: float, row_id: str) -> str:
+    return _encode(rank, row_id)
+
+def decode_rank_cursor(cursor: str) -> Tuple[float, str]:
+    """Inverse of encode_rank_cursor; raises ValueError for anything malformed"""
+    return _decode(cursor, float)
+
+def page_params(
+    default_limit: int,
+    decode: Callable[[str], Tuple[Any, str]] = decode_cursor
+) -> Callable[..., Page]:
+    """Dependency parsing ?limit= and ?cursor= into a Page"""
+    def dependency(
+        limit: int = Query(default_limit, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = Query(None, description=f"Value of the previous page's {NEXT_CURSOR_HEADER} header")
+    ) -> Page:
+        try:
+            after = decode(cursor) if cursor else None
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return Page(limit=limit, after=after)
+    return dependency
+
+def keyset(stmt, page: Page, timestamp_column, id_column):
+    """Order newest first and seek past the cursor; fetches one extra row to detect a next page.
+
+    The seek is a row comparison on (timestamp, id), so it stays an index range scan
+    no matter how deep the page is, unlike OFFSET.
+    """
+    if page.after is not None:
+        stmt = stmt.where(tuple_(timestamp_column, id_column) < tuple_(*page.after))
+    return stmt.order_by(timestamp_column.desc(), id_column.desc()).limit(page.limit + 1)
+
+def finish_page(
+    rows: Sequence[Any],
+    page: Page,
+    response: Response,
+    key: Callable[[Any], Tuple[Any, str]] = lambda row: (row.created_at, row.id),
+    encode: Callable[[Any, str], str] = encode_cursor
+) -> List[Any]:
+    """Trim the look-ahead row and set the next-page cursor header"""
+    rows = list(rows)
+    if len(rows) > page.limit:
+        rows = rows[:page.limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode(*key(rows[-1]))
+    return rows
@@ -0,0 +1,192 @@
+"""
+Read-replica routing for read-only routes.
+
+get_async_read_db hands out a session on one of the streaming replicas in
+DATABASE_REPLICA_URLS (round robin over the healthy ones), or on the primary
+when none is healthy. A replica is healthy when its last lag check succeeded
+and it was at most DB_REPLICA_MAX_LAG seconds behind the primary. The monitor
+re-checks every DB_REPLICA_CHECK_INTERVAL seconds; replicas count as unhealthy
+until their first check, so reads start on the primary.
+
+Read-your-writes: a successful write request pins its client to the primary
+for DB_REPLICA_STICKY_SECONDS through a cookie, which holds across workers.
+There is no fallback keyed by client address: behind a proxy or NAT that
+address is shared, and one client's writes would pin everyone to the primary.
+"""
+import asyncio
+import itertools
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+from fastapi import Request, Response
+from sqlalchemy import text
+
+from database import AsyncSessionLocal, async_engine, async_replica_engines
+
+logger = logging.getLogger(__name__)
+
+# A replica further behind the primary than this is skipped until it catches up
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+# Seconds between replica lag checks, and how long one check may take
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "1"))
+DB_REPLICA_CHECK_TIMEOUT = float(os.getenv("DB_REPLICA_CHECK_TIMEOUT", "2"))
+# How long a client reads from the primary after one of its writes
+DB_REPLICA_STICKY_SECONDS = float(os.getenv("DB_REPLICA_STICKY_SECONDS", "5"))
+
+PRIMARY_COOKIE = "skynet_read_primary_until"
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+# Seconds behind the primary; NULL if it has never replayed a commit. Nothing left to
+# replay counts as 0 however old the last replayed commit is (an idle primary).
+# A server that is not in recovery (e.g. a logical replica) has no lag to measure.
+# Without the primary's LSN (NULL), lag is the age of the last replayed commit.
+REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN CAST(:primary_lsn AS text) IS NULL THEN extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+        WHEN pg_last_wal_replay_lsn() >= CAST(:primary_lsn AS text)::pg_lsn THEN 0
+        ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+    END
+""")
+
+@dataclass
+class ReplicaState:
+    name: str
+    engine: object
+    lag: Optional[float] = None
+    healthy: bool = False
+    error: Optional[str] = None
+    checked_at: Optional[float] = None
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "error": self.error,
+            "checked_ago_seconds": (time.monotonic() - self.checked_at) if self.checked_at else None,
+        }
+
+class ReplicaRouter:
+    """Picks the database for read-only sessions and keeps replica lag current"""
+
+    def __init__(
+        self,
+        replica_engines: List,
+        check_interval: float = DB_REPLICA_CHECK_INTERVAL,
+        max_lag: float = DB_REPLICA_MAX_LAG,
+        sticky_seconds: float = DB_REPLICA_STICKY_SECONDS
+    ):
+        self.replicas = [
+            ReplicaState(name=engine.url.render_as_string(hide_password=True), engine=engine)
+            for engine in replica_engines
+        ]
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self.sticky_seconds = sticky_seconds
+        self._next = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    async def _measure_lag(self, replica: ReplicaState, primary_lsn: Optional[str]) -> Optional[float]:
+        async with replica.engine.connect() as connection:
+            lag = await connection.scalar(REPLICA_LAG_QUERY, {"primary_lsn": primary_lsn})
+        return None if lag is None else float(lag)
+
+    async def _check_replica(self, replica: ReplicaState, primary_lsn: Optional[str]):
+        was_healthy = replica.healthy
+        try:
+            replica.lag = await asyncio.wait_for(self._measure_lag(replica, primary_lsn), DB_REPLICA_CHECK_TIMEOUT)
+            replica.error = None
+            replica.healthy = replica.lag is not None and replica.lag <= self.max_lag
+        except Exception as e:
+            replica.lag = None
+            replica.error = f"{type(e).__name__}: {e}"
+            replica.healthy = False
+        replica.checked_at = time.monotonic()
+
+        if was_healthy and not replica.healthy:
+            logger.warning(
+                "Read replica %s unavailable (lag %s, error %s); reading from the primary",
+                replica.name, replica.lag, replica.error
+            )
+        elif replica.healthy and not was_healthy:
+            logger.info("Read replica %s back in rotation (lag %.3fs)", replica.name, replica.lag)
+
+    async def check(self):
+        """Measure every replica's lag once"""
+        try:
+            async with async_engine.connect() as connection:
+                primary_lsn = await connection.scalar(text("SELECT pg_current_wal_lsn()::text"))
+        except Exception:
+            # Lag then falls back to the age of each replica's last replayed commit
+            primary_lsn = None
+        await asyncio.gather(*(self._check_replica(replica, primary_lsn) for replica in self.replicas))
+
+    def pick(self) -> Optional[ReplicaState]:
+        """Next healthy replica in round robin order, or None to use the primary"""
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._next) % len(healthy)]
+
+    def pin_to_primary(self, request: Request, response: Response):
+        """Send this client's reads to the primary until its write has reached the replicas"""
+        until = time.time() + self.sticky_seconds
+        response.set_cookie(
+            PRIMARY_COOKIE, f"{until:.3f}", max_age=math.ceil(self.sticky_seconds), httponly=True, samesite="lax"
+        )
+
+    def is_pinned(self, request: Request) -> bool:
+        try:
+            return float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def status(self) -> List[dict]:
+        return [replica.status() for replica in self.replicas]
+
+    async def _run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(self.check_interval)
+
+    def start(self):
+        """Start the periodic lag check on the running event loop"""
+        if self.replicas and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Cancel the lag check and close the replica pools"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for replica in self.replicas:
+            replica.healthy = False
+            await replica.engine.dispose()
+
+replica_router = ReplicaRouter(async_replica_engines)
+
+async def pin_writes_to_primary(request: Request, call_next):
+    """HTTP middleware: successful write requests pin their client to the primary"""
+    response = await call_next(request)
+    if request.method in WRITE_METHODS and response.status_code < 400:
+        replica_router.pin_to_primary(request, response)
+    return response
+
+async def get_async_read_db(request: Request):
+    """Get an async session for read-only route handlers, on a replica when one is usable"""
+    replica = None if replica_router.is_pinned(request) else replica_router.pick()
+    async with AsyncSessionLocal(bind=replica.engine if replica else async_engine) as db:
+        try:
+            yield db
+        except Exception:
+            await db.rollback()
+            raise
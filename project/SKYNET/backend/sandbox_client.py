@@ -0,0 +1,153 @@
+"""
+Client for running code on sandbox replicas (sandbox/sandbox_app.py).
+
+With SANDBOX_URLS set to the base URLs of one or more replicas, CodeExecutor
+sends code to a sandbox's /execute instead of forking it from the local
+executor pool. Requests share one pooled HTTP session and go to the replica
+with the fewest requests in flight from this worker (the least recently used
+one on a tie). A replica that refuses the connection is skipped for
+SANDBOX_RETRY_AFTER seconds and the request goes to the next one; once a
+request has reached a replica it is not retried, since the code may have run.
+
+The sandbox reports output, exit status, wall time and which limit ended a
+run, but not the script's resource usage.
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from executor_pool import ExecutionLimits, ExecutionStream, ProcessOutput, ProcessTimeout
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated base URLs of sandbox replicas, e.g. http://sandbox-0:8000,http://sandbox-1:8000;
+# empty runs code locally
+SANDBOX_URLS = [url.strip().rstrip("/") for url in os.getenv("SANDBOX_URLS", "").split(",") if url.strip()]
+# Pooled connections kept per replica
+SANDBOX_MAX_CONNECTIONS = int(os.getenv("SANDBOX_MAX_CONNECTIONS", "32"))
+# Seconds a replica that refused a connection is left out of the rotation
+SANDBOX_RETRY_AFTER = float(os.getenv("SANDBOX_RETRY_AFTER", "10"))
+# Seconds allowed on top of an execution's timeout for the round trip and waiting for a sandbox slot
+SANDBOX_REQUEST_MARGIN = float(os.getenv("SANDBOX_REQUEST_MARGIN", "30"))
+
+class SandboxUnavailable(Exception):
+    """No sandbox replica could take the request, or the one that took it failed"""
+
+@dataclass
+class SandboxReplica:
+    url: str
+    in_flight: int = 0
+    requests: int = 0
+    failures: int = 0
+    down_until: float = 0.0
+    last_picked: float = 0.0
+
+class SandboxClient:
+    """Least-loaded dispatch of code executions over a pooled HTTP session"""
+
+    def __init__(self, urls: List[str] = SANDBOX_URLS, max_connections: int = SANDBOX_MAX_CONNECTIONS):
+        self.replicas = [SandboxReplica(url) for url in urls]
+        self.max_connections = max_connections
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # A session belongs to the loop it was made on (tests and benchmarks run several)
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=0, limit_per_host=self.max_connections)
+            )
+            self._session_loop = loop
+        return self._session
+
+    def _pick(self, tried: List[SandboxReplica]) -> Optional[SandboxReplica]:
+        now = time.monotonic()
+        candidates = [replica for replica in self.replicas if replica not in tried]
+        # Every replica recently refused: try them anyway rather than fail outright
+        up = [replica for replica in candidates if replica.down_until <= now] or candidates
+        return min(up, key=lambda replica: (replica.in_flight, replica.last_picked), default=None)
+
+    async def _post(self, path: str, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        session = self._get_session()
+        tried: List[SandboxReplica] = []
+        while True:
+            replica = self._pick(tried)
+            if replica is None:
+                raise SandboxUnavailable(f"No sandbox replica accepted the request (tried {len(tried)})")
+            tried.append(replica)
+            replica.in_flight += 1
+            replica.requests += 1
+            replica.last_picked = time.monotonic()
+            try:
+                async with session.post(
+                    replica.url + path, json=payload, timeout=aiohttp.ClientTimeout(total=timeout)
+                ) as response:
+                    response.raise_for_status()
+                    return await response.json()
+            except aiohttp.ClientConnectorError as e:
+                # Nothing was sent, so another replica can take it
+                replica.failures += 1
+                replica.down_until = time.monotonic() + SANDBOX_RETRY_AFTER
+                logger.warning("Sandbox %s refused the connection: %s", replica.url, e)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                replica.failures += 1
+                raise SandboxUnavailable(f"Sandbox {replica.url} failed: {e or type(e).__name__}") from e
+            finally:
+                replica.in_flight -= 1
+
+    async def run(self, code: str, timeout: float, limits: ExecutionLimits,
+                  stream: Optional[ExecutionStream] = None, report: bool = False) -> ProcessOutput:
+        """Run code on the least-loaded replica; raises ProcessTimeout like executor_pool.run.
+
+        A stream gets the output in one piece once the run is over. With report,
+        the output carries what the script wrote to its report file.
+        """
+        response = await self._post(
+            "/execute",
+            {"code": code, "timeout": timeout, "limits": asdict(limits), "report": report},
+            timeout + SANDBOX_REQUEST_MARGIN
+        )
+        output = ProcessOutput(
+            returncode=response.get("return_code"),
+            stdout=response.get("output") or "",
+            stderr=response.get("error") or "",
+            execution_time=response.get("execution_time", 0.0),
+            limit_exceeded=response.get("limit_exceeded"),
+            report=response.get("report")
+        )
+        if stream is not None:
+            await stream.output("stdout", output.stdout.encode())
+            await stream.output("stderr", output.stderr.encode())
+        if output.limit_exceeded == "timeout":
+            raise ProcessTimeout(f"Sandbox run did not finish in {timeout} seconds", output)
+        return output
+
+    def status(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [
+            {
+                "url": replica.url,
+                "in_flight": replica.in_flight,
+                "requests": replica.requests,
+                "failures": replica.failures,
+                "available": replica.down_until <= now,
+            }
+            for replica in self.replicas
+        ]
+
+    async def stop(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+sandbox_client = SandboxClient()
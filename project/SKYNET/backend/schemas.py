@@ -1,4 +1,4 @@
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, Field, validator
 from typing import Optional, Dict, Any, List
 from datetime import datetime
 import re
@@ -70,6 +70,17 @@ class ModelCreate(ModelBase):
     tags: Optional[List[str]] = []
     is_public: bool = False
 
+class ModelLatencyStatsResponse(BaseModel):
+    count: int
+    p50_ms: Optional[float]
+    p90_ms: Optional[float]
+    p99_ms: Optional[float]
+    mean_ms: Optional[float]
+    max_ms: Optional[float]
+    error_rate: float
+    throughput: float  # requests per second since window_start
+    window_start: Optional[datetime]
+
 class ModelResponse(ModelBase):
     id: str
     status: str
@@ -86,9 +97,32 @@ class ModelResponse(ModelBase):
     avg_response_time: float
     total_requests: int
     success_rate: float
+    latency: Optional[ModelLatencyStatsResponse] = None
+
+    class Config:
+        from_attributes = True
+
+# Summary projections for list endpoints (?view=summary): heavy text/JSON columns are
+# left out and fetched by id. extra="forbid" keeps full rows from matching the summary
+# schema when a route returns either shape.
+class ModelSummaryResponse(ModelBase):
+    id: str
+    status: str
+    user_id: str
+    provider: Optional[str]
+    model_identifier: Optional[str]
+    created_at: datetime
+    updated_at: Optional[datetime]
+    tags: List[str]
+    is_public: bool
+    avg_response_time: float
+    total_requests: int
+    success_rate: float
+    latency: Optional[ModelLatencyStatsResponse] = None
 
     class Config:
         from_attributes = True
+        extra = "forbid"
 
 # Skynet Generation schemas
 class SkynetGenerateRequest(BaseModel):
@@ -140,13 +174,28 @@ class CodeExecutionRequest(BaseModel):
     analyze: bool = True
     profile: bool = False
 
+class ExecutionResources(BaseModel):
+    """Resource usage of the process that ran the code"""
+    peak_rss_mb: float
+    user_cpu_time: float
+    system_cpu_time: float
+    wall_time: float
+    voluntary_context_switches: int
+    involuntary_context_switches: int
+    read_bytes: int
+    write_bytes: int
+
 class CodeExecutionResponse(BaseModel):
     success: bool
     output: Optional[str] = None
     error: Optional[str] = None
     execution_time: float
-    memory_usage: float
-    cpu_usage: float
+    memory_usage: float  # peak RSS in MB
+    cpu_usage: float  # CPU time as a percentage of wall time
+    resources: Optional[ExecutionResources] = None
+    # Limit that stopped the run ("timeout", "cpu_time", "memory", "file_size", "processes"),
+    # or "output" when only its output was truncated
+    limit_exceeded: Optional[str] = None
     test_results: Optional[List[Dict[str, Any]]]
 
 class CodeAnalysisRequest(BaseModel):
@@ -199,6 +248,18 @@ class CodeSessionResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class CodeSessionSummaryResponse(BaseModel):
+    id: str
+    user_id: str
+    name: str
+    language: str
+    created_at: datetime
+    updated_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+        extra = "forbid"
+
 # Prompt template schemas
 class PromptTemplateCreate(BaseModel):
     name: str
@@ -281,6 +342,31 @@ class CollaborationSessionResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class CollaborationSessionMessageResponse(BaseModel):
+    seq: int
+    session_id: str
+    user_id: Optional[str]
+    message_type: str
+    content: Optional[str]
+    data: Optional[Dict[str, Any]]
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class CollaborationSessionSummaryResponse(BaseModel):
+    id: str
+    name: str
+    session_id: str
+    created_by: str
+    is_active: bool
+    created_at: datetime
+    updated_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+        extra = "forbid"
+
 # Usage statistics schemas
 class UsageStatisticsResponse(BaseModel):
     id: str
@@ -333,6 +419,25 @@ class ChatHistoryUpdate(BaseModel):
     messages: List[Dict[str, Any]]
     title: Optional[str]
 
+class ChatHistoryAppend(BaseModel):
+    # Number of messages the client knows are stored; the append is rejected (409) otherwise
+    expected_seq: int = Field(ge=0)
+    messages: List[Dict[str, Any]]
+    model_id: Optional[str] = None
+    model_name: Optional[str] = None  # Required when the append creates the chat
+    title: Optional[str] = None
+
+class ChatHistoryAppendResponse(BaseModel):
+    session_id: str
+    seq: int  # Messages stored after the append; send as the next expected_seq
+    appended: int
+
+class ChatHistoryMessagesResponse(BaseModel):
+    session_id: str
+    seq: int  # Total messages stored
+    first_seq: int  # seq of messages[0]; messages are numbered from 1
+    messages: List[Dict[str, Any]]
+
 class ChatHistoryResponse(BaseModel):
     id: str
     user_id: Optional[str]
@@ -347,6 +452,24 @@ class ChatHistoryResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class ChatHistorySummaryResponse(BaseModel):
+    id: str
+    user_id: Optional[str]
+    session_id: str
+    model_id: Optional[str]
+    model_name: str
+    title: Optional[str]
+    created_at: datetime
+    updated_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+        extra = "forbid"
+
+class ChatHistorySearchResult(ChatHistorySummaryResponse):
+    rank: float
+    snippet: Optional[str]  # Best matching message fragments, matches in **bold**
+
 # Code optimization schemas
 class CodeOptimizationRequest(BaseModel):
     code: str
@@ -0,0 +1,33 @@
+"""
+Fast response serialization.
+
+ORJSONResponse is the app's default response class. List routes go further:
+they select plain column tuples (response_columns) instead of ORM entities,
+turn each row into a dict with exactly the response schema's fields and return
+rows_response(...), which is encoded with orjson as is. A returned Response
+skips FastAPI's per-item validation against response_model, which still
+documents the shape in OpenAPI.
+"""
+from typing import Any, Dict, List, Type
+
+import orjson
+from fastapi import Response
+from fastapi.responses import ORJSONResponse as _ORJSONResponse
+from pydantic import BaseModel
+
+class ORJSONResponse(_ORJSONResponse):
+    """orjson encoding; UTC datetimes end in "Z" like pydantic's, so both paths emit the same JSON"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+
+def response_columns(entity, schema: Type[BaseModel]) -> tuple:
+    """entity's columns named like schema's fields, in schema order"""
+    columns = entity.__table__.columns
+    return tuple(getattr(entity, name) for name in schema.model_fields if name in columns)
+
+def rows_response(rows: List[Dict[str, Any]], response: Response) -> ORJSONResponse:
+    """Encode response-shaped row dicts, keeping headers the route set on its Response (e.g. the next cursor)"""
+    encoded = ORJSONResponse(rows)
+    encoded.raw_headers.extend((name, value) for name, value in response.raw_headers if name != b"content-length")
+    return encoded
@@ -0,0 +1,206 @@
+"""
+Test runner for CodeExecutor.run_tests; this file runs in the child, not the API.
+
+CodeExecutor.run_tests does not run test code as it is. It sends a script made
+of this file followed by a call to run_tests() with the test code as a string.
+The test code then runs as __main__ from "test_code.py" (registered with
+linecache, so tracebacks show its lines), with unittest.main() replaced by one
+that runs the tests with a result class that records every test. Test code
+that defines TestCases but never calls unittest.main() gets them run as well.
+
+The records go to "<script>.report.json" next to the script, not to stdout, so
+whatever the tests print cannot garble them. Each has the test id, status
+("passed", "failed", "error", "skipped", "expected_failure" or
+"unexpected_success"), duration, the output the test printed and its traceback.
+The usual unittest progress and summary still go to stderr.
+
+When a run is split into shards (test_shards.py), each shard runs only the
+tests its include list names ("Class" or "Class.test_method"), or, for the
+first shard, every test the exclude list does not name. With a test timeout
+each test runs under a SIGALRM timer and is stopped and reported as "timeout"
+when that runs out, so the tests after it still run.
+
+Only the standard library is imported here.
+"""
+import builtins
+import io
+import json
+import linecache
+import signal
+import sys
+import time
+import traceback
+import types
+import unittest
+from typing import Any, Dict, List, Optional
+
+TEST_FILENAME = "test_code.py"
+# Characters of output and of traceback kept per test
+MAX_TEST_OUTPUT = 8 * 1024
+
+def clip(text: str, limit: int = MAX_TEST_OUTPUT) -> str:
+    if len(text) <= limit:
+        return text
+    return text[:limit] + f"\n... [{len(text) - limit:,} characters truncated]"
+
+def test_name(test: unittest.TestCase) -> str:
+    name = test.id()
+    return name[len("__main__."):] if name.startswith("__main__.") else name
+
+def named(name: str, names: List[str]) -> bool:
+    return any(name == other or name.startswith(other + ".") for other in names)
+
+def flatten(suite: unittest.TestSuite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from flatten(test)
+        else:
+            yield test
+
+class TestTimeout(BaseException):
+    """Raised in a test that ran out of time; a BaseException so `except Exception` cannot swallow it"""
+
+class ReportingResult(unittest.TextTestResult):
+    """TextTestResult that also keeps a record per test, with what it printed"""
+
+    # Seconds each test may take; 0 for no limit
+    test_timeout = 0.0
+
+    def __init__(self, stream, descriptions, verbosity, **kwargs):
+        super().__init__(stream, descriptions, verbosity, **kwargs)
+        self.records: List[Dict[str, Any]] = []
+        self._current: Optional[unittest.TestCase] = None
+
+    def startTest(self, test):
+        super().startTest(test)
+        self._current = test
+        self._outcome = ("passed", None, None)
+        self._saved_streams = sys.stdout, sys.stderr
+        self._captured = io.StringIO()
+        sys.stdout = sys.stderr = self._captured
+        if self.test_timeout:
+            signal.setitimer(signal.ITIMER_REAL, self.test_timeout)
+        self._started = time.perf_counter()
+
+    def stopTest(self, test):
+        duration = time.perf_counter() - self._started
+        if self.test_timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        sys.stdout, sys.stderr = self._saved_streams
+        status, message, tb = self._outcome
+        self.records.append({
+            "name": test_name(test),
+            "status": status,
+            "duration": duration,
+            "output": clip(self._captured.getvalue()),
+            "message": message,
+            "traceback": tb,
+        })
+        self._current = None
+        super().stopTest(test)
+
+    def _record(self, test, status: str, err=None, message: Optional[str] = None):
+        tb = clip(self._exc_info_to_string(err, test)) if err else None
+        if message is None and tb:
+            message = tb.rstrip().splitlines()[-1]
+        if self._current is None:
+            # setUpClass / setUpModule failures are reported outside any test
+            self.records.append({
+                "name": str(test), "status": status, "duration": 0.0, "output": "", "message": message, "traceback": tb
+            })
+        elif self._outcome[0] == "passed":
+            # The first problem decides; subtests can report several
+            self._outcome = (status, message, tb)
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._record(test, "failed", err)
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self._record(test, "timeout" if issubclass(err[0], TestTimeout) else "error", err)
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._record(test, "skipped", message=reason)
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self._record(test, "expected_failure", err)
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._record(test, "unexpected_success", message="Unexpected success")
+
+    def addSubTest(self, test, subtest, err):
+        super().addSubTest(test, subtest, err)
+        if err is not None:
+            self._record(test, "failed" if issubclass(err[0], test.failureException) else "error", err)
+
+def run_tests(source: str, report_path: str, include: Optional[List[str]] = None,
+              exclude: Optional[List[str]] = None, test_timeout: float = 0.0) -> int:
+    """Run source as the test module and write the report; returns the exit code"""
+    linecache.cache[TEST_FILENAME] = (len(source), None, source.splitlines(True), TEST_FILENAME)
+    module = types.ModuleType("__main__")
+    module.__file__ = TEST_FILENAME
+    module.__builtins__ = builtins
+    sys.modules["__main__"] = module
+    results: List[ReportingResult] = []
+
+    class ReportingRunner(unittest.TextTestRunner):
+        resultclass = ReportingResult
+
+        def run(self, test):
+            if include is not None:
+                test = unittest.TestSuite(t for t in flatten(test) if named(test_name(t), include))
+            elif exclude is not None:
+                test = unittest.TestSuite(t for t in flatten(test) if not named(test_name(t), exclude))
+            result = super().run(test)
+            results.append(result)
+            return result
+
+    unittest_main = unittest.main
+
+    def main(*args, **kwargs):
+        kwargs["testRunner"] = ReportingRunner
+        return unittest_main(*args, **kwargs)
+
+    def on_alarm(signum, frame):
+        raise TestTimeout(f"Test did not finish in {test_timeout:g} seconds")
+
+    if test_timeout:
+        ReportingResult.test_timeout = test_timeout
+        signal.signal(signal.SIGALRM, on_alarm)
+    unittest.main = main
+    error = None
+    exit_code = 0
+    started = time.perf_counter()
+    try:
+        exec(compile(source, TEST_FILENAME, "exec"), module.__dict__)
+        if not results:
+            # No unittest.main() call; run what the module defines, if anything
+            suite = unittest.defaultTestLoader.loadTestsFromModule(module)
+            if suite.countTestCases():
+                ReportingRunner().run(suite)
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException as e:
+        # Start the traceback at the test code, as the interpreter's would
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != TEST_FILENAME:
+            tb = tb.tb_next
+        error = clip("".join(traceback.format_exception(type(e), e, tb)))
+        print(error, end="", file=sys.stderr)
+        exit_code = 1
+    finally:
+        unittest.main = unittest_main
+
+    if results and not all(result.wasSuccessful() for result in results):
+        exit_code = exit_code or 1
+    with open(report_path, "w") as f:
+        json.dump({
+            "tests": [record for result in results for record in result.records],
+            "error": error,
+            "duration": time.perf_counter() - started,
+        }, f)
+    return exit_code
@@ -0,0 +1,148 @@
+"""
+Splitting a test run across processes, for CodeExecutor.run_tests.
+
+collect_units() reads the TestCase classes out of the test code without
+running it. Each test method is a unit that can go to any shard. A class with
+setUpClass / tearDownClass, or one that inherits from another class in the
+same code, is a single unit, so its fixtures run once and inherited tests
+are not missed.
+
+plan_shards() estimates each unit from test_durations and hands the longest
+unit to the least loaded shard, then the next longest, and so on. Wall time
+then comes close to the total divided by the number of shards. A unit's
+duration history is keyed on its source and on the module code outside the
+test classes (the code under test), so editing either starts it over. Suites
+too short to be worth the extra processes stay in one shard.
+
+Tests the parser cannot see (made at runtime, or by load_tests) are not in any
+unit; the first shard runs everything the other shards don't, so they still
+run exactly once.
+"""
+import ast
+import hashlib
+import heapq
+import math
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+# Processes one test run is split across
+CODE_TEST_WORKERS = int(os.getenv("CODE_TEST_WORKERS", str(os.cpu_count() or 1)))
+# Estimated seconds of tests per shard below which a run is not split further
+CODE_TEST_SHARD_MIN_SECONDS = float(os.getenv("CODE_TEST_SHARD_MIN_SECONDS", "0.5"))
+# Seconds assumed for a test that has never run
+CODE_TEST_DEFAULT_SECONDS = float(os.getenv("CODE_TEST_DEFAULT_SECONDS", "0.1"))
+# Units whose durations are remembered, least recently run dropped first
+CODE_TEST_HISTORY_SIZE = int(os.getenv("CODE_TEST_HISTORY_SIZE", "10000"))
+# Weight of the latest run in a unit's remembered duration
+CODE_TEST_HISTORY_WEIGHT = float(os.getenv("CODE_TEST_HISTORY_WEIGHT", "0.5"))
+
+CLASS_FIXTURES = ("setUpClass", "tearDownClass")
+
+@dataclass
+class TestUnit:
+    # "Class.test_method", or "Class" for a class that runs whole
+    name: str
+    # test_durations key
+    key: str
+    tests: int = 1
+    estimate: float = 0.0
+
+    def covers(self, test_name: str) -> bool:
+        return test_name == self.name or test_name.startswith(self.name + ".")
+
+class TestDurations:
+    """Exponentially weighted duration of each unit over the runs this process has seen"""
+
+    def __init__(self, max_entries: int = CODE_TEST_HISTORY_SIZE, weight: float = CODE_TEST_HISTORY_WEIGHT):
+        self.max_entries = max_entries
+        self.weight = weight
+        self._durations: "OrderedDict[str, float]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[float]:
+        return self._durations.get(key)
+
+    def record(self, key: str, duration: float):
+        previous = self._durations.pop(key, None)
+        if previous is not None:
+            duration = self.weight * duration + (1 - self.weight) * previous
+        self._durations[key] = duration
+        while len(self._durations) > self.max_entries:
+            self._durations.popitem(last=False)
+
+test_durations = TestDurations()
+
+def _digest(*parts: str) -> str:
+    return hashlib.sha1("\0".join(parts).encode()).hexdigest()[:16]
+
+def _is_test_case(node: ast.ClassDef) -> bool:
+    return any(ast.unparse(base).endswith("TestCase") for base in node.bases)
+
+def collect_units(test_code: str) -> List[TestUnit]:
+    """The TestCase classes and test methods defined at the top level of test_code"""
+    try:
+        tree = ast.parse(test_code)
+    except SyntaxError:
+        return []
+    classes, class_names = [], set()
+    for node in tree.body:
+        # A subclass of a TestCase defined above is one too, whatever its name
+        if isinstance(node, ast.ClassDef) and (
+            _is_test_case(node) or any(ast.unparse(base) in class_names for base in node.bases)
+        ):
+            classes.append(node)
+            class_names.add(node.name)
+    context = _digest(*(ast.unparse(node) for node in tree.body if node not in classes))
+
+    units = []
+    for node in classes:
+        methods = {
+            item.name: item for item in node.body
+            if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef))
+        }
+        tests = [name for name in methods if name.startswith("test")]
+        inherits = any(ast.unparse(base) in class_names for base in node.bases)
+        if inherits or any(name in methods for name in CLASS_FIXTURES):
+            units.append(TestUnit(node.name, _digest(context, ast.unparse(node)), max(len(tests), 1)))
+            continue
+        # setUp / tearDown and helpers belong to every test in the class
+        shared = "\n".join(ast.unparse(item) for item in node.body if getattr(item, "name", None) not in tests)
+        for name in tests:
+            units.append(TestUnit(
+                f"{node.name}.{name}", _digest(context, node.name, shared, ast.unparse(methods[name]))
+            ))
+    return units
+
+def plan_shards(units: List[TestUnit], workers: int = CODE_TEST_WORKERS,
+                durations: TestDurations = test_durations) -> List[List[TestUnit]]:
+    """Split units into at most workers shards of about equal estimated duration.
+
+    Sets each unit's estimate. A single shard means the run is not worth splitting.
+    """
+    known = [durations.get(unit.key) for unit in units]
+    known_per_test = [d / unit.tests for unit, d in zip(units, known) if d is not None]
+    default = sum(known_per_test) / len(known_per_test) if known_per_test else CODE_TEST_DEFAULT_SECONDS
+    for unit, duration in zip(units, known):
+        unit.estimate = duration if duration is not None else default * unit.tests
+
+    total = sum(unit.estimate for unit in units)
+    count = min(workers, len(units), math.ceil(total / CODE_TEST_SHARD_MIN_SECONDS) if total > 0 else 1)
+    if count <= 1:
+        return [units]
+
+    shards: List[List[TestUnit]] = [[] for _ in range(count)]
+    loads = [(0.0, index) for index in range(count)]
+    for unit in sorted(units, key=lambda unit: unit.estimate, reverse=True):
+        load, index = heapq.heappop(loads)
+        shards[index].append(unit)
+        heapq.heappush(loads, (load + unit.estimate, index))
+    return shards
+
+def record_durations(units: List[TestUnit], test_times: Dict[str, float],
+                     durations: TestDurations = test_durations):
+    """Remember how long each unit took, from the durations of the tests it covers"""
+    for unit in units:
+        times = [duration for name, duration in test_times.items() if unit.covers(name)]
+        if times:
+            durations.record(unit.key, sum(times))
@@ -0,0 +1,4 @@
+import os
+
+# database.py needs a URL at import; none of these tests connects to it
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/skynet_test")
@@ -0,0 +1,243 @@
+import asyncio
+
+import pytest
+
+from code_jobs import (
+    BACKGROUND_PRIORITY, PRIORITIES, REQUEST_PRIORITY, STREAM_PRIORITY, CodeJobScheduler, CodeJobsOverloaded
+)
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+async def hold(scheduler, owner, release, log=None, priority="normal", name=None):
+    async with scheduler.slot(owner, priority):
+        if log is not None:
+            log.append(name or owner)
+        await release.wait()
+
+def test_never_runs_more_than_max_running():
+    async def scenario():
+        scheduler = CodeJobScheduler(max_running=2, max_running_per_owner=5)
+        active, peak = 0, 0
+
+        async def job(owner):
+            nonlocal active, peak
+            async with scheduler.slot(owner):
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+
+        await asyncio.gather(*(job(f"owner-{i % 3}") for i in range(8)))
+        return scheduler, peak
+
+    scheduler, peak = run(scenario())
+    assert peak == 2
+    assert (scheduler.running, scheduler.queued, scheduler.admitted) == (0, 0, 8)
+
+def test_higher_priority_first_then_arrival_order():
+    async def scenario():
+        scheduler = CodeJobScheduler(max_running=1, max_running_per_owner=5)
+        blocker, release, log = asyncio.Event(), asyncio.Event(), []
+        first = asyncio.create_task(hold(scheduler, "a", blocker))
+        await settle()
+        tasks = []
+        for name, priority in [("low-1", "low"), ("normal-1", "normal"), ("high-1", "high"),
+                               ("normal-2", "normal"), ("high-2", "high")]:
+            tasks.append(asyncio.create_task(hold(scheduler, name, release, log, priority)))
+            await settle()
+        release.set()
+        blocker.set()
+        await asyncio.gather(first, *tasks)
+        return log
+
+    assert run(scenario()) == ["high-1", "high-2", "normal-1", "normal-2", "low-1"]
+
+def test_owner_over_running_quota_is_skipped():
+    async def scenario():
+        scheduler = CodeJobScheduler(max_running=2, max_running_per_owner=1)
+        release, log = asyncio.Event(), []
+        tasks = [asyncio.create_task(hold(scheduler, "a", release, log, name="a-1"))]
+        await settle()
+        tasks.append(asyncio.create_task(hold(scheduler, "a", release, log, name="a-2")))
+        await settle()
+        tasks.append(asyncio.create_task(hold(scheduler, "b", release, log, name="b-1")))
+        await settle()
+        admitted_before_release = list(log)
+        release.set()
+        await asyncio.gather(*tasks)
+        return admitted_before_release, log
+
+    before, log = run(scenario())
+    # b overtakes a's second execution, which waits for a's first to finish
+    assert before == ["a-1", "b-1"]
+    assert log == ["a-1", "b-1", "a-2"]
+
+def test_full_queue_is_refused_without_queueing():
+    async def scenario():
+        scheduler = CodeJobScheduler(max_running=1, max_queued=2, max_running_per_owner=5, max_queued_per_owner=5)
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(hold(scheduler, f"owner-{i}", release)) for i in range(3)]
+        await settle()
+        with pytest.raises(CodeJobsOverloaded) as raised:
+            async with scheduler.slot("late"):
+                pass
+        queued = scheduler.queued
+        release.set()
+        await asyncio.gather(*tasks)
+        return scheduler, raised.value, queued
+
+    scheduler, error, queued = run(scenario())
+    assert queued == 2
+    assert error.retry_after >= 1
+    assert scheduler.rejected == {"queue_full": 1, "owner_quota": 0}
+
+def test_owner_queue_quota():
+    async def scenario():
+        scheduler = CodeJobScheduler(max_running=1, max_queued=10, max_running_per_owner=1, max_queued_per_owner=2)
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(hold(scheduler, "greedy", release)) for _ in range(3)]
+        await settle()
+        with pytest.raises(CodeJobsOverloaded):
+            scheduler.check_admission("greedy")
+        scheduler.check_admission("polite")  # other owners still get in
+        release.set()
+        await asyncio.gather(*tasks)
+        return scheduler
+
+    assert run(scenario()).rejected == {"queue_full": 0, "owner_quota": 1}
+
+def test_cancelled_waiter_leaves_queue_and_frees_nothing():
+    async def scenario():
+        scheduler = CodeJobScheduler(max_running=1, max_running_per_owner=5)
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(scheduler, "a", release))
+        await settle()
+        waiter = asyncio.create_task(hold(scheduler, "b", release))
+        await settle()
+        assert scheduler.queued == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        queued_after_cancel = scheduler.queued
+        release.set()
+        await holder
+        async with scheduler.slot("c"):
+            running = scheduler.running
+        return scheduler, queued_after_cancel, running
+
+    scheduler, queued, running = run(scenario())
+    assert queued == 0
+    assert running == 1
+    assert (scheduler.running, scheduler.queued) == (0, 0)
+
+def test_extra_slots_only_when_free_and_nobody_waits():
+    async def scenario():
+        scheduler = CodeJobScheduler(max_running=4, max_running_per_owner=5)
+        release = asyncio.Event()
+        busy = [asyncio.create_task(hold(scheduler, f"o{i}", release)) for i in range(2)]
+        await settle()
+        async with scheduler.extra_slots(5) as extra:
+            during = (extra, scheduler.running)
+        after = scheduler.running
+
+        async with scheduler.extra_slots(2) as extra:
+            # The slots taken are not free for queued executions
+            queued = asyncio.create_task(hold(scheduler, "late", release))
+            await settle()
+            blocked = (extra, scheduler.queued)
+        await settle()
+        admitted_after = scheduler.queued
+
+        release.set()
+        await asyncio.gather(*busy, queued)
+        return during, after, blocked, admitted_after
+
+    during, after, blocked, admitted_after = run(scenario())
+    assert during == (2, 4)
+    assert after == 2
+    assert blocked == (2, 1)
+    assert admitted_after == 0
+
+def test_no_extra_slots_while_executions_wait():
+    async def scenario():
+        scheduler = CodeJobScheduler(max_running=2, max_running_per_owner=1)
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(hold(scheduler, "a", release)) for _ in range(2)]
+        await settle()
+        # One slot is free, but a's second execution waits for its quota
+        async with scheduler.extra_slots(1) as extra:
+            pass
+        release.set()
+        await asyncio.gather(*tasks)
+        return extra
+
+    assert run(scenario()) == 0
+
+def test_submitted_jobs_report_outcomes():
+    async def scenario():
+        scheduler = CodeJobScheduler(max_running=1, max_running_per_owner=5)
+
+        async def succeed():
+            return {"ok": True}
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        ok = scheduler.submit("execute", "a", BACKGROUND_PRIORITY, succeed)
+        bad = scheduler.submit("execute", "a", BACKGROUND_PRIORITY, fail)
+        assert scheduler.job_status(bad)["position"] == 1
+        await ok.wait(5)
+        await bad.wait(5)
+        return scheduler, ok, bad
+
+    scheduler, ok, bad = run(scenario())
+    assert (ok.status, ok.result) == ("succeeded", {"ok": True})
+    assert (bad.status, bad.error) == ("failed", "boom")
+    assert scheduler.outcomes == {"succeeded": 1, "failed": 1, "cancelled": 0}
+    assert scheduler.get(ok.id) is ok
+
+def test_cancelling_jobs_releases_their_slots():
+    async def scenario():
+        scheduler = CodeJobScheduler(max_running=1, max_running_per_owner=5)
+        started = asyncio.Event()
+
+        async def forever():
+            started.set()
+            await asyncio.Event().wait()
+
+        running = scheduler.submit("execute", "a", BACKGROUND_PRIORITY, forever)
+        queued = scheduler.submit("execute", "b", BACKGROUND_PRIORITY, forever)
+        await started.wait()
+        scheduler.cancel(queued)
+        await queued.wait(5)
+        scheduler.cancel(running)
+        await running.wait(5)
+        return scheduler, running, queued
+
+    scheduler, running, queued = run(scenario())
+    assert (running.status, queued.status) == ("cancelled", "cancelled")
+    assert queued.started_at is None
+    assert (scheduler.running, scheduler.queued) == (0, 0)
+
+def test_finished_jobs_are_pruned():
+    async def scenario():
+        scheduler = CodeJobScheduler(max_running=2, max_finished=2)
+
+        async def nothing():
+            return None
+
+        jobs = [scheduler.submit("execute", f"o{i}", BACKGROUND_PRIORITY, nothing) for i in range(4)]
+        for job in jobs:
+            await job.wait(5)
+        return scheduler, jobs
+
+    scheduler, jobs = run(scenario())
+    assert scheduler.get(jobs[0].id) is None
+    assert [job.id for job in scheduler.jobs.values()] == [job.id for job in jobs[2:]]
+
+def test_server_side_priorities_rank_streams_over_requests_over_jobs():
+    assert PRIORITIES.index(STREAM_PRIORITY) < PRIORITIES.index(REQUEST_PRIORITY) < PRIORITIES.index(BACKGROUND_PRIORITY)
@@ -0,0 +1,198 @@
+import asyncio
+import gzip
+
+import pytest
+from fastapi import Request, Response
+
+import http_cache
+from http_cache import CatalogCache, cached_response, choose_encoding, encoded_etag
+
+def request(headers=None) -> Request:
+    raw = [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw, "query_string": b""})
+
+class Builder:
+    """Counts builds; each waits for release when gated"""
+
+    def __init__(self, body: bytes = b'{"models": []}', gated: bool = False):
+        self.body = body
+        self.calls = 0
+        self.release = asyncio.Event()
+        if not gated:
+            self.release.set()
+
+    async def __call__(self) -> Response:
+        self.calls += 1
+        await self.release.wait()
+        return Response(self.body, media_type="application/json")
+
+def test_repeat_gets_are_served_from_memory():
+    async def scenario():
+        cache, build = CatalogCache(ttl=60), Builder()
+        first = await cache.get("models", build)
+        second = await cache.get("models", build)
+        return cache, build, first, second
+
+    cache, build, first, second = asyncio.run(scenario())
+    assert build.calls == 1
+    assert second is first
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1}
+
+def test_concurrent_misses_share_one_build():
+    async def scenario():
+        cache, build = CatalogCache(ttl=60), Builder(gated=True)
+        gets = [asyncio.create_task(cache.get("models", build)) for _ in range(5)]
+        await asyncio.sleep(0)
+        build.release.set()
+        return build, await asyncio.gather(*gets)
+
+    build, entries = asyncio.run(scenario())
+    assert build.calls == 1
+    assert all(entry is entries[0] for entry in entries)
+
+def test_expired_entry_is_rebuilt(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(http_cache.time, "monotonic", lambda: now[0])
+
+    async def scenario():
+        cache, build = CatalogCache(ttl=5), Builder()
+        await cache.get("models", build)
+        now[0] += 4.9
+        await cache.get("models", build)
+        now[0] += 0.2
+        await cache.get("models", build)
+        return build
+
+    assert asyncio.run(scenario()).calls == 2
+
+def test_invalidate_drops_entries_and_discards_running_builds():
+    async def scenario():
+        cache = CatalogCache(ttl=60)
+        await cache.get("models", Builder())
+        cache.invalidate()
+        assert cache.stats()["entries"] == 0
+
+        build = Builder(gated=True)
+        pending = asyncio.create_task(cache.get("models", build))
+        await asyncio.sleep(0)
+        cache.invalidate()  # a write lands while the old data is being read
+        build.release.set()
+        await pending
+        await cache.get("models", build)
+        return build
+
+    # The build that straddled the invalidation is not stored
+    assert asyncio.run(scenario()).calls == 2
+
+def test_failed_build_reaches_waiters_and_is_not_cached():
+    async def scenario():
+        cache = CatalogCache(ttl=60)
+        release = asyncio.Event()
+        calls = []
+
+        async def failing():
+            calls.append(1)
+            await release.wait()
+            raise RuntimeError("database down")
+
+        gets = [asyncio.create_task(cache.get("models", failing)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*gets, return_exceptions=True)
+        entry = await cache.get("models", Builder())
+        return calls, results, entry
+
+    calls, results, entry = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert entry.body == b'{"models": []}'
+
+def test_least_recently_used_entry_is_evicted():
+    async def scenario():
+        cache = CatalogCache(ttl=60, max_entries=2)
+        builds = {key: Builder(key.encode()) for key in "abc"}
+        await cache.get("a", builds["a"])
+        await cache.get("b", builds["b"])
+        await cache.get("a", builds["a"])  # b is now the oldest
+        await cache.get("c", builds["c"])
+        await cache.get("a", builds["a"])
+        await cache.get("b", builds["b"])
+        return {key: build.calls for key, build in builds.items()}
+
+    assert asyncio.run(scenario()) == {"a": 1, "b": 2, "c": 1}
+
+def test_etag_follows_content():
+    async def scenario():
+        cache = CatalogCache(ttl=60)
+        first = await cache.get("a", Builder(b"[1]"))
+        same = await cache.get("b", Builder(b"[1]"))
+        other = await cache.get("c", Builder(b"[2]"))
+        return first, same, other
+
+    first, same, other = asyncio.run(scenario())
+    assert first.etag == same.etag != other.etag
+    assert first.etag.startswith('"') and first.etag.endswith('"')
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    cache = CatalogCache(ttl=60)
+    monkeypatch.setattr(http_cache, "catalog_cache", cache)
+    return cache
+
+def test_if_none_match_gets_304(fresh_cache):
+    async def scenario():
+        build = Builder()
+        full = await cached_response(request(), "models", build)
+        again = await cached_response(request({"If-None-Match": full.headers["etag"]}), "models", build)
+        stale = await cached_response(request({"If-None-Match": '"something-else"'}), "models", build)
+        return build, full, again, stale
+
+    build, full, again, stale = asyncio.run(scenario())
+    assert build.calls == 1
+    assert full.status_code == 200 and full.body == b'{"models": []}'
+    assert again.status_code == 304 and again.body == b""
+    assert again.headers["etag"] == full.headers["etag"]
+    assert stale.status_code == 200
+
+def test_compressed_variant_has_its_own_etag(fresh_cache):
+    body = b'{"models": [%s]}' % b",".join(b'"model-%d"' % i for i in range(500))
+
+    async def scenario():
+        build = Builder(body)
+        plain = await cached_response(request(), "models", build)
+        zipped = await cached_response(request({"Accept-Encoding": "gzip"}), "models", build)
+        cross = await cached_response(
+            request({"Accept-Encoding": "gzip", "If-None-Match": plain.headers["etag"]}), "models", build
+        )
+        return plain, zipped, cross
+
+    plain, zipped, cross = asyncio.run(scenario())
+    assert "content-encoding" not in plain.headers
+    assert zipped.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(zipped.body) == body
+    assert zipped.headers["etag"] == encoded_etag(plain.headers["etag"], "gzip") != plain.headers["etag"]
+    assert cross.status_code == 200
+
+def test_built_headers_are_replayed(fresh_cache):
+    async def build():
+        response = Response(b"[]", media_type="application/json")
+        response.headers["X-Next-Cursor"] = "abc"
+        return response
+
+    async def scenario():
+        await cached_response(request(), "models", build)
+        return await cached_response(request(), "models", build)
+
+    assert asyncio.run(scenario()).headers["x-next-cursor"] == "abc"
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("gzip;q=0", None),
+    ("deflate, gzip;q=0.5", "gzip"),
+    ("*", http_cache.SUPPORTED_ENCODINGS[0]),
+    ("gzip;q=bogus", None),
+])
+def test_choose_encoding(header, expected):
+    assert choose_encoding(header) == expected
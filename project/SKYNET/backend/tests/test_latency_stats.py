@@ -0,0 +1,91 @@
+import math
+import random
+
+import pytest
+
+from latency_stats import MIN_TRACKED_LATENCY, LatencySketch, summarize
+
+def sketch_of(values, relative_accuracy=0.01):
+    sketch = LatencySketch(relative_accuracy)
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+def exact_quantile(values, q):
+    # The rank LatencySketch.quantile uses
+    return sorted(values)[int(q * (len(values) - 1))]
+
+def test_empty_sketch_has_no_quantiles():
+    sketch = LatencySketch()
+    assert sketch.quantile(0.5) is None
+    assert summarize(sketch, None)["p50_ms"] is None
+
+@pytest.mark.parametrize("relative_accuracy", [0.01, 0.05])
+def test_quantiles_within_relative_accuracy(relative_accuracy):
+    rng = random.Random(1)
+    values = [rng.lognormvariate(-3, 1.5) for _ in range(5000)]
+    sketch = sketch_of(values, relative_accuracy)
+    for q in (0.0, 0.25, 0.5, 0.9, 0.99, 1.0):
+        exact = exact_quantile(values, q)
+        assert sketch.quantile(q) == pytest.approx(exact, rel=relative_accuracy)
+
+def test_quantiles_stay_within_observed_range():
+    sketch = sketch_of([0.123, 0.123, 0.123])
+    assert sketch.quantile(0.0) == 0.123
+    assert sketch.quantile(1.0) == 0.123
+
+def test_tiny_latencies_land_in_zero_bucket():
+    sketch = sketch_of([MIN_TRACKED_LATENCY / 10] * 3 + [0.5])
+    assert sketch.zero_count == 3
+    assert sketch.quantile(0.5) == 0.0
+    assert sketch.quantile(1.0) == pytest.approx(0.5, rel=0.01)
+
+def test_merge_equals_sketch_of_all_values():
+    rng = random.Random(2)
+    left = [rng.uniform(0.001, 2) for _ in range(700)]
+    right = [rng.uniform(0.5, 10) for _ in range(300)] + [0.0]
+    merged = sketch_of(left)
+    merged.merge(sketch_of(right))
+    combined = sketch_of(left + right)
+
+    assert merged.bins == combined.bins
+    assert merged.zero_count == combined.zero_count
+    assert merged.count == combined.count == 1001
+    assert merged.sum == pytest.approx(combined.sum)
+    assert (merged.min, merged.max) == (combined.min, combined.max)
+    for q in (0.5, 0.9, 0.99):
+        assert merged.quantile(q) == combined.quantile(q)
+
+def test_merge_into_empty_sketch():
+    merged = LatencySketch()
+    merged.merge(sketch_of([0.2, 0.4]))
+    assert merged.count == 2
+    assert (merged.min, merged.max) == (0.2, 0.4)
+
+def test_merge_rejects_different_accuracy():
+    with pytest.raises(ValueError):
+        LatencySketch(0.01).merge(LatencySketch(0.02))
+
+def test_error_counts_merge():
+    sketch = LatencySketch()
+    sketch.add(0.1, error=True)
+    sketch.add(0.2)
+    other = LatencySketch()
+    other.add(0.3, error=True)
+    sketch.merge(other)
+    assert (sketch.count, sketch.error_count) == (3, 2)
+    assert summarize(sketch, None)["error_rate"] == pytest.approx(2 / 3)
+
+def test_dict_round_trip():
+    sketch = sketch_of([0.0, 0.01, 0.2, 3.5])
+    sketch.add(1.0, error=True)
+    restored = LatencySketch.from_dict(sketch.to_dict())
+    assert restored.to_dict() == sketch.to_dict()
+    assert restored.quantile(0.9) == sketch.quantile(0.9)
+
+def test_empty_dict_round_trip():
+    restored = LatencySketch.from_dict(LatencySketch().to_dict())
+    assert restored.count == 0
+    assert restored.min == math.inf
+    restored.add(0.5)
+    assert restored.min == 0.5
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException, Response
+from sqlalchemy import Column, DateTime, MetaData, String, Table, select
+from sqlalchemy.dialects import postgresql
+
+from pagination import (
+    NEXT_CURSOR_HEADER, Page, decode_cursor, decode_rank_cursor, encode_cursor, encode_rank_cursor,
+    finish_page, keyset, page_params
+)
+
+items = Table(
+    "items", MetaData(),
+    Column("id", String, primary_key=True),
+    Column("created_at", DateTime(timezone=True)),
+)
+
+def test_cursor_round_trip():
+    timestamp = datetime(2026, 10, 18, 12, 30, 5, 123456, tzinfo=timezone.utc)
+    cursor = encode_cursor(timestamp, "row-1")
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (timestamp, "row-1")
+
+def test_rank_cursor_round_trip():
+    assert decode_rank_cursor(encode_rank_cursor(0.125, "row-2")) == (0.125, "row-2")
+
+@pytest.mark.parametrize("cursor", ["", "not base64!", "bm90IGpzb24", encode_rank_cursor(1.5, "x")[:-3], "WzFd"])
+def test_malformed_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+def test_timestamp_cursor_is_not_a_rank_cursor():
+    with pytest.raises(ValueError):
+        decode_rank_cursor(encode_cursor(datetime.now(timezone.utc), "x"))
+
+def test_page_params_turns_bad_cursor_into_400():
+    dependency = page_params(50)
+    assert dependency(limit=50, cursor=None) == Page(limit=50)
+    with pytest.raises(HTTPException) as raised:
+        dependency(limit=50, cursor="garbage")
+    assert raised.value.status_code == 400
+
+def compiled(stmt) -> str:
+    return str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+def test_keyset_first_page_orders_newest_first_with_look_ahead():
+    sql = compiled(keyset(select(items), Page(limit=10), items.c.created_at, items.c.id))
+    assert "WHERE" not in sql
+    assert "ORDER BY items.created_at DESC, items.id DESC" in sql
+    assert "LIMIT 11" in sql
+
+def test_keyset_seeks_past_cursor_with_row_comparison():
+    after = (datetime(2026, 1, 1, tzinfo=timezone.utc), "row-9")
+    sql = compiled(keyset(select(items), Page(limit=5, after=after), items.c.created_at, items.c.id))
+    assert "(items.created_at, items.id) < (" in sql
+    assert "'row-9'" in sql
+    assert "LIMIT 6" in sql
+
+def rows(count):
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    return [SimpleNamespace(id=f"row-{i}", created_at=start - timedelta(minutes=i)) for i in range(count)]
+
+def test_finish_page_trims_look_ahead_and_sets_cursor():
+    response = Response()
+    page = finish_page(rows(4), Page(limit=3), response)
+    assert [row.id for row in page] == ["row-0", "row-1", "row-2"]
+    assert decode_cursor(response.headers[NEXT_CURSOR_HEADER]) == (page[-1].created_at, "row-2")
+
+@pytest.mark.parametrize("count", [0, 2, 3])
+def test_last_page_has_no_cursor(count):
+    response = Response()
+    assert len(finish_page(rows(count), Page(limit=3), response)) == count
+    assert NEXT_CURSOR_HEADER not in response.headers
+
+def test_pages_cover_every_row_once():
+    everything = rows(10)
+    seen, after = [], None
+    while True:
+        remaining = [row for row in everything if after is None or (row.created_at, row.id) < after]
+        response = Response()
+        page = finish_page(remaining[:4], Page(limit=3, after=after), response)
+        seen.extend(row.id for row in page)
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if cursor is None:
+            break
+        after = decode_cursor(cursor)
+    assert seen == [row.id for row in everything]
@@ -0,0 +1,159 @@
+import textwrap
+
+import pytest
+
+import test_shards
+from test_shards import collect_units, plan_shards, record_durations
+
+CODE = textwrap.dedent("""
+    import unittest
+
+    def add(a, b):
+        return a + b
+
+    class Helper:
+        def test_not_a_test_case(self):
+            pass
+
+    class TestAdd(unittest.TestCase):
+        def setUp(self):
+            self.zero = 0
+
+        def test_small(self):
+            self.assertEqual(add(1, 2), 3)
+
+        def test_zero(self):
+            self.assertEqual(add(self.zero, 0), 0)
+
+        def helper(self):
+            pass
+
+    class TestWithFixture(unittest.TestCase):
+        @classmethod
+        def setUpClass(cls):
+            cls.shared = 1
+
+        def test_a(self):
+            pass
+
+        def test_b(self):
+            pass
+
+    class TestMore(TestAdd):
+        def test_extra(self):
+            pass
+""")
+
+def units_by_name(code=CODE):
+    return {unit.name: unit for unit in collect_units(code)}
+
+def test_collect_units():
+    units = units_by_name()
+    assert set(units) == {"TestAdd.test_small", "TestAdd.test_zero", "TestWithFixture", "TestMore"}
+    # Class fixtures and local base classes keep the class whole
+    assert units["TestWithFixture"].tests == 2
+    assert units["TestMore"].tests == 1
+    assert units["TestAdd.test_small"].tests == 1
+
+def test_collect_units_without_tests():
+    assert collect_units("def broken(:\n    pass") == []
+    assert collect_units("print('no tests here')") == []
+
+def test_unit_covers_its_tests_only():
+    whole = test_shards.TestUnit("TestWithFixture", "k")
+    single = test_shards.TestUnit("TestAdd.test_small", "k")
+    assert whole.covers("TestWithFixture.test_a")
+    assert not whole.covers("TestWithFixtureToo.test_a")
+    assert single.covers("TestAdd.test_small")
+    assert not single.covers("TestAdd.test_small_other")
+
+def test_keys_are_stable_and_follow_the_code():
+    keys = {name: unit.key for name, unit in units_by_name().items()}
+    assert keys == {name: unit.key for name, unit in units_by_name().items()}
+
+    method_changed = units_by_name(CODE.replace("add(1, 2), 3", "add(2, 2), 4"))
+    assert method_changed["TestAdd.test_small"].key != keys["TestAdd.test_small"]
+    assert method_changed["TestAdd.test_zero"].key == keys["TestAdd.test_zero"]
+
+    setup_changed = units_by_name(CODE.replace("self.zero = 0", "self.zero = 0 * 1"))
+    assert setup_changed["TestAdd.test_small"].key != keys["TestAdd.test_small"]
+    assert setup_changed["TestWithFixture"].key == keys["TestWithFixture"]
+
+    # Editing the code under test starts every history over
+    code_changed = units_by_name(CODE.replace("return a + b", "return b + a"))
+    assert all(code_changed[name].key != key for name, key in keys.items())
+
+def make_units(seconds, durations):
+    units = []
+    for index, duration in enumerate(seconds):
+        unit = test_shards.TestUnit(f"T.test_{index}", f"key-{index}")
+        if duration is not None:
+            durations.record(unit.key, duration)
+        units.append(unit)
+    return units
+
+def test_short_suites_are_not_split():
+    durations = test_shards.TestDurations()
+    units = make_units([0.01] * 10, durations)
+    assert plan_shards(units, workers=4, durations=durations) == [units]
+
+def test_single_unit_is_not_split():
+    durations = test_shards.TestDurations()
+    units = make_units([30.0], durations)
+    assert plan_shards(units, workers=4, durations=durations) == [units]
+
+def test_shards_are_balanced_by_history():
+    durations = test_shards.TestDurations()
+    units = make_units([4.0, 3.0, 3.0, 2.0, 2.0, 1.0, 1.0], durations)
+    shards = plan_shards(units, workers=2, durations=durations)
+
+    assert len(shards) == 2
+    assert sorted(unit.name for shard in shards for unit in shard) == sorted(unit.name for unit in units)
+    assert sorted(sum(unit.estimate for unit in shard) for shard in shards) == [8.0, 8.0]
+
+@pytest.mark.parametrize("workers, count", [(1, 1), (3, 3), (100, 8)])
+def test_shard_count_is_bounded_by_workers_and_units(workers, count):
+    durations = test_shards.TestDurations()
+    units = make_units([1.0] * 8, durations)
+    assert len(plan_shards(units, workers=workers, durations=durations)) == count
+
+def test_unknown_units_are_estimated_from_known_ones():
+    durations = test_shards.TestDurations()
+    units = make_units([2.0, 4.0, None], durations)
+    plan_shards(units, workers=2, durations=durations)
+    assert units[2].estimate == pytest.approx(3.0)
+
+def test_default_estimate_without_history():
+    durations = test_shards.TestDurations()
+    units = make_units([None, None], durations)
+    units.append(test_shards.TestUnit("Whole", "key-whole", tests=3))
+    plan_shards(units, workers=1, durations=durations)
+    assert [unit.estimate for unit in units] == pytest.approx(
+        [test_shards.CODE_TEST_DEFAULT_SECONDS] * 2 + [3 * test_shards.CODE_TEST_DEFAULT_SECONDS]
+    )
+
+def test_record_durations_sums_a_units_tests():
+    durations = test_shards.TestDurations(weight=0.5)
+    whole = test_shards.TestUnit("TestWithFixture", "whole")
+    single = test_shards.TestUnit("TestAdd.test_small", "single")
+    missing = test_shards.TestUnit("TestGone.test_x", "missing")
+    record_durations([whole, single, missing], {
+        "TestWithFixture.test_a": 1.0,
+        "TestWithFixture.test_b": 2.0,
+        "TestAdd.test_small": 0.5,
+    }, durations)
+    assert durations.get("whole") == pytest.approx(3.0)
+    assert durations.get("single") == pytest.approx(0.5)
+    assert durations.get("missing") is None
+
+    record_durations([single], {"TestAdd.test_small": 1.5}, durations)
+    assert durations.get("single") == pytest.approx(1.0)
+
+def test_durations_forget_least_recently_run():
+    durations = test_shards.TestDurations(max_entries=2)
+    durations.record("a", 1.0)
+    durations.record("b", 1.0)
+    durations.record("a", 1.0)
+    durations.record("c", 1.0)
+    assert durations.get("b") is None
+    assert durations.get("a") is not None and durations.get("c") is not None
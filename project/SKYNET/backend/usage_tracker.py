@@ -0,0 +1,300 @@
+import asyncio
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.dialects.postgresql import insert
+
+from database import TRANSIENT_ERRORS, SessionLocal
+from models import APIKey, Model, UsageStatistics, generate_uuid
+
+logger = logging.getLogger(__name__)
+
+# Seconds between batched flushes of the in-memory counters
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "10"))
+
+@dataclass
+class UsageCounters:
+    api_calls: int = 0
+    tokens_used: int = 0
+    code_executions: int = 0
+    models_tested: int = 0
+
+    def merge(self, other: "UsageCounters"):
+        self.api_calls += other.api_calls
+        self.tokens_used += other.tokens_used
+        self.code_executions += other.code_executions
+        self.models_tested += other.models_tested
+
+@dataclass
+class ModelCounters:
+    requests: int = 0
+    successes: int = 0
+    latency_sum: float = 0.0
+
+    def merge(self, other: "ModelCounters"):
+        self.requests += other.requests
+        self.successes += other.successes
+        self.latency_sum += other.latency_sum
+
+@dataclass
+class KeyCounters:
+    uses: int = 0
+    last_used: Optional[datetime] = None
+
+    def merge(self, other: "KeyCounters"):
+        self.uses += other.uses
+        if other.last_used and (self.last_used is None or other.last_used > self.last_used):
+            self.last_used = other.last_used
+
+@dataclass
+class UsageBatch:
+    usage: Dict[Tuple[str, datetime], UsageCounters] = field(default_factory=dict)
+    models: Dict[str, ModelCounters] = field(default_factory=dict)
+    keys: Dict[str, KeyCounters] = field(default_factory=dict)
+
+    def is_empty(self) -> bool:
+        return not (self.usage or self.models or self.keys)
+
+    def split(self) -> List["UsageBatch"]:
+        """One batch per usage row, model and API key"""
+        return (
+            [UsageBatch(usage={key: counters}) for key, counters in self.usage.items()]
+            + [UsageBatch(models={key: counters}) for key, counters in self.models.items()]
+            + [UsageBatch(keys={key: counters}) for key, counters in self.keys.items()]
+        )
+
+    def describe(self) -> str:
+        return ", ".join(
+            [f"usage {user_id} {day:%Y-%m-%d}" for user_id, day in self.usage]
+            + [f"model {model_id}" for model_id in self.models]
+            + [f"API key {key_id}" for key_id in self.keys]
+        )
+
+def extract_token_count(usage: Optional[Dict[str, Any]]) -> int:
+    """Normalize provider usage payloads (OpenAI, Anthropic, Gemini) to a total token count"""
+    if not usage:
+        return 0
+    if "total_tokens" in usage:
+        return int(usage.get("total_tokens") or 0)
+    if "totalTokenCount" in usage:
+        return int(usage.get("totalTokenCount") or 0)
+    input_tokens = usage.get("input_tokens", usage.get("prompt_tokens", 0)) or 0
+    output_tokens = usage.get("output_tokens", usage.get("completion_tokens", 0)) or 0
+    return int(input_tokens) + int(output_tokens)
+
+class UsageAggregator:
+    """Write-behind accumulator for usage statistics and model/API key counters.
+
+    Request handlers record events in memory; a background task periodically
+    flushes the accumulated deltas in a single transaction using batched upserts
+    and atomic increments, so no per-request commit sits on the latency path.
+
+    A batch that fails for any other reason than a transient error is written
+    again one row at a time; rows that still fail (a user or model that is gone,
+    say) are logged and dropped, so they never hold back the deltas after them.
+    """
+
+    def __init__(self, session_factory=SessionLocal, flush_interval: float = USAGE_FLUSH_INTERVAL):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._batch = UsageBatch()
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _today() -> datetime:
+        now = datetime.now(timezone.utc)
+        return datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
+
+    def _usage_for(self, user_id: Optional[str]) -> UsageCounters:
+        key = (user_id, self._today())
+        counters = self._batch.usage.get(key)
+        if counters is None:
+            counters = self._batch.usage[key] = UsageCounters()
+        return counters
+
+    def record_api_call(
+        self,
+        user_id: Optional[str],
+        tokens: int = 0,
+        model_id: Optional[str] = None,
+        api_key_id: Optional[str] = None,
+        success: bool = True,
+        latency: float = 0.0
+    ):
+        """Record one LLM generation call"""
+        with self._lock:
+            usage = self._usage_for(user_id)
+            usage.api_calls += 1
+            usage.tokens_used += tokens
+
+            if model_id:
+                model = self._batch.models.setdefault(model_id, ModelCounters())
+                model.requests += 1
+                model.successes += 1 if success else 0
+                model.latency_sum += latency
+
+            if api_key_id:
+                key = self._batch.keys.setdefault(api_key_id, KeyCounters())
+                key.uses += 1
+                key.last_used = datetime.now(timezone.utc)
+
+    def record_code_execution(self, user_id: Optional[str], count: int = 1):
+        """Record code executions or test runs"""
+        with self._lock:
+            self._usage_for(user_id).code_executions += count
+
+    def record_model_test(self, user_id: Optional[str], count: int = 1):
+        """Record model health checks, comparisons and benchmarks"""
+        with self._lock:
+            self._usage_for(user_id).models_tested += count
+
+    def _swap(self) -> UsageBatch:
+        with self._lock:
+            batch, self._batch = self._batch, UsageBatch()
+        return batch
+
+    def _restore(self, batch: UsageBatch):
+        """Merge an unflushed batch back so a failed flush loses nothing"""
+        with self._lock:
+            for key, counters in batch.usage.items():
+                self._batch.usage.setdefault(key, UsageCounters()).merge(counters)
+            for model_id, counters in batch.models.items():
+                self._batch.models.setdefault(model_id, ModelCounters()).merge(counters)
+            for key_id, counters in batch.keys.items():
+                self._batch.keys.setdefault(key_id, KeyCounters()).merge(counters)
+
+    def flush(self):
+        """Write all pending deltas, in one transaction unless that fails (blocking)"""
+        batch = self._swap()
+        if batch.is_empty():
+            return
+        try:
+            self._write(batch)
+        except TRANSIENT_ERRORS:
+            self._restore(batch)
+            logger.exception("Failed to flush usage statistics; will retry on next interval")
+        except Exception:
+            logger.exception("Failed to flush usage statistics; writing them one row at a time")
+            self._write_each(batch)
+
+    def _write_each(self, batch: UsageBatch):
+        parts = batch.split()
+        for index, part in enumerate(parts):
+            try:
+                self._write(part)
+            except TRANSIENT_ERRORS:
+                for rest in parts[index:]:
+                    self._restore(rest)
+                logger.exception("Failed to flush usage statistics; will retry on next interval")
+                return
+            except Exception:
+                logger.exception("Dropping %s delta that cannot be written", part.describe())
+
+    def _write(self, batch: UsageBatch):
+        """Write batch in one transaction, rolling back and raising on failure"""
+        db = self.session_factory()
+        try:
+            if batch.usage:
+                rows = [
+                    {
+                        "id": generate_uuid(),
+                        "user_id": user_id,
+                        "date": day,
+                        "api_calls": c.api_calls,
+                        "tokens_used": c.tokens_used,
+                        "code_executions": c.code_executions,
+                        "models_tested": c.models_tested,
+                        "storage_used": 0,
+                    }
+                    for (user_id, day), c in batch.usage.items()
+                ]
+                stmt = insert(UsageStatistics).values(rows)
+                table = UsageStatistics.__table__
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[table.c.user_id, table.c.date],
+                    set_={
+                        "api_calls": table.c.api_calls + stmt.excluded.api_calls,
+                        "tokens_used": table.c.tokens_used + stmt.excluded.tokens_used,
+                        "code_executions": table.c.code_executions + stmt.excluded.code_executions,
+                        "models_tested": table.c.models_tested + stmt.excluded.models_tested,
+                    }
+                )
+                db.execute(stmt)
+
+            if batch.models:
+                table = Model.__table__
+                total = func.coalesce(table.c.total_requests, 0)
+                # Single-statement running averages: no read-modify-write race between workers
+                db.execute(
+                    update(table)
+                    .where(table.c.id == bindparam("b_id"))
+                    .values(
+                        total_requests=total + bindparam("b_requests"),
+                        avg_response_time=(
+                            func.coalesce(table.c.avg_response_time, 0) * total + bindparam("b_latency_sum")
+                        ) / (total + bindparam("b_requests")),
+                        success_rate=(
+                            func.coalesce(table.c.success_rate, 100) * total + 100.0 * bindparam("b_successes")
+                        ) / (total + bindparam("b_requests")),
+                    ),
+                    [
+                        {
+                            "b_id": model_id,
+                            "b_requests": c.requests,
+                            "b_successes": c.successes,
+                            "b_latency_sum": c.latency_sum,
+                        }
+                        for model_id, c in batch.models.items()
+                    ]
+                )
+
+            if batch.keys:
+                table = APIKey.__table__
+                db.execute(
+                    update(table)
+                    .where(table.c.id == bindparam("b_id"))
+                    .values(
+                        usage_count=func.coalesce(table.c.usage_count, 0) + bindparam("b_uses"),
+                        last_used=bindparam("b_last_used"),
+                    ),
+                    [
+                        {"b_id": key_id, "b_uses": c.uses, "b_last_used": c.last_used}
+                        for key_id, c in batch.keys.items()
+                    ]
+                )
+
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await asyncio.to_thread(self.flush)
+
+    def start(self):
+        """Start the periodic flush task on the running event loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Cancel the flush task and write out whatever is pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+usage_aggregator = UsageAggregator()
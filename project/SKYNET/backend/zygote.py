@@ -0,0 +1,206 @@
+"""
+Fork server for code execution; the API side is executor_pool.py.
+
+Started as `python zygote.py <fd>`, where fd is a SOCK_SEQPACKET socket to
+the API process. It imports the modules named in CODE_EXECUTOR_PRELOAD,
+reports ready, then forks one child per request. The child leads its own
+process group, takes the stdout / stderr pipes sent with the request, applies the
+request's rlimits and runs the script as `python <script>` would. The zygote
+reaps it and reports the exit status and resource usage.
+
+`python zygote.py --run <script> <rlimits>` runs one script the same way in
+the current interpreter, for executions that don't go through a zygote.
+
+The preloaded heap is frozen out of the garbage collector, and a child does
+the parts of interpreter shutdown a script can observe (joining threads,
+atexit handlers, flushing output) and then leaves with os._exit. A full
+finalization would touch, and so copy, every page inherited from the zygote;
+that alone costs more than forking.
+
+Only the standard library is imported here: whatever this process imports,
+every script inherits.
+"""
+import atexit
+import gc
+import importlib
+import json
+import os
+import resource
+import runpy
+import selectors
+import signal
+import socket
+import sys
+import threading
+import traceback
+from typing import Dict, List, Optional
+
+MAX_MESSAGE = 64 * 1024
+
+def send(sock: socket.socket, message: dict):
+    sock.send(json.dumps(message).encode())
+
+def apply_limits(limits: Dict[str, List[int]]):
+    """setrlimit each (soft, hard) pair, never above the hard limit this process already has"""
+    for name, (soft, hard) in limits.items():
+        limit = getattr(resource, name, None)
+        if limit is None:
+            continue  # not on this platform
+        _, current_hard = resource.getrlimit(limit)
+        if current_hard != resource.RLIM_INFINITY:
+            soft, hard = min(soft, current_hard), min(hard, current_hard)
+        resource.setrlimit(limit, (soft, hard))
+
+def run_script(path: str) -> int:
+    """Run path as __main__ and return its exit code"""
+    sys.argv = [path]
+    sys.path[0] = os.path.dirname(os.path.abspath(path))
+    try:
+        runpy.run_path(path, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException as e:
+        # Start the traceback at the script, as the interpreter's does, not in runpy
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != path:
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb)
+        return 1
+    return 0
+
+def exit_child(code: int):
+    """Shut down the way the interpreter would, without tearing down the inherited heap"""
+    try:
+        for thread in threading.enumerate():
+            if thread is not threading.main_thread() and not thread.daemon:
+                thread.join()
+        atexit._run_exitfuncs()
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+        os._exit(code & 0xFF)
+
+def serve(sock: socket.socket) -> Optional[dict]:
+    """Fork a child per request until the API closes the socket.
+
+    Returns None in the zygote when it should exit, and the request in a
+    freshly forked child.
+    """
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_r, False)
+    os.set_blocking(wake_w, False)
+    signal.set_wakeup_fd(wake_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    selector.register(wake_r, selectors.EVENT_READ)
+    children: Dict[int, int] = {}  # pid -> request id
+    closing = False
+
+    def reap():
+        while children:
+            try:
+                pid, status, rusage = os.wait3(os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            request_id = children.pop(pid, None)
+            if request_id is not None:
+                send(sock, {
+                    "id": request_id,
+                    "returncode": os.waitstatus_to_exitcode(status),
+                    "rusage": {name: getattr(rusage, name) for name in dir(rusage) if name.startswith("ru_")}
+                })
+
+    send(sock, {"ready": True})
+    while not closing or children:
+        for key, _ in selector.select():
+            if key.fileobj == wake_r:
+                while True:
+                    try:
+                        if not os.read(wake_r, 4096):
+                            break
+                    except BlockingIOError:
+                        break
+                reap()
+                continue
+
+            try:
+                data, fds, _, _ = socket.recv_fds(sock, MAX_MESSAGE, 2)
+            except ConnectionError:
+                data, fds = b"", []
+            if not data:
+                # The API process is gone; nobody is left to time these out
+                for pid in children:
+                    try:
+                        os.killpg(pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+                return None
+
+            request = json.loads(data)
+            if request.get("op") == "close":
+                closing = True
+                continue
+
+            pid = os.fork()
+            if pid == 0:
+                # Own process group, so the API can kill the script with everything it starts
+                os.setpgid(0, 0)
+                selector.close()
+                sock.close()
+                signal.set_wakeup_fd(-1)
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                os.close(wake_r)
+                os.close(wake_w)
+                request["fds"] = fds
+                return request
+
+            # Also set here, so the group exists before the API gets the pid and may killpg it
+            try:
+                os.setpgid(pid, pid)
+            except OSError:
+                pass  # the child already exited
+            for fd in fds:
+                os.close(fd)
+            children[pid] = request["id"]
+            send(sock, {"id": request["id"], "pid": pid})
+    return None
+
+if __name__ == "__main__":
+    if sys.argv[1] == "--run":
+        apply_limits(json.loads(sys.argv[3]))
+        exit_child(run_script(sys.argv[2]))
+
+    sock = socket.socket(fileno=int(sys.argv[1]))
+    for name in os.getenv("CODE_EXECUTOR_PRELOAD", "").split(","):
+        if name.strip():
+            try:
+                importlib.import_module(name.strip())
+            except ImportError as e:
+                print(f"zygote: not preloading {name.strip()}: {e}", file=sys.stderr)
+    gc.freeze()
+
+    request = serve(sock)
+    if request is None:
+        sys.exit(0)
+
+    stdout_fd, stderr_fd = request["fds"]
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(stdout_fd, 1)
+    os.dup2(stderr_fd, 2)
+    for fd in (devnull, stdout_fd, stderr_fd):
+        os.close(fd)
+    apply_limits(request.get("limits", {}))
+    exit_child(run_script(request["path"]))
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark /models/list throughput under NullPool versus a pooled engine.
+
+Starts the backend once per DB_POOL_MODE, drives concurrent GET requests at
+/models/list for a fixed duration and reports requests/sec, latency
+percentiles and the pool's checkout wait / connection churn metrics.
+
+Requires DATABASE_URL (and ENCRYPTION_KEY or JWT_SECRET_KEY) in the environment:
+    python benchmarks/bench_db_pool.py --concurrency 32 --duration 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend")
+
+async def wait_until_ready(base_url: str, timeout: float = 60):
+    deadline = time.time() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.time() < deadline:
+            try:
+                async with session.get(f"{base_url}/health") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"Backend at {base_url} did not become ready")
+
+async def drive_load(base_url: str, concurrency: int, duration: float):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(session):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                async with session.get(f"{base_url}/models/list") as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+            except aiohttp.ClientError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        async with session.get(f"{base_url}/health/db-pool") as response:
+            pool_status = await response.json()
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else 0,
+        "p99_ms": latencies[int(0.99 * (len(latencies) - 1))] * 1000 if latencies else 0,
+        "pool": pool_status,
+    }
+
+def run_mode(mode: str, args) -> dict:
+    env = dict(os.environ, DB_POOL_MODE=mode)
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env
+    )
+    try:
+        asyncio.run(wait_until_ready(base_url))
+        # Warm-up so one-off startup costs are not attributed to either mode
+        asyncio.run(drive_load(base_url, args.concurrency, 2))
+        return asyncio.run(drive_load(base_url, args.concurrency, args.duration))
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("Benchmarking /models/list: NullPool vs pooled engine")
+    print("=" * 60)
+
+    results = {}
+    for mode in ("null", "queue"):
+        print(f"\n=== DB_POOL_MODE={mode} ===")
+        result = run_mode(mode, args)
+        results[mode] = result
+        metrics = result["pool"]["metrics"]
+        print(f"Requests: {result['requests']} (errors: {result['errors']})")
+        print(f"Throughput: {result['rps']:.1f} req/s")
+        print(f"Latency p50: {result['p50_ms']:.2f} ms, p99: {result['p99_ms']:.2f} ms")
+        print(f"Checkout wait avg: {metrics['checkout_wait_avg_ms']:.2f} ms, max: {metrics['checkout_wait_max_ms']:.2f} ms")
+        print(f"New connections: {metrics['connects']} for {metrics['checkouts']} checkouts (churn {metrics['churn_ratio']:.2f})")
+
+    print("\n" + "=" * 60)
+    speedup = results["queue"]["rps"] / results["null"]["rps"] if results["null"]["rps"] else float("inf")
+    print(f"Pooled engine throughput: {speedup:.2f}x NullPool")
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Code execution latency and concurrency on one event loop, i.e. one API worker.
+
+Latency: median time to run small snippets in a fresh interpreter per run
+(run_python) versus forked from a warm zygote (executor_pool).
+
+Concurrency: runs N scripts that each sleep for --seconds, all at once, through
+CodeExecutor.execute_code, and through the previous implementation (blocking
+Popen.communicate inside the coroutine). A ticker task measures how long the
+loop is stalled meanwhile: with blocking calls every other request on the
+worker waits for the scripts, one after another.
+
+Burst: --burst CPU-bound scripts submitted at once, all started immediately
+versus through code_jobs admission control (CODE_JOBS_MAX_RUNNING slots,
+--queue waiting, the rest refused with 429). Unbounded, every script shares
+the CPUs with every other and all of them finish late; with admission the
+admitted ones run at full speed and the excess is refused at once.
+
+Test sharding: run_tests on a suite of --tests CPU-bound tests of uneven
+length, in one process and split across --workers. Each mode runs the suite
+once to learn the durations the shards are balanced on, then is timed. Split,
+the wall time approaches the tests' total over the number of workers, given as
+many CPUs.
+
+Also checks that a timed-out script is killed together with the processes it
+spawned.
+
+Starting a fresh interpreter (fork/exec) happens on the loop, so with
+CODE_EXECUTOR_POOL_SIZE=0 the stall that remains grows with how many scripts
+start at the same moment and with how busy the CPUs are with interpreters
+starting up.
+
+Needs no database:
+    python benchmarks/code_execution.py --concurrency 50
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import psutil
+
+from code_jobs import CodeJobScheduler, CodeJobsOverloaded
+from code_testing import CodeExecutor
+from executor_pool import executor_pool, run_python
+
+SNIPPETS = {
+    "print": "print(42)",
+    "json + re": "import json, re\nprint(json.dumps({'ok': bool(re.match('a', 'abc'))}))",
+    "unittest": (
+        "import unittest\n"
+        "class T(unittest.TestCase):\n"
+        "    def test_add(self):\n"
+        "        self.assertEqual(1 + 1, 2)\n"
+        "unittest.main()\n"
+    ),
+}
+
+async def blocking_execute(code: str, timeout: int = 10) -> dict:
+    """The previous execute_code: a coroutine that blocks the loop in communicate()"""
+    with tempfile.NamedTemporaryFile(mode="w", suffix=".py", delete=False) as f:
+        f.write(code)
+    try:
+        proc = subprocess.Popen([sys.executable, f.name], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        stdout, stderr = proc.communicate(timeout=timeout)
+        return {"output": stdout, "success": proc.returncode == 0}
+    finally:
+        os.remove(f.name)
+
+async def measure(execute, concurrency: int, seconds: float) -> dict:
+    code = f"import time\ntime.sleep({seconds})\nprint('done')"
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker(interval: float = 0.01):
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - started - interval)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    results = await asyncio.gather(*(execute(code) for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    stop.set()
+    await executor_pool.stop()
+    await tick
+    return {
+        "wall": wall,
+        "ok": sum(1 for r in results if r["success"] and r["output"].strip() == "done"),
+        "max_lag": max(lags),
+    }
+
+async def measure_latency(runs: int) -> dict:
+    """snippet -> (fresh interpreter median, warm zygote median) in seconds"""
+    executor_pool.start()
+    results = {}
+    for name, code in SNIPPETS.items():
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".py", delete=False) as f:
+            f.write(code)
+        try:
+            timings = {}
+            for label, run in (("fresh", run_python), ("warm", executor_pool.run)):
+                await run(f.name, 10)  # warm-up; the first pool run waits for the zygotes
+                samples = []
+                for _ in range(runs):
+                    started = time.perf_counter()
+                    output = await run(f.name, 10)
+                    samples.append(time.perf_counter() - started)
+                    assert output.returncode == 0, output.stderr
+                timings[label] = statistics.median(samples)
+            results[name] = (timings["fresh"], timings["warm"])
+        finally:
+            os.remove(f.name)
+    await executor_pool.stop()
+    return results
+
+async def measure_burst(burst: int, cpu_seconds: float, queue: Optional[int]) -> dict:
+    """Latencies of completed and of refused executions; queue=None runs everything at once"""
+    code = f"import time\nend = time.process_time() + {cpu_seconds}\nwhile time.process_time() < end:\n    pass\n"
+    scheduler = CodeJobScheduler(max_queued=queue or 0, max_running_per_owner=burst, max_queued_per_owner=burst)
+    executor_pool.start()
+    await CodeExecutor.execute_code("pass")  # warm the zygotes
+
+    async def execute(i: int):
+        started = time.perf_counter()
+        try:
+            if queue is None:
+                await CodeExecutor.execute_code(code, timeout=300)
+            else:
+                async with scheduler.slot(f"client-{i}"):
+                    await CodeExecutor.execute_code(code, timeout=300)
+        except CodeJobsOverloaded:
+            return "refused", time.perf_counter() - started
+        return "completed", time.perf_counter() - started
+
+    results = await asyncio.gather(*(execute(i) for i in range(burst)))
+    await executor_pool.stop()
+    completed = sorted(t for outcome, t in results if outcome == "completed")
+    refused = [t for outcome, t in results if outcome == "refused"]
+    return {
+        "completed": len(completed),
+        "refused": len(refused),
+        "p50": statistics.median(completed),
+        "max": completed[-1],
+        "refused_max": max(refused, default=None),
+    }
+
+async def measure_tests(tests: int, workers: int) -> dict:
+    """Wall time of run_tests once the suite's durations are known, and the tests' total time"""
+    code = "import time, unittest\nclass T(unittest.TestCase):\n" + "".join(
+        f"    def test_{i}(self):\n"
+        f"        end = time.process_time() + {0.05 * (i % 5 + 1):.2f}\n"
+        "        while time.process_time() < end:\n"
+        "            pass\n"
+        for i in range(tests)
+    )
+    executor_pool.start()
+    await CodeExecutor.run_tests(code, timeout=300, workers=workers)
+    started = time.perf_counter()
+    results = await CodeExecutor.run_tests(code, timeout=300, workers=workers)
+    wall = time.perf_counter() - started
+    await executor_pool.stop()
+    return {
+        "wall": wall,
+        "total": sum(t.execution_time for t in results),
+        "passed": sum(t.passed for t in results),
+    }
+
+async def check_timeout_cleanup() -> bool:
+    pid_file = tempfile.mktemp(suffix=".pid")
+    code = (
+        "import subprocess, sys\n"
+        f"child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)'])\n"
+        f"open({pid_file!r}, 'w').write(str(child.pid))\n"
+        "while True:\n    pass\n"
+    )
+    result = await CodeExecutor.execute_code(code, timeout=1)
+    await executor_pool.stop()
+    with open(pid_file) as f:
+        child_pid = int(f.read())
+    os.remove(pid_file)
+    await asyncio.sleep(0.1)
+    child_alive = psutil.pid_exists(child_pid) and psutil.Process(child_pid).status() != psutil.STATUS_ZOMBIE
+    print(f"  result: {result['error']!r}, spawned child {child_pid} {'still running' if child_alive else 'killed'}")
+    return result["error"] == "Execution timeout (1 seconds)" and not child_alive
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=20, help="scripts started at once")
+    parser.add_argument("--seconds", type=float, default=0.5, help="how long each script sleeps")
+    parser.add_argument("--runs", type=int, default=30, help="sequential runs per snippet for the latency median")
+    parser.add_argument("--burst", type=int, default=24, help="CPU-bound scripts submitted at once")
+    parser.add_argument("--cpu-seconds", type=float, default=0.25, help="CPU time each burst script uses")
+    parser.add_argument("--queue", type=int, default=4, help="executions allowed to wait for a slot")
+    parser.add_argument("--tests", type=int, default=25, help="tests in the sharded suite")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="shards the suite is split across")
+    args = parser.parse_args()
+
+    print("=" * 78)
+    print(f"Median latency of small snippets ({args.runs} sequential runs each)")
+    print("=" * 78)
+    print(f"  {'snippet':<12} {'fresh interpreter':>18} {'warm zygote':>12} {'speedup':>8}")
+    for name, (fresh, warm) in asyncio.run(measure_latency(args.runs)).items():
+        print(f"  {name:<12} {fresh * 1000:>16.1f}ms {warm * 1000:>10.1f}ms {fresh / warm:>7.1f}x")
+
+    print()
+    print("=" * 78)
+    print(f"{args.concurrency} concurrent executions of a {args.seconds}s script on one event loop")
+    print("=" * 78)
+    print(f"  {'implementation':<32} {'wall':>9} {'succeeded':>10} {'max loop stall':>15}")
+    for label, execute in (("blocking Popen.communicate", blocking_execute),
+                           ("execute_code (warm zygotes)", CodeExecutor.execute_code)):
+        r = asyncio.run(measure(execute, args.concurrency, args.seconds))
+        print(f"  {label:<32} {r['wall']:>8.2f}s {r['ok']:>6}/{args.concurrency:<3} {r['max_lag'] * 1000:>13.1f}ms")
+
+    print()
+    print("=" * 78)
+    print(f"Burst of {args.burst} scripts using {args.cpu_seconds}s of CPU each, {os.cpu_count()} CPUs")
+    print("=" * 78)
+    print(f"  {'mode':<28} {'completed':>9} {'p50':>8} {'max':>8} {'refused':>8} {'refused in':>11}")
+    for label, queue in (("unbounded", None), (f"admission (queue {args.queue})", args.queue)):
+        r = asyncio.run(measure_burst(args.burst, args.cpu_seconds, queue))
+        refused_in = f"{r['refused_max'] * 1000:.1f}ms" if r["refused_max"] is not None else "-"
+        print(f"  {label:<28} {r['completed']:>9} {r['p50']:>7.2f}s {r['max']:>7.2f}s {r['refused']:>8} {refused_in:>11}")
+
+    print()
+    print("=" * 78)
+    print(f"run_tests on {args.tests} CPU-bound tests, {os.cpu_count()} CPUs")
+    print("=" * 78)
+    print(f"  {'mode':<28} {'wall':>8} {'test total':>11} {'passed':>8}")
+    for label, workers in (("one process", 1), (f"{args.workers} shards", args.workers)):
+        r = asyncio.run(measure_tests(args.tests, workers))
+        print(f"  {label:<28} {r['wall']:>7.2f}s {r['total']:>10.2f}s {r['passed']:>5}/{args.tests:<3}")
+
+    print("\nTimeout kills the whole process group")
+    ok = asyncio.run(check_timeout_cleanup())
+    print(f"  {'ok' if ok else 'FAIL'}")
+    if not ok:
+        sys.exit(1)
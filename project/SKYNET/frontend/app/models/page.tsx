@@ -7,6 +7,7 @@ import {
   Sparkles, CheckCircle, XCircle, Clock, MessageSquareText
 } from 'lucide-react';
 import ChatHistory from '../../components/ChatHistory'; // Import ChatHistory component
+import { fetchAllPages } from '../../lib/pagination';
 
 interface Model {
   id: string;
@@ -43,24 +44,21 @@ export default function ModelsPage() {
 
   const fetchModels = async () => {
     try {
-      const response = await fetch('/api/models');
-      if (response.ok) {
-        let data: Model[] = await response.json();
-        console.log('Raw models data from API:', data); // Log raw data
-
-        // Simulate requires_paid_api for demonstration with more specific models
-        data = data.map(model => {
-          const lowerCaseName = model.name.toLowerCase();
-          const isPaid = lowerCaseName.includes('gpt-4') ||
-                         lowerCaseName.includes('claude-3-opus') ||
-                         lowerCaseName.includes('claude-3-5-sonnet') ||
-                         lowerCaseName.includes('gemini-2.0-flash-exp'); // Assuming Gemini 2.0 is also paid
-          return {
-            ...model,
-            requires_paid_api: isPaid
-          };
-        });
-      }
+      let data = await fetchAllPages<Model>('/api/models');
+      console.log('Raw models data from API:', data); // Log raw data
+
+      // Simulate requires_paid_api for demonstration with more specific models
+      data = data.map(model => {
+        const lowerCaseName = model.name.toLowerCase();
+        const isPaid = lowerCaseName.includes('gpt-4') ||
+                       lowerCaseName.includes('claude-3-opus') ||
+                       lowerCaseName.includes('claude-3-5-sonnet') ||
+                       lowerCaseName.includes('gemini-2.0-flash-exp'); // Assuming Gemini 2.0 is also paid
+        return {
+          ...model,
+          requires_paid_api: isPaid
+        };
+      });
     } catch (error) {
       console.error('Failed to fetch models:', error);
     } finally {
@@ -1,6 +1,6 @@
 'use client';
 
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useRouter } from 'next/navigation';
 import {
   Brain, Send, Upload, Settings, Plus, X, Loader2,
@@ -8,6 +8,7 @@ import {
   ChevronDown, FileText, Cpu, Zap, Home, History as HistoryIcon
 } from 'lucide-react';
 import ChatHistory from '@/components/ChatHistory';
+import { fetchAllPages } from '@/lib/pagination';
 
 interface Model {
   id: string;
@@ -42,6 +43,8 @@ export default function Playground() {
   const [modelHealthStatus, setModelHealthStatus] = useState<Record<string, boolean>>({});
   const [checkingModels, setCheckingModels] = useState(false);
   const [sessionId, setSessionId] = useState<string>(() => Date.now().toString());
+  // Number of messages the server has stored for this session (next expected_seq)
+  const savedCount = useRef(0);
   const [showHistory, setShowHistory] = useState(false);
 
   useEffect(() => {
@@ -87,16 +90,9 @@ export default function Playground() {
 
   const fetchModels = async () => {
     try {
-      const response = await fetch('/api/models');
-      if (response.ok) {
-        const allModels = await response.json();
-        console.log('Fetched models:', allModels);
-        setModels(allModels);
-      } else {
-        console.error('Failed to fetch models, status:', response.status);
-        const errorText = await response.text();
-        console.error('Error response:', errorText);
-      }
+      const allModels = await fetchAllPages('/api/models');
+      console.log('Fetched models:', allModels);
+      setModels(allModels);
     } catch (error) {
       console.error('Failed to fetch models:', error);
     }
@@ -231,31 +227,55 @@ export default function Playground() {
     }
   };
 
+  const toStoredMessage = (m: Message) => ({
+    role: m.role,
+    content: m.content,
+    timestamp: m.timestamp.toISOString()
+  });
+
   const saveChatHistory = async (messagesToSave: Message[]) => {
-    if (!selectedModel || messagesToSave.length === 0) return;
+    const expectedSeq = savedCount.current;
+    const pending = messagesToSave.slice(expectedSeq);
+    if (!selectedModel || pending.length === 0) return;
 
     try {
-      await fetch('/api/chat-history', {
+      // Send only the messages added since the last save
+      const response = await fetch(`/api/chat-history/${sessionId}/messages`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
-          session_id: sessionId,
+          expected_seq: expectedSeq,
           model_id: selectedModel.id,
           model_name: selectedModel.name,
-          messages: messagesToSave.map(m => ({
-            role: m.role,
-            content: m.content,
-            timestamp: m.timestamp.toISOString()
-          })),
-          title: messagesToSave[0]?.content.slice(0, 50) || 'New Chat'
+          messages: pending.map(toStoredMessage),
+          title: expectedSeq === 0 ? messagesToSave[0]?.content.slice(0, 50) || 'New Chat' : undefined
         })
       });
+
+      if (response.status === 409) {
+        // Out of sync with the server (e.g. another tab): resync with one full save
+        await fetch('/api/chat-history', {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({
+            session_id: sessionId,
+            model_id: selectedModel.id,
+            model_name: selectedModel.name,
+            messages: messagesToSave.map(toStoredMessage),
+            title: messagesToSave[0]?.content.slice(0, 50) || 'New Chat'
+          })
+        });
+        savedCount.current = messagesToSave.length;
+      } else if (response.ok) {
+        savedCount.current = (await response.json()).seq;
+      }
     } catch (err) {
       console.error('Error saving chat history:', err);
     }
   };
 
   const loadChat = (loadedSessionId: string, loadedMessages: any[]) => {
+    savedCount.current = loadedMessages.length;
     setSessionId(loadedSessionId);
     setMessages(
       loadedMessages.map((m: any) => ({
@@ -268,6 +288,7 @@ export default function Playground() {
   };
 
   const startNewChat = () => {
+    savedCount.current = 0;
     setSessionId(Date.now().toString());
     setMessages([]);
   };
@@ -25,6 +25,8 @@ export default function ChatInterface() {
   const [showHistory, setShowHistory] = useState(false)
   const [selectedModel, setSelectedModel] = useState('Test Model')
   const messagesEndRef = useRef<HTMLDivElement>(null)
+  // Number of messages the server has stored for this session (next expected_seq)
+  const savedCount = useRef(0)
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' })
@@ -40,31 +42,59 @@ export default function ChatInterface() {
     }
   }, [messages])
 
+  const toStoredMessage = (m: Message) => ({
+    role: m.role,
+    content: m.content,
+    timestamp: m.timestamp.toISOString()
+  })
+
   const saveChatHistory = async () => {
+    const expectedSeq = savedCount.current
+    const pending = messages.slice(expectedSeq)
+    if (pending.length === 0) return
+
     try {
-      await fetch('http://localhost:8000/api/chat-history', {
+      // Send only the messages added since the last save
+      const response = await fetch(`http://localhost:8000/api/chat-history/${sessionId}/messages`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json'
         },
         body: JSON.stringify({
-          session_id: sessionId,
+          expected_seq: expectedSeq,
           model_id: null,
           model_name: selectedModel,
-          messages: messages.map(m => ({
-            role: m.role,
-            content: m.content,
-            timestamp: m.timestamp.toISOString()
-          })),
-          title: messages[0]?.content.slice(0, 50) || 'New Chat'
+          messages: pending.map(toStoredMessage),
+          title: expectedSeq === 0 ? messages[0]?.content.slice(0, 50) || 'New Chat' : undefined
         })
       })
+
+      if (response.status === 409) {
+        // Out of sync with the server (e.g. another tab): resync with one full save
+        await fetch('http://localhost:8000/api/chat-history', {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json'
+          },
+          body: JSON.stringify({
+            session_id: sessionId,
+            model_id: null,
+            model_name: selectedModel,
+            messages: messages.map(toStoredMessage),
+            title: messages[0]?.content.slice(0, 50) || 'New Chat'
+          })
+        })
+        savedCount.current = messages.length
+      } else if (response.ok) {
+        savedCount.current = (await response.json()).seq
+      }
     } catch (err) {
       console.error('Error saving chat history:', err)
     }
   }
 
   const loadChat = (loadedSessionId: string, loadedMessages: any[]) => {
+    savedCount.current = loadedMessages.length
     setSessionId(loadedSessionId)
     setMessages(
       loadedMessages.map((m: any) => ({
@@ -78,6 +108,7 @@ export default function ChatInterface() {
   }
 
   const startNewChat = () => {
+    savedCount.current = 0
     setSessionId(Date.now().toString())
     setMessages([
       {
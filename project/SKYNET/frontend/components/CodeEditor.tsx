@@ -3,6 +3,7 @@
 import { useState, useRef, useEffect } from 'react'
 import Editor from '@monaco-editor/react'
 import { useStore } from '@/lib/store'
+import { fetchAllPages } from '@/lib/pagination'
 import { Play, Save, Share2, FileUp, BarChart3, FlaskConical, CheckCircle, XCircle, Sparkles, Send, Loader2 } from 'lucide-react'
 import CodeAnalysisSidebar from './CodeAnalysisSidebar'
 
@@ -35,16 +36,13 @@ export default function CodeEditor() {
       const response = await fetch('http://localhost:8000/llm/api-keys')
       if (response.ok) {
         const apiKeys = await response.json()
-        const modelsResponse = await fetch('http://localhost:8000/models/list')
-        if (modelsResponse.ok) {
-          const models = await modelsResponse.json()
-          const filteredModels = models.filter((m: any) =>
-            apiKeys.some((key: any) => key.provider === m.provider && key.is_active)
-          )
-          setAvailableModels(filteredModels)
-          if (filteredModels.length > 0 && !selectedAiModel) {
-            setSelectedAiModel(filteredModels[0].id)
-          }
+        const models = await fetchAllPages('http://localhost:8000/models/list?view=summary')
+        const filteredModels = models.filter((m: any) =>
+          apiKeys.some((key: any) => key.provider === m.provider && key.is_active)
+        )
+        setAvailableModels(filteredModels)
+        if (filteredModels.length > 0 && !selectedAiModel) {
+          setSelectedAiModel(filteredModels[0].id)
         }
       }
     } catch (err) {
@@ -0,0 +1,20 @@
+// List endpoints return one page per request and put the next page's cursor
+// in the X-Next-Cursor header; there is no header on the last page.
+export const NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+export async function fetchAllPages<T = any>(url: string, init?: RequestInit): Promise<T[]> {
+  const items: T[] = []
+  let cursor: string | null = null
+  do {
+    const pageUrl: string = cursor
+      ? `${url}${url.includes('?') ? '&' : '?'}cursor=${encodeURIComponent(cursor)}`
+      : url
+    const response = await fetch(pageUrl, init)
+    if (!response.ok) {
+      throw new Error(`${pageUrl} returned ${response.status}: ${await response.text()}`)
+    }
+    items.push(...(await response.json()))
+    cursor = response.headers.get(NEXT_CURSOR_HEADER)
+  } while (cursor)
+  return items
+}
@@ -1,16 +1,218 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
+import asyncio
 import subprocess
 import sys
 import os
 import importlib.util
-from typing import Any, Dict
+import json
+import shutil
+import signal
+import tempfile
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
 
 app = FastAPI(title="LLM Sandbox")
 
+# Limits for every process the sandbox runs; 0 disables one
+# Address space in MB; torch and transformers reserve a lot of it on import
+SANDBOX_MAX_MEMORY_MB = int(os.getenv("SANDBOX_MAX_MEMORY_MB", "4096"))
+# CPU seconds before SIGXCPU
+SANDBOX_MAX_CPU_SECONDS = int(os.getenv("SANDBOX_MAX_CPU_SECONDS", "60"))
+# Largest file a run may write, in MB
+SANDBOX_MAX_FILE_SIZE_MB = int(os.getenv("SANDBOX_MAX_FILE_SIZE_MB", "64"))
+# Processes llmuser may have, the server's own included, before a fork fails
+SANDBOX_MAX_PROCESSES = int(os.getenv("SANDBOX_MAX_PROCESSES", "128"))
+# Bytes of stdout and of stderr kept per run; beyond that the middle is dropped
+SANDBOX_MAX_OUTPUT_BYTES = int(os.getenv("SANDBOX_MAX_OUTPUT_BYTES", str(1024 * 1024)))
+# Seconds a /test pytest run may take
+SANDBOX_TEST_TIMEOUT = int(os.getenv("SANDBOX_TEST_TIMEOUT", "120"))
+
+# Runs executing at once; further requests wait for one to finish
+SANDBOX_MAX_CONCURRENCY = int(os.getenv("SANDBOX_MAX_CONCURRENCY", str(os.cpu_count() or 2)))
+# Each request gets a fresh directory under this one, removed when it is done
+SANDBOX_WORKSPACE_ROOT = os.getenv("SANDBOX_WORKSPACE_ROOT", tempfile.gettempdir())
+
+class ExecutionLimits(BaseModel):
+    """Limits a caller asks for; each is capped at the SANDBOX_MAX_* value, and 0 means that maximum"""
+    memory_mb: int = 0
+    cpu_seconds: int = 0
+    file_size_mb: int = 0
+    processes: int = 0
+    output_bytes: int = 0
+
+    def capped(self) -> "ExecutionLimits":
+        def cap(requested: int, maximum: int) -> int:
+            if not requested or not maximum:
+                return requested or maximum
+            return min(requested, maximum)
+
+        return ExecutionLimits(
+            memory_mb=cap(self.memory_mb, SANDBOX_MAX_MEMORY_MB),
+            cpu_seconds=cap(self.cpu_seconds, SANDBOX_MAX_CPU_SECONDS),
+            file_size_mb=cap(self.file_size_mb, SANDBOX_MAX_FILE_SIZE_MB),
+            processes=cap(self.processes, SANDBOX_MAX_PROCESSES),
+            output_bytes=cap(self.output_bytes, SANDBOX_MAX_OUTPUT_BYTES)
+        )
+
+    def rlimits(self) -> Dict[str, List[int]]:
+        """(soft, hard) per resource.RLIMIT_* name, for LIMITS_LAUNCHER"""
+        rlimits = {"RLIMIT_CORE": [0, 0]}
+        if self.memory_mb:
+            rlimits["RLIMIT_AS"] = [self.memory_mb * 1024 * 1024] * 2
+        if self.cpu_seconds:
+            rlimits["RLIMIT_CPU"] = [self.cpu_seconds, self.cpu_seconds + 1]
+        if self.file_size_mb:
+            rlimits["RLIMIT_FSIZE"] = [self.file_size_mb * 1024 * 1024] * 2
+        if self.processes:
+            rlimits["RLIMIT_NPROC"] = [self.processes] * 2
+        return rlimits
+
+# `python -c LIMITS_LAUNCHER <rlimits> <args...>` sets the rlimits on itself and
+# execs args, which keep them. The limits are applied in the child's own
+# interpreter rather than in a preexec_fn, which is not safe to run in a
+# threaded server between fork and exec.
+LIMITS_LAUNCHER = """
+import json, os, resource, sys
+for name, (soft, hard) in json.loads(sys.argv[1]).items():
+    resource.setrlimit(getattr(resource, name), (soft, hard))
+os.execvp(sys.argv[2], sys.argv[2:])
+"""
+
+class OutputBuffer:
+    """The first and last limit / 2 bytes of a stream, with the middle counted and dropped"""
+
+    def __init__(self, limit: int = SANDBOX_MAX_OUTPUT_BYTES):
+        self.head_size = limit // 2 if limit else sys.maxsize
+        self.tail_size = limit - limit // 2
+        self.head = bytearray()
+        self.tail: "deque[bytes]" = deque()
+        self.tail_bytes = 0
+        self.total = 0
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > len(self.head) + self.tail_bytes
+
+    def write(self, data: bytes):
+        self.total += len(data)
+        room = self.head_size - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail.append(data)
+            self.tail_bytes += len(data)
+            while self.tail_bytes - len(self.tail[0]) >= self.tail_size:
+                self.tail_bytes -= len(self.tail.popleft())
+
+    def getvalue(self) -> str:
+        tail = b"".join(self.tail)
+        if not self.truncated:
+            return (bytes(self.head) + tail).decode(errors="replace")
+        tail = tail[-self.tail_size:]
+        dropped = self.total - len(self.head) - len(tail)
+        return (
+            self.head.decode(errors="replace")
+            + f"\n... [{dropped:,} bytes truncated] ...\n"
+            + tail.decode(errors="replace")
+        )
+
+def limit_exceeded(returncode: int, stderr: str, timed_out: bool, truncated: bool) -> Optional[str]:
+    """"timeout", "cpu_time", "memory", "file_size" or "processes" when that ended the run, "output" when only its output was cut"""
+    if timed_out:
+        return "timeout"
+    if returncode == -signal.SIGXCPU:
+        return "cpu_time"
+    if returncode == -signal.SIGXFSZ:
+        return "file_size"
+    if returncode != 0:
+        # Python ignores SIGXFSZ and turns the other limits into exceptions; the last one is the cause
+        last_error = stderr[-1024:]
+        if "MemoryError" in last_error:
+            return "memory"
+        if "File too large" in last_error:
+            return "file_size"
+        if "BlockingIOError: [Errno 11]" in last_error:
+            return "processes"
+    return "output" if truncated else None
+
+def kill_group(pid: int):
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+async def drain(pipe: asyncio.StreamReader, buffer: OutputBuffer):
+    while True:
+        chunk = await pipe.read(64 * 1024)
+        if not chunk:
+            return
+        buffer.write(chunk)
+
+async def run_limited(args: List[str], timeout: float, cwd: str, limits: ExecutionLimits) -> Dict[str, Any]:
+    """Run args under limits in its own process group, reading output as it is written"""
+    started = time.monotonic()
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", LIMITS_LAUNCHER, json.dumps(limits.rlimits()), *args,
+        cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        start_new_session=True
+    )
+    stdout, stderr = OutputBuffer(limits.output_bytes), OutputBuffer(limits.output_bytes)
+    readers = asyncio.gather(drain(proc.stdout, stdout), drain(proc.stderr, stderr))
+    timed_out = False
+    try:
+        await asyncio.wait_for(proc.wait(), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+    finally:
+        # Also kills background children left by a clean exit, which would keep the pipes open
+        kill_group(proc.pid)
+        await proc.wait()
+        done, _ = await asyncio.wait({readers}, timeout=1)
+        if not done:
+            readers.cancel()  # something left the group and still holds a pipe
+
+    return {
+        "returncode": proc.returncode,
+        "stdout": stdout.getvalue(),
+        "stderr": stderr.getvalue(),
+        "execution_time": time.monotonic() - started,
+        "limit_exceeded": limit_exceeded(
+            proc.returncode, stderr.getvalue(), timed_out, stdout.truncated or stderr.truncated
+        )
+    }
+
+slots = asyncio.Semaphore(SANDBOX_MAX_CONCURRENCY)
+load = {"running": 0, "waiting": 0}
+
+@asynccontextmanager
+async def workspace() -> AsyncIterator[str]:
+    """A fresh directory for one request, entered once one of SANDBOX_MAX_CONCURRENCY slots is free"""
+    load["waiting"] += 1
+    try:
+        await slots.acquire()
+    finally:
+        load["waiting"] -= 1
+    load["running"] += 1
+    try:
+        path = tempfile.mkdtemp(prefix="run-", dir=SANDBOX_WORKSPACE_ROOT)
+        try:
+            yield path
+        finally:
+            await asyncio.to_thread(shutil.rmtree, path, ignore_errors=True)
+    finally:
+        load["running"] -= 1
+        slots.release()
+
 class CodeExecutionRequest(BaseModel):
     code: str
     timeout: int = 30
+    limits: ExecutionLimits = ExecutionLimits()
+    # Return what the script wrote to "<script>.report.json" (the backend's test runner)
+    report: bool = False
 
 class TestRequest(BaseModel):
     test_code: str
@@ -20,21 +222,35 @@ class TestRequest(BaseModel):
 async def execute_code(request: CodeExecutionRequest):
     """Execute Python code safely in sandbox"""
     try:
-        # Write code to temporary file
-        with open("/tmp/temp_code.py", "w") as f:
-            f.write(request.code)
-        
-        # Execute with timeout and resource limits
-        result = subprocess.run([
-            "timeout", str(request.timeout),
-            "python", "/tmp/temp_code.py"
-        ], capture_output=True, text=True, cwd="/home/llmuser/workspace")
+        async with workspace() as path:
+            # Write code to this request's workspace
+            with open(os.path.join(path, "temp_code.py"), "w") as f:
+                f.write(request.code)
+            
+            # Execute with timeout and resource limits
+            limits = request.limits.capped()
+            result = await run_limited(["python", "temp_code.py"], request.timeout, path, limits)
+            report = None
+            report_path = os.path.join(path, "temp_code.py.report.json")
+            if request.report and os.path.exists(report_path):
+                if not limits.output_bytes or os.path.getsize(report_path) <= limits.output_bytes:
+                    try:
+                        with open(report_path) as f:
+                            report = json.load(f)
+                    except ValueError:
+                        pass  # the script wrote something else there
+        error = result["stderr"]
+        if result["limit_exceeded"] == "timeout":
+            error += f"Execution timeout ({request.timeout} seconds)"
         
         return {
-            "success": result.returncode == 0,
-            "output": result.stdout,
-            "error": result.stderr,
-            "return_code": result.returncode
+            "success": result["returncode"] == 0,
+            "output": result["stdout"],
+            "error": error,
+            "return_code": result["returncode"],
+            "execution_time": result["execution_time"],
+            "limit_exceeded": result["limit_exceeded"],
+            "report": report
         }
         
     except Exception as e:
@@ -42,30 +258,33 @@ async def execute_code(request: CodeExecutionRequest):
             "success": False,
             "output": None,
             "error": str(e),
-            "return_code": -1
+            "return_code": -1,
+            "limit_exceeded": None
         }
 
 @app.post("/test")
 async def run_tests(request: TestRequest):
     """Run tests on model wrapper"""
     try:
-        # Save model wrapper
-        with open("/tmp/model_wrapper.py", "w") as f:
-            f.write(request.model_wrapper)
-        
-        # Save test code
-        with open("/tmp/test_model.py", "w") as f:
-            f.write(request.test_code)
-        
-        # Run tests
-        result = subprocess.run([
-            "python", "-m", "pytest", "/tmp/test_model.py", "-v"
-        ], capture_output=True, text=True)
+        async with workspace() as path:
+            # Save model wrapper
+            with open(os.path.join(path, "model_wrapper.py"), "w") as f:
+                f.write(request.model_wrapper)
+            
+            # Save test code
+            with open(os.path.join(path, "test_model.py"), "w") as f:
+                f.write(request.test_code)
+            
+            # Run tests
+            result = await run_limited(
+                ["python", "-m", "pytest", "test_model.py", "-v"], SANDBOX_TEST_TIMEOUT, path, ExecutionLimits().capped()
+            )
         
         return {
-            "success": result.returncode == 0,
-            "output": result.stdout,
-            "error": result.stderr
+            "success": result["returncode"] == 0,
+            "output": result["stdout"],
+            "error": result["stderr"],
+            "limit_exceeded": result["limit_exceeded"]
         }
         
     except Exception as e:
@@ -77,4 +296,4 @@ async def run_tests(request: TestRequest):
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "llm-sandbox"}
\ No newline at end of file
+    return {"status": "healthy", "service": "llm-sandbox", "max_concurrency": SANDBOX_MAX_CONCURRENCY, **load}
\ No newline at end of file